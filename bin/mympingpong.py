@@ -37,19 +37,29 @@ import datetime
 import os
 import signal
 import sys
+import tempfile
 import time
-from itertools import permutations
 
 import h5py
 import numpy as n
 from mpi4py import MPI
 
-from vsc.mympingpong.pingpongers import PingPongSR
-from vsc.mympingpong.pairs import Pair
-from vsc.mympingpong.tools import hwlocmap
+from vsc.mympingpong.pingpongers import LATENCY_MODES, PingPongSR
+from vsc.mympingpong.checkpoint import NO_ROUND, Checkpoint
+from vsc.mympingpong.pairs import ADAPT_INTERVAL, IDLE, Pair
+from vsc.mympingpong.rawdata import RawBuffer
+from vsc.mympingpong.sparse import SPARSE_LAYOUT, failtocoo, tocoo
+from vsc.mympingpong.stats import PairStats, STATS_FIELDS
+from vsc.mympingpong.timers import PhaseTimer, calibrate
+from vsc.mympingpong.topology import DISTANCES, Topology, formathwloc, parsehwloc
+from vsc.mympingpong.tools import TOPOLOGY_BACKENDS, hwlocmapcached, parsesizes
 from vsc.utils.affinity import sched_getaffinity, sched_setaffinity
 
 
+# number of entries per chunk of the sparse datasets
+SPARSE_CHUNK = 65536
+
+
 class MyPingPong(object):
 
     def __init__(self, logger, it, num):
@@ -58,6 +68,22 @@ class MyPingPong(object):
         self.rngfilter = None
         self.mapfilter = None
         self.pairmode = None
+        self.concurrency = None
+        self.schedule = 'local'
+        self.compareschedule = False
+        self.adaptinterval = ADAPT_INTERVAL
+        self.distances = None
+        self.topology = None
+        # write the pair matrices in the sparse layout (see vsc.mympingpong.sparse)
+        self.sparse = False
+        # the names of all nodes, and the node id and core of every rank (set in makecpumap)
+        self.nodenames = None
+        self.rankinfo = None
+        # directory of the per node hwloc cache (None is the default temporary directory, '' disables it)
+        self.hwloccache = None
+        self.topologybackend = 'auto'
+        # the pair generator, set in setup
+        self.pair = None
 
         self.fn = None
 
@@ -65,27 +91,152 @@ class MyPingPong(object):
         self.name = MPI.Get_processor_name()
         self.size = self.comm.Get_size()
         self.rank = self.comm.Get_rank()
-        self.core = self.setrankaffinity()
+
+        # wall time per phase of this rank
+        self.phases = PhaseTimer()
+
+        with self.phases.timed('affinity'):
+            # the ranks on the same node (sharing memory), ordered by rank
+            self.nodecomm = self.comm.Split_type(MPI.COMM_TYPE_SHARED, key=self.rank)
+            self.core = self.setrankaffinity()
+        # time spent exchanging the rank metadata, after the topology discovery (see makecpumap)
+        self.startuptime = 0
 
         self.it = it
         self.nr = num
+        # untimed pingpongs before the timed ones, for every pair and messagesize
+        self.warmup = 0
 
         self.outputfile = None
+        self.raw = None
+        self.timer = 'wtime'
+        # periodic checkpoints, and resume from them (see setcheckpoint)
+        self.checkpoint = None
+        self.resume = False
 
         self.abortsignal = False
+        # buffers for the non-blocking abort check: [abort, elapsed time]
+        self.abortsend = n.zeros(2, float)
+        self.abortrecv = n.zeros(2, float)
+        self.abortreq = None
 
         signal.signal(signal.SIGUSR1, self.abort)
 
     def setfilename(self, directory, msg):
-        """generate a filename for the outputfile"""
+        """generate a filename for the outputfile (msg is a messagesize or a list of messagesizes)"""
         timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S') if self.rank == 0 else None
         timestamp = self.comm.bcast(timestamp, root=0)
 
         name = self.name if self.rank == 0 else None
         name = self.comm.bcast(name, root=0)
 
+        if isinstance(msg, list):
+            msg = '-'.join(['%07d' % x for x in sorted(set([min(msg), max(msg)]))])
+        else:
+            msg = '%07d' % msg
+
         args = (directory, name, self.size, msg, self.nr, self.it, timestamp)
-        self.fn = '%s/PP%s-%03d-msg%07dB-nr%05d-it%05d-%s.h5' % args
+        self.fn = '%s/PP%s-%03d-msg%sB-nr%05d-it%05d-%s.h5' % args
+
+    def setraw(self, capacity):
+        """record the timing of every group in a per-rank file, buffering capacity groups in memory"""
+        rawfn = '%s-raw%05d.h5' % (os.path.splitext(self.fn)[0], self.rank)
+        self.raw = RawBuffer(rawfn, capacity=capacity, logger=self.log)
+        self.log.debug("setraw: raw timings will be written to %s", rawfn)
+
+    def setcheckpoint(self, interval, resume=None):
+        """
+        write a per-rank checkpoint every interval rounds (0 disables),
+        resume is the prefix of the checkpoints of an interrupted run to resume from
+        (the name of its outputfile without extension), the checkpoints of this run use the same prefix
+        """
+        prefix = resume or os.path.splitext(self.fn)[0]
+        self.checkpoint = Checkpoint(prefix, self.rank, interval, logger=self.log)
+        self.resume = bool(resume)
+        self.log.debug("setcheckpoint: every %s rounds to %s (resume %s)", interval, prefix, self.resume)
+
+    def checkpointmeta(self, msgsizes, stats, pmode, bandwidth, bidirectional):
+        """
+        the settings that change the schedule or the measurements (after setup),
+        they have to be the same to resume from a checkpoint
+        """
+        return {
+            'totalranks': self.size,
+            'nr_tests': self.nr,
+            'seed': self.seed,
+            'pairmode': self.pairmode,
+            'rngfilter': str(self.rngfilter or ''),
+            'mapfilter': str(self.mapfilter or ''),
+            'schedule': self.schedule,
+            'concurrency': self.concurrency or [],
+            'distances': ','.join(self.pair.distances) if self.pairmode == 'distance' else '',
+            'adaptinterval': self.adaptinterval if self.pairmode == 'adaptive' else 0,
+            'iterations': self.it,
+            'warmup': self.warmup,
+            'msgsize': msgsizes,
+            'ppmode': pmode,
+            'timer': self.timer,
+            'bwwindow': bandwidth,
+            'bidirectional': bidirectional,
+            'stats': ','.join(sorted(stats)),
+        }
+
+    def resumecheckpoint(self, stats, fail, mypairs, meta):
+        """
+        restore the statistics, fail counts and schedule from the newest checkpoint that all ranks have
+        (collective: called by all ranks)
+
+        Returns the first round that still has to run (0 if there is no usable checkpoint)
+        """
+        rounds = n.array(self.comm.allgather(self.checkpoint.rounds()))
+        common = set(rounds[0])
+        for rankrounds in rounds[1:]:
+            common &= set(rankrounds)
+        common.discard(NO_ROUND)
+        if not common:
+            if self.rank == 0:
+                self.log.error("resumecheckpoint: no checkpoint of %s common to all ranks (rounds %s), "
+                               "starting from the first round", self.checkpoint.prefix, rounds.tolist())
+            self.restartcheckpoint()
+            return 0
+
+        nextround = max(common)
+        res = self.checkpoint.read(nextround, stats, meta)
+        if not self.comm.allreduce(res is not None, op=MPI.LAND):
+            if self.rank == 0:
+                self.log.error("resumecheckpoint: checkpoint of %s does not match the settings of this run, "
+                               "starting from the first round", self.checkpoint.prefix)
+            for sts in stats.values():
+                sts[:] = [PairStats(self.size) for _ in sts]
+            self.restartcheckpoint()
+            return 0
+
+        fail[self.rank] = res[0]
+        if res[1] is not None:
+            mypairs[:] = res[1]
+        if self.rank == 0:
+            self.log.info("resumecheckpoint: resuming from round %s of %s", nextround, self.nr)
+        return nextround
+
+    def setwarmup(self, warmup):
+        """do warmup untimed pingpongs before the timed ones, for every pair and messagesize"""
+        self.warmup = warmup
+
+    def restartcheckpoint(self):
+        """
+        a run that can't resume writes its checkpoints with the prefix of its own outputfile,
+        so the checkpoints of the interrupted run are not overwritten or removed
+        """
+        self.checkpoint = Checkpoint(os.path.splitext(self.fn)[0], self.rank, self.checkpoint.interval,
+                                     logger=self.log)
+
+    def setsparse(self, sparse=True):
+        """write the pair matrices in the sparse (coo) layout instead of dense matrices"""
+        self.sparse = sparse
+
+    def settimer(self, timer):
+        """set the timer used for the timings (see vsc.mympingpong.timers.TIMERS)"""
+        self.timer = timer
 
     def setpairmode(self, pairmode='shuffle', rngfilter=None, mapfilter=None):
         """set the pairmode, rngfilter and mapfilter for the pairgenerator """
@@ -94,25 +245,51 @@ class MyPingPong(object):
         self.mapfilter = mapfilter
         self.log.debug("pairmode: pairmode %s rngfilter %s mapfilter %s", pairmode, rngfilter, mapfilter)
 
+    def setschedule(self, schedule, compare=False):
+        """
+        set how the pairs are generated: local (every rank generates its own pairs)
+        or distributed (the pairs of every round are generated by one rank and exchanged)
+        with compare, the distributed schedule is also generated locally, to compare the time of both
+        """
+        self.schedule = schedule
+        self.compareschedule = compare
+
+    def setadaptinterval(self, interval):
+        """set the number of rounds between two steering steps of the adaptive pairmode"""
+        self.adaptinterval = max(interval, 2)
+
+    def sethwloccache(self, cachedir, backend='auto'):
+        """
+        set the directory of the hwloc cache and the backend that discovers the topology
+        (see vsc.mympingpong.tools.hwlocmapcached)
+        """
+        self.hwloccache = cachedir
+        self.topologybackend = backend
+
+    def setdistances(self, distances):
+        """set the distance classes the distance pairmode cycles over (see vsc.mympingpong.topology.DISTANCES)"""
+        self.distances = distances
+
+    def setconcurrency(self, levels):
+        """
+        set the number of pairs that pingpong at the same time, cycling over the levels every round
+        (0 or more than the number of pairs is all pairs)
+        """
+        nrpairs = (self.size + 1) // 2
+        self.concurrency = sorted(set([nrpairs if level <= 0 else min(level, nrpairs) for level in levels]))
+        self.log.debug("setconcurrency: levels %s", self.concurrency)
+
     def setrankaffinity(self):
         """pins the rank to an available core on its node"""
-        ranknodes = self.comm.alltoall([self.name] * self.size)
-        ranksonnode = [i for i, j in enumerate(ranknodes) if j == self.name]
-
         rankaffinity = sched_getaffinity()
         self.log.debug("affinity pre-set: %s", rankaffinity)
 
         cores = [i for i, j in enumerate(rankaffinity.cpus) if j == 1]
 
-        topin = None
-        for index, iterrank in enumerate(ranksonnode):
-            if iterrank == self.rank:
-                topin = cores[index % len(cores)]
-                self.log.debug("setting affinity to core: %s", topin)
-
-        if topin is None:
-            topin = cores[0]
-            self.log.warning("could not determine core to pin the rank to. automatically set it to %s", topin)
+        # the index of this rank among the ranks on its node
+        index = self.nodecomm.Get_rank()
+        topin = cores[index % len(cores)]
+        self.log.debug("setting affinity to core: %s", topin)
 
         rankaffinity.convert_hr_bits(str(topin))
         rankaffinity.set_bits()
@@ -142,6 +319,152 @@ class MyPingPong(object):
         alltoall = self.comm.alltoall(abortlist)
         return any(alltoall)
 
+    def startabortcheck(self, maxruntime, start):
+        """
+        start a (non-blocking) reduction over all ranks of the abort signal and the elapsed time.
+        the result is collected with finishabortcheck.
+        """
+        elapsed = time.time() - start
+        abort = self.abortsignal
+
+        if maxruntime and elapsed > maxruntime:
+            self.log.warning("maximum runtime was reached on rank %s", self.rank)
+            abort = True
+
+        self.abortsend[:] = (int(abort), elapsed)
+        if hasattr(self.comm, 'Iallreduce'):
+            self.abortreq = self.comm.Iallreduce(self.abortsend, self.abortrecv, op=MPI.MAX)
+        else:
+            # MPI-2 only
+            self.comm.Allreduce(self.abortsend, self.abortrecv, op=MPI.MAX)
+            self.abortreq = None
+
+    def finishabortcheck(self):
+        """
+        complete the reduction started by startabortcheck
+
+        returns True when any rank in the world has received the signal to abort,
+        and the maximum elapsed time over all ranks
+        """
+        if self.abortreq is not None:
+            self.abortreq.Wait()
+            self.abortreq = None
+        return self.abortrecv[0] > 0, self.abortrecv[1]
+
+    def nextabortcheck(self, runid, elapsed, abortinterval, aborttime, firstround=0):
+        """
+        determine the round of the next abort check: every abortinterval rounds,
+        or sooner when that would take more than aborttime seconds at the current rate.
+        elapsed is the time since firstround (the round a resumed run started from),
+        all ranks get the same result, since elapsed is reduced over all ranks.
+        """
+        interval = abortinterval
+        if aborttime and elapsed > 0:
+            interval = min(interval, int(aborttime * (runid - firstround) / elapsed))
+        return runid + max(interval, 1)
+
+    def abortcheckcost(self, maxruntime, start, nrchecks=5):
+        """
+        measure the time of the original blocking alltoall-barrier abort check
+        (the barrier before it is still done every round)
+        """
+        cost = 0
+        for _ in range(nrchecks):
+            self.comm.barrier()
+            begin = time.time()
+            self.alltoallabort(maxruntime, start)
+            self.comm.barrier()
+            cost += time.time() - begin
+        return cost / nrchecks
+
+    def calibrateloop(self, pptype, comm, other, nrloops=5):
+        """
+        best average zero-byte pingpong time of a pingponger of pptype with other on comm
+        (a pingponger with itself needs matching tags)
+        """
+        pp = PingPongSR.pingpongfactory(pptype, comm, other, self.log)
+        pp.settimer(self.timer)
+        if other == comm.Get_rank():
+            pp.tag2 = pp.tag1
+        pp.setdat(self.makedata(l=0))
+
+        best = n.inf
+        for _ in range(nrloops):
+            pp.dopingpong(self.it)
+            best = min(best, n.average(pp.timings()))
+        return best
+
+    def calibrate(self, pmodes=None):
+        """
+        measure the fixed overhead of every available latency pingpongmode, with zero-byte pingpongs
+        with self and between pairs of ranks on the same node
+
+        Returns the fastest pingpongmode (the same on all ranks) and a dictionary with
+        the overhead (self) and local latency of every pingpongmode, averaged over the ranks
+        """
+        if pmodes is None:
+            pmodes = LATENCY_MODES
+
+        # all ranks have to agree on the modes that are tested
+        usable = n.array([PingPongSR.available(pmode, MPI.COMM_SELF, self.log) for pmode in pmodes], int)
+        self.comm.Allreduce(MPI.IN_PLACE, usable, op=MPI.MIN)
+        pmodes = [pmode for pmode, ok in zip(pmodes, usable) if ok]
+        self.log.debug("calibrate: available pingpongmodes %s", pmodes)
+
+        # pairs of ranks on the same node: local rank 2k with 2k+1
+        nodecomm = self.nodecomm
+        nodesize = nodecomm.Get_size()
+        noderank = nodecomm.Get_rank()
+        other = noderank ^ 1
+        if other >= nodesize:
+            other = None
+
+        overheads = []
+        for pmode in pmodes:
+            selfloop = self.calibrateloop('SR' + pmode, MPI.COMM_SELF, 0)
+            local = 0
+            if other is not None:
+                pptype = 'SR' if noderank < other else 'RS'
+                local = self.calibrateloop(pptype + pmode, nodecomm, other)
+            overheads.append([selfloop, local, int(other is not None)])
+
+        totals = n.array(overheads, float).reshape(len(pmodes), 3)
+        self.comm.Allreduce(MPI.IN_PLACE, totals, op=MPI.SUM)
+        calib = {}
+        for pmode, (selfloop, local, nrlocal) in zip(pmodes, totals):
+            name = pmode or 'plain'
+            calib['ppoverhead_%s' % name] = selfloop / self.size
+            calib['pplocal_%s' % name] = local / nrlocal if nrlocal else 0
+
+        # fastest between local pairs, or with self if there are none
+        index = 1 if totals[0][2] else 0
+        best = pmodes[int(n.argmin(totals[:, index]))]
+        self.log.debug("calibrate: overhead and local latency %s, selected %s", calib, best or 'plain')
+
+        return best, calib
+
+    def calibratetimer(self):
+        """
+        measure the overhead and resolution of the timer on every rank
+
+        Returns a dictionary with the worst overhead, resolution and tick over all ranks,
+        the tick of MPI.Wtime and if MPI.Wtime is synchronised between all ranks
+        """
+        calib = calibrate(self.timer)
+        worst = n.array([calib['overhead'], calib['resolution'], calib['tick']])
+        self.comm.Allreduce(MPI.IN_PLACE, worst, op=MPI.MAX)
+
+        attrs = {
+            'timer': self.timer,
+            'timer_overhead': worst[0],
+            'timer_resolution': worst[1],
+            'timer_tick': worst[2],
+            'wtick': MPI.Wtick(),
+            'wtime_is_global': bool(self.comm.Get_attr(MPI.WTIME_IS_GLOBAL)),
+        }
+        self.log.debug("calibratetimer: %s", attrs)
+        return attrs
+
     def makedata(self, l=1024):
         """create data with size l (in Bytes)"""
         return array.array('b', b'\0' * l)
@@ -155,32 +478,61 @@ class MyPingPong(object):
         MPI processor name, pinned core, [socket-id, core-id, absolute Processor Unit ID of core]
         """
 
-        hwloc = hwlocmap()
+        begin = time.time()
+        leader = self.nodecomm.Get_rank() == 0
+
+        # only one rank per node runs hwloc (or reads the cache), and shares it with the other ranks on its node
+        hwloc = None
+        if leader:
+            hwloc = hwlocmapcached(self.hwloccache, backend=self.topologybackend)
+            self.log.debug("makecpumap: hwlocmap of %s PUs in %.3f s", len(hwloc), time.time() - begin)
+
+        # the other ranks wait for the topology discovery of their leader, which is not part of the exchange
+        self.comm.barrier()
+        begin = time.time()
+        # the table of the names of all nodes is gathered by the node leaders (the index is the node id)
+        leadercomm = self.comm.Split(0 if leader else MPI.UNDEFINED, key=self.rank)
+        names = None
+        if leader:
+            names = leadercomm.allgather(self.name)
+            leadercomm.Free()
+        hwloc, names = self.nodecomm.bcast((hwloc, names), root=0)
+
         prop = None
         try:
             prop = hwloc[int(self.core)]
         except KeyError as err:
-            # it's important to continue, due to alltoall
+            # it's important to continue, due to allgather
             # (if one rank has issues, comm should still complete)
             self.log.error("makecpumap: failed to get hwloc info: map %s, err %s", hwloc, err)
 
-        pc = "core_%s" % self.core
-        ph = "hwloc_%s" % prop
-        self.log.debug("makecpumap: found property core %s hwloc %s", pc, ph)
+        # every rank sends a fixed number of ints: node id, core and the ids of the hwloc property (-1 if unknown)
+        myinfo = n.array([names.index(self.name), int(self.core)] + list(parsehwloc(prop)), int)
+        allinfo = n.empty((self.size, myinfo.size), int)
+        self.comm.Allgather(myinfo, allinfo)
+
+        self.nodenames = names
+        self.rankinfo = allinfo[:, :2]
 
-        myinfo = [self.name, pc, ph]
-        mymap = [myinfo] * self.size
-        alltoall = self.comm.alltoall(mymap)
-        self.log.debug("Received map %s", alltoall)
+        cpumap = []
+        for info in allinfo.tolist():
+            ph = "hwloc_%s" % (formathwloc(*info[2:]) if max(info[2:]) >= 0 else None)
+            cpumap.append([names[info[0]], "core_%s" % info[1], ph])
+        self.log.debug("Received map %s", cpumap)
 
-        return alltoall
+        self.startuptime = self.comm.allreduce(time.time() - begin, op=MPI.MAX)
+        if self.rank == 0:
+            self.log.info("makecpumap: ranks of %s nodes exchanged in %.3f s", len(names), self.startuptime)
 
-    def setup(self, seed, cpumap):
+        return cpumap
+
+    def setup(self, seed, cpumap, msgsizes):
         """
         Set up all variables necessary for running PingPong
 
         Returns a dictionary with global attributes, a list of pairs for pingponging with and
-        a data array for storing outputdata
+        a dictionary that maps the name of the output dataset to a list with a PairStats instance per messagesize
+        for accumulating the timings per partner
         """
 
         if self.nr is None:
@@ -201,68 +553,298 @@ class MyPingPong(object):
             self.log.error("Failed to create pair instance %s: %s", self.pairmode, err)
         pair.setcpumap(cpumap, self.rngfilter, self.mapfilter)
         pair.setnr(self.nr)
-        mypairs = pair.makepairs()
+        if self.concurrency:
+            pair.setconcurrency(self.concurrency)
+        if self.pairmode == 'adaptive':
+            pair.setinterval(self.adaptinterval)
+        if self.pairmode == 'distance' and self.distances:
+            pair.setdistances(self.distances)
+        self.pair = pair
+        self.topology = Topology.fromcpumap(cpumap)
+
+        if self.pairmode == 'roundrobin' and self.rank == 0:
+            # with an odd number of ranks, one rank is idle every round
+            cycle = 2 * (self.size + self.size % 2 - 1)
+            if self.nr % cycle:
+                self.log.warning("setup: %s rounds is not a multiple of %s, not all pairs get the same number "
+                                 "of samples", self.nr, cycle)
+
+        begin = time.time()
+        if self.schedule == 'distributed':
+            mypairs = pair.makepairsdistributed(self.comm)
+        else:
+            mypairs = pair.makepairs()
+        self.phases.add('schedule', time.time() - begin)
+        scheduletime = self.comm.allreduce(time.time() - begin, op=MPI.MAX)
+        if self.rank == 0:
+            self.log.info("setup: %s schedule of %s rounds generated in %.3f s", self.schedule, self.nr, scheduletime)
+
+        # the time of the local schedule, for comparison with the distributed one (0 if not measured)
+        localtime = scheduletime if self.schedule == 'local' else 0
+        if self.schedule == 'distributed' and self.compareschedule:
+            begin = time.time()
+            pair.makepairs()
+            localtime = self.comm.allreduce(time.time() - begin, op=MPI.MAX)
+            if self.rank == 0:
+                self.log.info("setup: local schedule of %s rounds generated in %.3f s", self.nr, localtime)
 
         attrs = {
             'pairmode': self.pairmode,
             'totalranks': self.size,
             'nr_tests': self.nr,
             'iterations': self.it,
+            'warmup': self.warmup,
             'aborted': False,
+            'datafields': ','.join(STATS_FIELDS),
+            'msgsize': msgsizes[0] if len(msgsizes) == 1 else msgsizes,
+            'concurrency': self.concurrency or [],
+            'schedule': self.schedule,
+            'scheduletime': scheduletime,
+            'scheduletime_local': localtime,
+            'adaptinterval': self.adaptinterval if self.pairmode == 'adaptive' else 0,
+            'startuptime': self.startuptime,
+            'distances': ','.join(pair.distances) if self.pairmode == 'distance' else '',
         }
 
-        if self.nr > (2 * (self.size-1)):
-            # the amount of pairs made is greater that the amount of possible combinations
-            # therefore, create the keys beforehand to minimize hash collisions
-            # possible combinations are the permutations of range(size) that contain rank
-            keys = [tup for tup in permutations(range(self.size), 2) if self.rank in tup]
-            data = dict.fromkeys(keys, (0, 0))
-            self.log.debug("created a datadict from keys: %s", keys)
-        else:
-            data = dict()
-            self.log.debug("created an empty datadict")
+        # only the timings of the sending rank are kept, so one row of the pair matrix is sufficient
+        stats = {'data': [PairStats(self.size) for _ in msgsizes]}
+        # data has the timings of all rounds, data_conc<level> only those of the rounds with that concurrency
+        for level in self.concurrency or []:
+            stats['data_conc%05d' % level] = [PairStats(self.size) for _ in msgsizes]
 
-        return attrs, mypairs, data
+        return attrs, mypairs, stats
 
-    def run(self, abort_check=True, seed=1, msgsize=1024, maxruntime=0, parallel_io=True):
+    def distancestats(self, stats):
+        """
+        the latency per distance class (see vsc.mympingpong.topology.DISTANCES) over all pairs
+
+        Returns a dict that maps latency_<distance> to an array with the count, mean and stdev for every messagesize
+        """
+        distance = self.topology.distance(n.ones(self.size, int) * self.rank, n.arange(self.size))
+        # count, sum and sum of squares, so the classes can be summed over all ranks
+        sums = n.zeros((len(stats), len(DISTANCES), 3), float)
+        for sizeid, st in enumerate(stats):
+            for idx in range(len(DISTANCES)):
+                sel = distance == idx
+                sums[sizeid, idx] = [n.sum(st.count[sel]), n.sum(st.count[sel] * st.mean[sel]),
+                                     n.sum(st.m2[sel] + st.count[sel] * st.mean[sel] ** 2)]
+        self.comm.Allreduce(MPI.IN_PLACE, sums, op=MPI.SUM)
+
+        count = sums[..., 0]
+        mean = sums[..., 1] / n.where(count == 0, 1, count)
+        stdev = n.sqrt(n.maximum(sums[..., 2] / n.where(count == 0, 1, count) - mean ** 2, 0))
+
+        res = {}
+        for idx, name in enumerate(DISTANCES):
+            res['latency_%s' % name] = n.column_stack([count[:, idx], mean[:, idx], stdev[:, idx]])
+            if self.rank == 0 and count[0, idx]:
+                self.log.info("run: latency %s: %.3g s (stdev %.3g s, %d samples)",
+                              name, mean[0, idx], stdev[0, idx], count[0, idx])
+        return res
+
+    def steer(self, stats, runid, mypairs):
+        """
+        replace the pairs of the next rounds of the adaptive pairmode by pairs steered toward suspicious partners
+
+        every rank proposes its most suspicious partners, based on the latency timings of the first messagesize,
+        and gathers the candidates of all ranks
+
+        Returns the number of steered rounds
+        """
+        st = stats['data'][0]
+        mine = self.pair.suspicious(st.count, st.mean, st.stdev())
+        candidates = n.empty((self.size,) + mine.shape, float)
+        self.comm.Allgather(mine, candidates)
+
+        iterations, res, _ = self.pair.steer(candidates, n.arange(runid, min(runid + self.adaptinterval, self.nr)))
+        mypairs[iterations] = res
+        if self.rank == 0:
+            self.log.debug("steer: %s rounds steered after round %s, %s candidates, highest score %.3g",
+                           len(iterations), runid, n.count_nonzero(candidates[..., 1]), candidates[..., 1].max())
+        return len(iterations)
+
+    def updatebandwidth(self, stats, sizeid, partner, nbytes, timingdata):
+        """
+        add the bandwidth (in MB/s) and messagerate (in messages/s) of the windows of a bandwidth test
+        with nbytes messages and timingdata the time per message in every window
+        windows that completed within the resolution of the timer (a time of 0) are left out,
+        and 0 Bytes messages have no bandwidth (only a messagerate)
+        """
+        timingdata = n.asarray(timingdata, float)
+        timingdata = timingdata[timingdata > 0]
+        if nbytes:
+            stats['bandwidth'][sizeid].update(partner, nbytes / timingdata / 1e6)
+        stats['msgrate'][sizeid].update(partner, 1.0 / timingdata)
+
+    def run(self, abort_check=True, seed=1, msgsize=1024, maxruntime=0, parallel_io=True,
+            abortinterval=100, aborttime=1.0, bandwidth=0, bidirectional=False, pmode='auto', abortcost=False):
         """
         sets up and runs the main test loop
 
         Arguments:
-        abort_check: if True, will check if the test should be aborted before every pingpong (includes maxruntime check)
+        abort_check: if True, will check if the test should be aborted (includes maxruntime check)
         seed: a seed for the random number generator used in pairs.py, should be an int.
-        msgsize: size of the data that will be sent between pairs
+        msgsize: size of the data that will be sent between pairs, or a list of sizes to sweep in every round
         maxruntime: the maximum amount of time that the test will run. Will abort the main loop if exceeded.
-        barrier: if true, wait until every action in a set is finished before starting the next set
+        parallel_io: write the output using parallel IO
+        abortinterval: the maximum number of rounds between two abort checks
+        aborttime: the maximum time (in seconds) between two abort checks
+        bandwidth: if nonzero, also run a streaming bandwidth test with this windowsize every round
+        bidirectional: also run a bidirectional exchange every round
+        pmode: the pingpongmode used for the latency test
+               (fast2 and U10 need a patched mpi4py, persist and kernel don't),
+               auto selects the fastest available pingpongmode
+        abortcost: also measure the original blocking alltoall abort check (at the start of the run),
+                   to estimate the gain in rounds/s of the non-blocking abort check
 
         Returns nothing but will pass the following to writehdf5
         attr: a dictionary containing metadata
-        data: a dict that maps a pair to the amount of times it has been tested and the sum of its test timings
+        data: a dict that maps the name of the dataset to an array with the statistics (see STATS_FIELDS)
+              of this rank with every other rank, for every messagesize
         fail: a 2D array that contains information on how many times a rank has failed a test
         """
-        cpumap = self.makecpumap()
-        attrs, mypairs, data = self.setup(seed, cpumap)
+        msgsizes = msgsize if isinstance(msgsize, list) else [msgsize]
+
+        with self.phases.timed('cpumap'):
+            cpumap = self.makecpumap()
+        attrs, mypairs, stats = self.setup(seed, cpumap, msgsizes)
+
+        if pmode != 'auto' and not self.comm.allreduce(PingPongSR.available(pmode, MPI.COMM_SELF, self.log),
+                                                       op=MPI.LAND):
+            self.log.error("pingpongmode %s is not available on all ranks, selecting one instead", pmode)
+            pmode = 'auto'
+        # the overhead is always measured, so latencies can be corrected for it,
+        # but only that of the requested pingpongmode when it is not selected
+        with self.phases.timed('calibrate'):
+            best, calib = self.calibrate(pmodes=None if pmode == 'auto' else [pmode])
+        attrs.update(calib)
+        if pmode == 'auto':
+            pmode = best
+            if self.rank == 0:
+                self.log.info("run: selected pingpongmode %s", pmode or 'plain')
+        attrs['ppoverhead'] = calib.get('ppoverhead_%s' % (pmode or 'plain'), 0)
+
+        timer = PingPongSR.pingpongfactory('SR' + pmode, MPI.COMM_SELF, 0, self.log).settimer(self.timer)
+        if timer != self.timer:
+            self.log.warning("run: pingpongmode %s does not support timer %s, using %s instead",
+                             pmode or 'plain', self.timer, timer)
+            self.timer = timer
+        with self.phases.timed('calibrate'):
+            attrs.update(self.calibratetimer())
+        if self.rank == 0:
+            self.log.info("run: timer %s, overhead %.3g s, resolution %.3g s",
+                          self.timer, attrs['timer_overhead'], attrs['timer_resolution'])
         fail = n.zeros((self.size, self.size), int)
-        dattosend = self.makedata(l=msgsize)
-        pmode = 'fast2'
+        # the buffers are reused for all pairs
+        dattosend = [self.makedata(l=size) for size in msgsizes]
+
+        if bandwidth:
+            # bandwidth in MB/s and messagerate in messages/s
+            stats['bandwidth'] = [PairStats(self.size) for _ in msgsizes]
+            stats['msgrate'] = [PairStats(self.size) for _ in msgsizes]
+        if bidirectional:
+            # both sides record: the time of the complete exchange, and until the message of the partner arrived
+            stats['bidir'] = [PairStats(self.size) for _ in msgsizes]
+            stats['bidir_recv'] = [PairStats(self.size) for _ in msgsizes]
+
+        checkpointmeta = self.checkpointmeta(msgsizes, stats, pmode, bandwidth, bidirectional)
+        firstround = 0
+        if self.checkpoint and self.resume:
+            with self.phases.timed('checkpoint'):
+                firstround = self.resumecheckpoint(stats, fail, mypairs, checkpointmeta)
+        attrs['resumed'] = firstround
+
+        legacycost = 0
+        if abort_check and abortcost:
+            with self.phases.timed('calibrate'):
+                legacycost = self.abortcheckcost(maxruntime, time.time())
 
         self.comm.barrier()
         self.log.debug("run: setup finished")
         start = time.time()
 
+        # the reduction for the abort check of round nextcheck is started in the round before,
+        # so it can complete during the pingpong
+        nextcheck = firstround + 1
+        checktime = 0
+        steertime = 0
+        steered = 0
+        runs = 0
+        group = 0
         for runid, pair in enumerate(mypairs):
+            if runid < firstround:
+                continue
+            barrierstart = time.time()
             self.comm.barrier()
+            checkstart = time.time()
+            self.phases.add('barrier', checkstart - barrierstart)
             if abort_check:
-                if self.alltoallabort(maxruntime, start):
-                    attrs.update({
-                        'nr_tests': runid*self.size,
-                        'aborted': True,
-                    })
-                    self.log.info("breaking pingpong loop at runid %s", runid)
-                    break
-                self.comm.barrier()
+                if runid == nextcheck:
+                    aborted, elapsed = self.finishabortcheck()
+                    if aborted:
+                        attrs.update({
+                            'nr_tests': runid*self.size,
+                            'aborted': True,
+                        })
+                        self.log.info("breaking pingpong loop at runid %s", runid)
+                        break
+                    nextcheck = self.nextabortcheck(runid, elapsed, abortinterval, aborttime,
+                                                    firstround=firstround)
+                if runid == nextcheck - 1:
+                    self.startabortcheck(maxruntime, start)
+            self.phases.add('abortcheck', time.time() - checkstart)
+            checktime += time.time() - checkstart
+            runs += 1
+
+            if self.pairmode == 'adaptive' and runid and runid % self.adaptinterval == 0:
+                # the pairs of the following rounds are changed in place, this round is never steered
+                steerstart = time.time()
+                steered += self.steer(stats, runid, mypairs)
+                steertime += time.time() - steerstart
+                self.phases.add('steer', time.time() - steerstart)
 
-            timingdata, group = self.pingpong(pair[0], pair[1], pmode=pmode, dat=dattosend)
+            key = tuple(pair)
+            if (-1 in key) or (-2 in key):
+                if key[0] > -1:
+                    fail[self.rank][key[0]] += 1
+                else:
+                    fail[self.rank][key[1]] += 1
+            # we only use the timingdata if the current rank is the sender (and there is a partner)
+            partner = key[1] if key[0] == self.rank else key[0]
+            haspartner = partner >= 0 and partner != self.rank
+            sender = haspartner and key[0] == self.rank
+            # for the bidirectional test, both sides are sender
+            bidirsender = haspartner
+            if self.concurrency:
+                level = self.concurrency[runid % len(self.concurrency)]
+
+            pingpongstart = time.time()
+            for sizeid, dat in enumerate(dattosend):
+                timingdata, ppgroup = self.pingpong(pair[0], pair[1], pmode=pmode, dat=dat, runid=runid)
+                if sender:
+                    group = ppgroup
+                    stats['data'][sizeid].update(key[1], timingdata)
+                    if self.concurrency:
+                        stats['data_conc%05d' % level][sizeid].update(key[1], timingdata)
+
+                if bandwidth:
+                    # timingdata is the time per message in every window
+                    timingdata, _ = self.pingpong(pair[0], pair[1], pmode='bw', dat=dat, group=bandwidth)
+                    if sender:
+                        self.updatebandwidth(stats, sizeid, key[1], len(dat), timingdata)
+
+                if bidirectional:
+                    timingdata, _ = self.pingpong(pair[0], pair[1], pmode='bidir', dat=dat)
+                    if bidirsender:
+                        stats['bidir'][sizeid].update(partner, timingdata[0])
+                        stats['bidir_recv'][sizeid].update(partner, timingdata[1])
+            self.phases.add('pingpong', time.time() - pingpongstart)
+
+            if self.checkpoint and self.checkpoint.due(runid):
+                with self.phases.timed('checkpoint'):
+                    # only the adaptive pairmode changes the schedule, the others are regenerated from the seed
+                    self.checkpoint.write(runid + 1, stats, fail[self.rank], checkpointmeta,
+                                          pairs=mypairs if self.pairmode == 'adaptive' else None)
 
             # log progress
             #   log first 10 per iteration,
@@ -278,57 +860,123 @@ class MyPingPong(object):
                 progress = int(float(runid)*100/self.nr)
                 self.log.debug("run %s/%s (%s%%)", runid*self.size, self.nr*self.size, progress)
 
-            key = tuple(pair)
-            try:
-                count, old_timingdata = data.get(key, (0, 0))
-                data[key] = (count + 1, n.append(old_timingdata, timingdata))
-            except KeyError as _:
-                self.log.error("pair %s is not in permutation", key)
-            if (-1 in key) or (-2 in key):
-                if key[0] > -1:
-                    fail[self.rank][key[0]] += 1
-                else:
-                    fail[self.rank][key[1]] += 1
+        data = dict([(name, n.array([st.asarray() for st in sts])) for name, sts in stats.items()])
+        self.log.debug("finished building data {name: [msgsize, partner, %s]}: %s", STATS_FIELDS, data)
+
+        if bandwidth:
+            # sustained bandwidth over all pairs and messagesizes
+            bwstats = data['bandwidth']
+            totals = self.comm.allreduce([n.sum(bwstats[..., 0] * bwstats[..., 1]), n.sum(bwstats[..., 0])])
+            if self.rank == 0:
+                self.log.info("run: average bandwidth %.1f MB/s (window %s)",
+                              totals[0] / max(totals[1], 1), bandwidth)
 
-        for k, (count, timings) in data.items():
-            data[k] = (count, n.sum(timings)/count, n.std(timings))
-        self.log.debug("finished building data { (p1,p2) : (count, avg, stdev), }: %s", data)
+        if self.abortreq is not None:
+            # last check was started but not needed anymore
+            self.finishabortcheck()
+
+        attrs.update(self.distancestats(stats['data']))
 
         failed = n.count_nonzero(fail) > 0
-        timing = int((time.time() - start))
+        runtime = time.time() - start
+        timing = int(runtime)
+
+        # the rates are the same on all ranks, as they are stored as attributes
+        runtime = self.comm.allreduce(runtime, op=MPI.MAX)
+        checktime = self.comm.allreduce(checktime, op=MPI.MAX)
+        steertime = self.comm.allreduce(steertime, op=MPI.MAX)
+        if steered and self.rank == 0:
+            self.log.info("run: %s rounds steered toward suspicious pairs in %.3f s", steered, steertime)
+        # ranks that never sent (e.g. always idle) have no group
+        group = self.comm.allreduce(group, op=MPI.MAX)
+        roundrate = runs / runtime if runtime else 0
+        roundrate_gain_estimate = 0
+        if abort_check and abortcost:
+            # extrapolated: the rate if every round had done the blocking alltoall-barrier check instead,
+            # with the cost of that check measured at the start of the run
+            legacycost = self.comm.allreduce(legacycost, op=MPI.MAX)
+            legacytime = runtime - checktime + runs * legacycost
+            roundrate_gain_estimate = roundrate - (runs / legacytime if legacytime else 0)
+            if self.rank == 0:
+                self.log.info("run: %.1f rounds/s, estimated gain of %.1f rounds/s over per-round alltoall abort "
+                              "checks", roundrate, roundrate_gain_estimate)
+
+        if self.raw:
+            self.raw.attrs.update({
+                'rank': self.rank,
+                'name': self.name,
+                'core': self.core,
+                'iterations': self.it,
+                'ppmode': pmode,
+                'ppgroup': group,
+                'timer': self.timer,
+            })
+            self.raw.close()
 
         attrs.update({
-            'msgsize': msgsize,
             'ppmode': pmode,
             'failed': failed,
             'timing': timing,
             'ppgroup': group,
+            'raw': self.raw is not None,
+            'roundrate': roundrate,
+            'roundrate_gain_estimate': roundrate_gain_estimate,
+            'bwwindow': bandwidth,
+            'bidirectional': bidirectional,
+            'steered': steered,
+            'steertime': steertime,
+            'rounds': runs,
         })
 
-        if parallel_io or self.rank == 0:
-            self.writehdf5(data, attrs, failed, fail, parallel_io=parallel_io)
-        else:
-            self.log.debug("sending data to master rank (blocking until master rank receives)...")
-            self.comm.send((self.rank, self.name, self.core, self.size, data, failed, fail), dest=0, tag=123)
-            self.log.debug("data sent to master rank!")
+        with self.phases.timed('writehdf5'):
+            filename = self.writehdf5(data, attrs, failed, fail, parallel_io=parallel_io)
+        self.writephases(filename, runs)
 
-    def pingpong(self, p1, p2, pmode='fast2', dat=None, dummyfirst=False, test=False):
+        if self.checkpoint and not attrs['aborted']:
+            # the run is complete, nothing to resume
+            self.checkpoint.remove()
+
+    def writephases(self, filename, runs):
+        """
+        reduce the wall time per phase over all ranks and add it to the outputfile (by rank 0)
+        as phase_<phase> attributes with the min, median and max over all ranks
+        """
+        phases = self.phases.reduce(self.comm)
+        if self.rank != 0:
+            return
+
+        # the output file is closed (also for parallel IO), so it can be reopened by rank 0 only
+        fh = h5py.File(filename, 'a')
+        for name, durations in phases.items():
+            fh.attrs[name] = durations
+        fh.attrs['phases'] = ','.join(self.phases.phases)
+        fh.close()
+
+        slowest = max(self.phases.phases, key=lambda phase: phases['phase_%s' % phase][2])
+        self.log.info("writephases: slowest phase %s (max %.3f s), per round barrier %.3g s and abort check %.3g s",
+                      slowest, phases['phase_%s' % slowest][2], phases['phase_barrier'][1] / max(runs, 1),
+                      phases['phase_abortcheck'][1] / max(runs, 1))
+
+    def pingpong(self, p1, p2, pmode='fast2', dat=None, dummyfirst=False, test=False, runid=None, group=None):
         """
         Pingpong between pairs
 
         Arguments:
         p1, p2: pair 1 & 2
-        pmode: which pingpongmode is used (fast, fast2, U10) (default: fast2)
+        pmode: which pingpongmode is used (fast, fast2, U10, persist, kernel, bw, bidir) (default: fast2)
         dat: the data that is being sent
         dummyfirst: if true, do a dummyrun before pingponging $it times
         test: use pingpongtest()
+        runid: the id of the round, used for the raw timings (not recorded if None)
+        group: the groupsize passed to the pingponger (the windowsize for bw)
 
         Returns:
-        timing: the time that it took to pingpong between 1 and 2 $it times
+        timing: the timings of every group of pingpongs between 1 and 2 ($it pingpongs in total)
         group: the group attribute of the pingponger
         """
 
-        if not dat:
+        if dat is None:
+            # an empty buffer is a valid (0 Bytes) message
             dat = self.makedata()
         if p1 == p2:
             self.log.debug("pingpong: do nothing p1 == p2")
@@ -340,6 +988,9 @@ class MyPingPong(object):
         if (p1 == -2) or (p2 == -2):
             self.log.debug("pingpong: do nothing: result from odd number of elements (ps: %s p2 %s)", p1, p2)
             return -1, {}
+        if IDLE in (p1, p2):
+            self.log.debug("pingpong: do nothing: idle in this round (ps: %s p2 %s)", p1, p2)
+            return -1, {}
 
         if test:
             pp = PingPongSR.pingpongfactory('test')
@@ -352,38 +1003,60 @@ class MyPingPong(object):
             return -1, {}
 
         pp.setdat(dat)
+        pp.settimer(self.timer)
 
         if dummyfirst:
             self.log.debug("pingpong: dummy first")
             pp.dopingpong(1)
 
-        timingdata = pp.dopingpong(self.it)
-        return timingdata, pp.group
+        if self.warmup:
+            pp.dowarmup(self.warmup, group)
+
+        if group:
+            pp.dopingpong(self.it, group)
+        else:
+            pp.dopingpong(self.it)
+
+        if self.raw and self.rank == p1 and runid is not None:
+            # only the sender records, like for the data
+            self.raw.add(pp.start, pp.end, p2, runid, len(dat))
+
+        return pp.timings(), pp.group
 
     def writehdf5(self, data, attributes, failed, fail, remove=True, parallel_io=True):
         """
-        writes data to a .h5 defined by the -f parameter
+        writes data to a .h5 defined by the -f parameter (collective: called by all ranks)
 
         Arguments:
-        data: a 3D matrix containing the data from running pingpong. data[p1][p2][information]
+        data: a dict that maps the name of the dataset to a 3D array containing the statistics of this rank
+              with every partner, for every messagesize. data[name][msgsize][p2][field]
         attrs: a dict containing the attributes of the test
         failed: a boolean that is False if there were no fails during testing
         fail: a 2D array containing information on how many times a rank has failed a test
+        parallel_io: every rank writes its own rows with a collective write,
+                     otherwise rank 0 gathers the rows of all ranks and writes everything
 
-        will generate a hdf5 file containing all this data plus a dataset containing information on the rank
+        will generate a hdf5 file containing all this data plus a dataset containing information on the rank,
+        returns the name of that file
         """
         filename = self.fn
+        STR_LEN = 64
 
-        # receive data from other ranks
-        all_tuples = [(self.rank, self.name, self.core, self.size, data, failed, fail)]
+        # the messagesize dimension is only added when sweeping over messagesizes
+        nrsizes = data['data'].shape[0]
+        shape = (self.size, self.size, len(STATS_FIELDS))
+        if nrsizes > 1:
+            shape = (nrsizes,) + shape
 
-        if not parallel_io:
-            # receive data for other (n-1) ranks
-            for rank in range(self.size)[1:]:
-                self.log.debug("receiving data from rank %d (blocking MPI recv)...", rank)
-                foo = self.comm.recv(source=rank, tag=123)
-                self.log.debug("data from rank %d received!", rank)
-                all_tuples.append(foo)
+        # creating datasets is collective, so all ranks need to know if there is a fail dataset
+        anyfailed = self.comm.allreduce(bool(failed), op=MPI.LOR)
+
+        if self.sparse:
+            tables = self.gathercoo(data, fail, anyfailed, parallel_io)
+        else:
+            rows = self.gatherrows(data, fail, anyfailed, parallel_io, STR_LEN)
+        if not parallel_io and self.rank != 0:
+            return filename
 
         if remove and os.path.exists(filename):
             try:
@@ -398,36 +1071,128 @@ class MyPingPong(object):
             f = h5py.File(filename, 'w')
 
         for k, v in sorted(attributes.items()):
-            if v == {}:
+            if isinstance(v, dict) and not v:
                 # workaround for: TypeError: Object dtype dtype('O') has no native HDF5 equivalent
                 v = ''
             f.attrs[k] = v
             if self.rank == 0:
                 self.log.debug("added attribute %s: %s to data.attrs", k, v)
 
-        data_cnt = len(list(data.values())[0])
-        dataset = f.create_dataset('data', (self.size, self.size, data_cnt), 'f')
-        STR_LEN = 64
-        rankname = f.create_dataset('rankdata', (self.size, 2), dtype='S%s' % str(STR_LEN))
+        if self.sparse:
+            self.writecoo(f, tables, shape, parallel_io)
+            f.close()
+            return filename
+
+        shapes = {
+            'fail': ((self.size, self.size), 'i8'),
+            'rankdata': ((self.size, 2), 'S%s' % STR_LEN),
+        }
+        for name, row in rows:
+            dshape, dtype = shapes.get(name, (shape, 'f'))
+            dataset = f.create_dataset(name, dshape, dtype)
+            if name in shapes:
+                if parallel_io:
+                    with dataset.collective:
+                        dataset[self.rank] = row
+                else:
+                    dataset[...] = row
+            elif parallel_io:
+                # one hyperslab per rank: the row of this rank for all messagesizes
+                with dataset.collective:
+                    if nrsizes > 1:
+                        dataset[:, self.rank] = row
+                    else:
+                        dataset[self.rank] = row[0]
+            elif nrsizes > 1:
+                dataset[...] = row.transpose(1, 0, 2, 3)
+            else:
+                dataset[...] = row[:, 0]
+            self.log.debug("written dataset %s to file (%s)", name, filename)
 
-        if any(t[5] for t in all_tuples):
-            failset = f.create_dataset('fail', (self.size, self.size), dtype='i8')
+        f.close()
 
-        for (rank, name, core, size, data, failed, fail) in all_tuples:
-            self.log.debug("writing data for rank %d to file (%s)", rank, filename)
-            for ((sendrank, recvrank), val) in data.items():
-                if sendrank != rank:
-                    # we only use the timingdata if the current rank is the sender
-                    continue
-                dataset[sendrank, recvrank] = tuple(val)
+        return filename
 
-            if failed:
-                failset[rank] = fail[rank]
+    def gatherrows(self, data, fail, anyfailed, parallel_io, strlen):
+        """
+        the rows of this rank of every dataset, as one contiguous block (parallel_io),
+        or the rows of all ranks gathered on rank 0 (they have the same size on all ranks)
 
-            rankname[rank] = (self.fitstr(name, STR_LEN), self.fitstr(core, STR_LEN))
-            self.log.debug("done writing data for rank %d", rank)
+        Returns a list of (name, rows), in the same order on all ranks
+        """
+        rows = [(name, n.ascontiguousarray(data[name], dtype='f')) for name in sorted(data)]
+        if anyfailed:
+            rows.append(('fail', n.ascontiguousarray(fail[self.rank], dtype='i8')))
+        rankinfo = n.array([self.fitstr(self.name, strlen), self.fitstr(self.core, strlen)], dtype='S%s' % strlen)
+        rows.append(('rankdata', rankinfo))
 
-        f.close()
+        if parallel_io:
+            return rows
+
+        gathered = []
+        for name, row in rows:
+            recv = n.empty((self.size,) + row.shape, row.dtype) if self.rank == 0 else None
+            self.comm.Gather([row, MPI.BYTE], [recv, MPI.BYTE] if self.rank == 0 else None, root=0)
+            gathered.append((name, recv))
+        self.log.debug("gathered %s datasets of all ranks", len(rows))
+        return gathered
+
+    def gathercoo(self, data, fail, anyfailed, parallel_io):
+        """
+        the sparse entries (see vsc.mympingpong.sparse) of this rank (parallel_io)
+        or of all ranks gathered on rank 0 with a Gatherv, for every dataset
+
+        Returns a list of (name, entries, offset of the entries in the dataset, total number of entries)
+        """
+        tables = [(name, tocoo(self.rank, data[name])) for name in sorted(data)]
+        if anyfailed:
+            tables.append(('fail', failtocoo(self.rank, fail[self.rank])))
+
+        res = []
+        for name, entries in tables:
+            counts = n.empty(self.size, int)
+            self.comm.Allgather(n.array([entries.size], int), counts)
+            offset, total = int(counts[:self.rank].sum()), int(counts.sum())
+
+            if not parallel_io:
+                recv = None
+                if self.rank == 0:
+                    nbytes = counts * entries.dtype.itemsize
+                    recv = [n.empty(total, entries.dtype), (nbytes, n.cumsum(nbytes) - nbytes), MPI.BYTE]
+                self.comm.Gatherv([entries, MPI.BYTE], recv, root=0)
+                entries, offset = (recv[0] if recv else None), 0
+
+            res.append((name, entries, offset, total))
+        self.log.debug("gathered sparse entries: %s", [(name, total) for name, _, _, total in res])
+        return res
+
+    def writecoo(self, f, tables, shape, parallel_io):
+        """
+        write the sparse entries of gathercoo as chunked and compressed datasets,
+        and the rank data as a table of node names plus the node id and core of every rank
+        """
+        f.attrs['layout'] = SPARSE_LAYOUT
+
+        for name, entries, offset, total in tables:
+            dataset = f.create_dataset(name, (total,), entries.dtype, maxshape=(None,), chunks=(SPARSE_CHUNK,),
+                                       compression='gzip', shuffle=True)
+            dataset.attrs['layout'] = SPARSE_LAYOUT
+            dataset.attrs['shape'] = (self.size, self.size) if name == 'fail' else shape
+            if parallel_io:
+                with dataset.collective:
+                    dataset[offset:offset + entries.size] = entries
+            elif total:
+                dataset[...] = entries
+            self.log.debug("written %s sparse entries of dataset %s", total, name)
+
+        names = n.array([name.encode('utf8') for name in self.nodenames])
+        hostnames = f.create_dataset('hostnames', names.shape, names.dtype)
+        rankdata = f.create_dataset('rankdata', self.rankinfo.shape, 'i4')
+        rankdata.attrs['fields'] = 'node,core'
+        # the same on all ranks
+        if self.rank == 0:
+            hostnames[...] = names
+            rankdata[...] = self.rankinfo
 
     def fitstr(self, string, length):
         """Pad string value with spaces until it has specified length."""
@@ -447,15 +1212,63 @@ if __name__ == '__main__':
     options = {
         'number': ('set the amount of samples that will be made', int, 'store', 1000, 'n'),
         'messagesize': ('set the message size in Bytes', int, 'store', 1024, 'm'),
+        'sweep': ('sweep over messagesizes in every round (overrides messagesize): a comma-separated list of sizes '
+                  'in Bytes, or min:max:steps for a geometric range', str, 'store', None),
         'iterations': ('set the number of iterations', int, 'store', 20, 'i'),
-        'groupmode': ('set the groupmode', str, 'store', None, 'g'),
+        'warmup': ('set the number of untimed pingpongs before the timed iterations, for every pair and messagesize',
+                   int, 'store', 0),
+        'groupmode': ('set the groupmode: incl, groupexcl, hwloc, roundrobin, adaptive (steer rounds toward '
+                      'pairs with high latency, high variance or few samples) or distance (pair at the distances '
+                      'of --distances)', str, 'store', None, 'g'),
+        'hwloccache': ("Directory of the per node cache of the hwloc topology, keyed by hostname, boot id and backend "
+                       "(an empty string disables the cache)", str, 'store', tempfile.gettempdir()),
+        'topologybackend': ("Discover the topology with hwloc-ls (hwloc), from /sys (sysfs) or with hwloc-ls "
+                            "unless it is missing, fails or is slow (auto)",
+                            'choice', 'store', 'auto', TOPOLOGY_BACKENDS),
+        'distances': ("Comma-separated distance classes the distance groupmode cycles over every round: %s "
+                      "(default: all)" % ', '.join(DISTANCES), str, 'store', None),
+        'adaptinterval': ('number of rounds between two steering steps of the adaptive groupmode',
+                          int, 'store', ADAPT_INTERVAL),
         'output': ('set the outputdirectory. a file will be written in format \
             PP<name>-<worldssize>-msg<msgsize>-nr<number>-it<iterations>-<ddmmyy-hhmm>.h5', str, 'store', 'test2', 'f'),
         'seed': ('set the seed', int, 'store', 2, 's'),
         'maxruntime': ('set the maximum runtime of pingpong in seconds \
                        (default will run infinitely)', int, 'store', 0, 't'),
         'abort_check': ('check for abort signals or maxruntime', '', 'store_true', True, 'a'),
+        'abortinterval': ('maximum number of rounds between two abort checks', int, 'store', 100),
+        'aborttime': ('maximum time in seconds between two abort checks', float, 'store', 1.0),
+        'abortcost': ("Also measure the original blocking alltoall abort check at the start of the run, and estimate "
+                      "the gain in rounds/s of the non-blocking one (roundrate_gain_estimate)",
+                      '', 'store_true', False),
         'parallel-io': ("Create output *.h5 using parallel IO", '', 'store_true', True),
+        'checkpoint': ("Write a per-rank checkpoint of the statistics every this number of rounds (0 disables), "
+                       "an interrupted run can be resumed from it with --resume", int, 'store', 0),
+        'resume': ("Resume the interrupted run with this outputfile (without the .h5 extension) from its checkpoints, "
+                   "with the same options (the results are written to a new outputfile)", str, 'store', None),
+        'sparse': ("Write the pair matrices as chunked and compressed lists of (sender, receiver, statistics) "
+                   "entries of the pairs with samples, instead of dense rank x rank matrices (for large rank counts)",
+                   '', 'store_true', False),
+        'ppmode': ("Pingpongmode for the latency test: fast2, U10 or fast (need patched mpi4py), persist "
+                   "(persistent requests), kernel (compiled kernel), '' (plain Send/Recv) or auto (the fastest "
+                   "available one)", str, 'store', 'auto'),
+        'bandwidth': ("Also run a streaming bandwidth test every round, with this number of outstanding messages "
+                      "(0 disables)", int, 'store', 0),
+        'bidirectional': ("Also run a bidirectional exchange (both partners send at the same time) every round",
+                          '', 'store_true', False),
+        'raw': ("Also write the timing of every group of pingpongs to a per-rank *-raw<rank>.h5 file",
+                '', 'store_true', False),
+        'rawbuffer': ("Number of raw timings buffered in memory before writing them", int, 'store', 65536),
+        'concurrency': ("Number of pairs that pingpong at the same time: a comma-separated list or min:max:steps "
+                        "range of levels, the rounds cycle over them (0 is all pairs); the timings are also "
+                        "stored per level in data_conc<level>", str, 'store', None),
+        'schedule': ("Generate the pairs on every rank (local) or generate the pairs of every round on one rank and "
+                     "exchange them (distributed, not for hwloc or incl groupmodes)",
+                     'choice', 'store', 'local', ['local', 'distributed']),
+        'compareschedule': ("With the distributed schedule, also generate the schedule locally and store its time "
+                            "as scheduletime_local, to compare with scheduletime", '', 'store_true', False),
+        'timer': ("Clock for the timings: MPI.Wtime or the high resolution performance counter "
+                  "(not supported by the pingpongmodes of the patched mpi4py)",
+                  'choice', 'store', 'wtime', ['wtime', 'perf_counter']),
     }
 
     go = simple_option(options)
@@ -469,7 +1282,28 @@ if __name__ == '__main__':
     if not os.path.isdir(go.options.output):
         go.log.error("could not set outputfile: %s doesn't exist or isn't a path", go.options.output)
         sys.exit(3)
-    mpp.setfilename(go.options.output, go.options.messagesize)
+    if go.options.sweep:
+        msgsize = parsesizes(go.options.sweep)
+        go.log.info("sweeping messagesizes %s", msgsize)
+    else:
+        msgsize = go.options.messagesize
+
+    mpp.setfilename(go.options.output, msgsize)
+
+    if go.options.raw:
+        mpp.setraw(go.options.rawbuffer)
+
+    if go.options.checkpoint or go.options.resume:
+        mpp.setcheckpoint(go.options.checkpoint, resume=go.options.resume)
+
+    mpp.settimer(go.options.timer)
+    mpp.setwarmup(go.options.warmup)
+    mpp.setsparse(go.options.sparse)
+    mpp.sethwloccache(go.options.hwloccache, backend=go.options.topologybackend)
+    mpp.setschedule(go.options.schedule, compare=go.options.compareschedule)
+
+    if go.options.concurrency:
+        mpp.setconcurrency(parsesizes(go.options.concurrency, what='concurrency level'))
 
     if go.options.groupmode == 'incl':
         mpp.setpairmode(rngfilter=go.options.groupmode)
@@ -478,9 +1312,16 @@ if __name__ == '__main__':
     elif go.options.groupmode == 'hwloc':
         # no rngfilter needed (hardcoded to incl)
         mpp.setpairmode(pairmode=go.options.groupmode)
+    elif go.options.groupmode in ('roundrobin', 'adaptive', 'distance'):
+        mpp.setpairmode(pairmode=go.options.groupmode)
+    if go.options.distances:
+        mpp.setdistances(go.options.distances.split(','))
+    mpp.setadaptinterval(go.options.adaptinterval)
 
     mpp.run(abort_check=go.options.abort_check, seed=go.options.seed,
-            msgsize=go.options.messagesize, maxruntime=go.options.maxruntime,
-            parallel_io=go.options.parallel_io)
+            msgsize=msgsize, maxruntime=go.options.maxruntime,
+            parallel_io=go.options.parallel_io, abortinterval=go.options.abortinterval,
+            aborttime=go.options.aborttime, bandwidth=go.options.bandwidth,
+            bidirectional=go.options.bidirectional, pmode=go.options.ppmode, abortcost=go.options.abortcost)
 
     go.log.info("data written to %s", mpp.fn)
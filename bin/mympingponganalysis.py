@@ -40,11 +40,18 @@ import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 import numpy as n
 
+from vsc.mympingpong.sparse import SPARSE_LAYOUT, todense
 from vsc.utils.generaloption import simple_option
 
 
 INTERVAL_NONE = (None, None)
 
+# latencies less than this number of times the timer precision are flagged
+PRECISION_FACTOR = 10
+
+# the metadata that is not shown in the text panel (the phase timings and the detailed calibrations)
+HIDDEN_META = ('phase', 'latency_', 'ppoverhead_', 'pplocal_', 'timer_', 'wtick', 'wtime_is_global')
+
 
 class PingPongAnalysis(object):
 
@@ -55,6 +62,7 @@ class PingPongAnalysis(object):
         self.count = None
         self.fail = None
         self.consistency = None
+        self.precision = None
 
         # use multiplication of 10e6 (ie microsec)
         self.scaling = 1e6
@@ -67,32 +75,111 @@ class PingPongAnalysis(object):
         self.latencymask = latencymask
         self.bins = bins
 
-    def collectdata(self, fn):
-        """collects metatags, failures, counters and timingdata from the inputfile"""
+    def collectdata(self, fn, msgsize=None, concurrency=None, ranks=None):
+        """
+        collects metatags, failures, counters and timingdata from the inputfile
+        if the inputfile contains a sweep over messagesizes, msgsize selects the one to use (default: the smallest)
+        concurrency selects the timings of the rounds with that number of active pairs (default: all rounds)
+        ranks selects the block of the pairs of the ranks in the interval [start, end) (default: all ranks)
+        """
         f = h5py.File(fn, 'r')
 
         self.meta = dict(f.attrs.items())
         self.log.debug("collect meta: %s" % self.meta)
 
+        if ranks is None:
+            ranks = (0, int(self.meta['totalranks']))
+        else:
+            self.meta['ranks'] = "%s-%s" % ranks
+
         if self.meta['failed']:
-            self.fail = f['fail'][:]
+            self.fail = self.loadblock(f['fail'], ranks)
             self.log.debug("collect fail: %s" % self.fail)
 
+        dname = 'data'
+        if concurrency is not None:
+            levels = list(self.meta.get('concurrency', []))
+            if concurrency not in levels:
+                self.log.error("concurrency %s not in levels %s" % (concurrency, levels))
+                sys.exit(1)
+            dname = 'data_conc%05d' % concurrency
+            self.meta['concurrency'] = concurrency
+
+        sizeid = None
+        if self.ndim(f[dname]) == 4:
+            msgsizes = list(self.meta['msgsize'])
+            if msgsize is None:
+                msgsize = msgsizes[0]
+            elif msgsize not in msgsizes:
+                self.log.error("messagesize %s not in sweep %s" % (msgsize, msgsizes))
+                sys.exit(1)
+            sizeid = msgsizes.index(msgsize)
+            self.meta['msgsize'] = msgsize
+            self.log.debug("collect data for messagesize %s from sweep %s" % (msgsize, msgsizes))
+        alldata = self.loadblock(f[dname], ranks, sizeid=sizeid)
+
         # http://stackoverflow.com/a/118508
-        self.count = n.ma.array(f['data'][..., 0])
+        self.count = n.ma.array(alldata[..., 0])
         self.log.debug("collect count: %s" % self.count)
 
-        data = f['data'][..., 1]
+        # the data contains the average timing, no need to divide by count
+        data = alldata[..., 1]
         data = data * self.scaling
-        data = data / n.where(self.count == 0, 1, self.count)
         self.data = n.ma.array(data)
         self.log.debug("collect data: %s" % data)
 
-        self.consistency = n.ma.array(f['data'][..., 2])
+        self.consistency = n.ma.array(alldata[..., 2])
         self.log.debug("collect consistency: %s" % self.consistency)
 
+        self.precision = self.timerprecision()
+        if self.precision:
+            below = n.count_nonzero((self.count > 0) & (self.data < PRECISION_FACTOR * self.precision))
+            self.meta['below_precision'] = below
+            if below:
+                self.log.warning("%s latencies are less than %s times the timer precision (%.3g microsec)" %
+                                 (below, PRECISION_FACTOR, self.precision))
+
         f.close()
 
+    def ndim(self, dataset):
+        """the number of dimensions of the (dense) dataset"""
+        if dataset.attrs.get('layout') == SPARSE_LAYOUT:
+            return len(dataset.attrs['shape'])
+        return dataset.ndim
+
+    def loadblock(self, dataset, ranks, sizeid=None):
+        """
+        the dense block of the pairs of ranks (start, end) of the dataset, for the messagesize sizeid (if any)
+
+        of sparse datasets only the entries of the senders in ranks are read
+        (the entries are sorted by sender) and only the block is materialized
+        """
+        start, end = ranks
+        if dataset.attrs.get('layout') != SPARSE_LAYOUT:
+            if sizeid is not None:
+                return dataset[sizeid, start:end, start:end]
+            return dataset[start:end, start:end]
+
+        senders = dataset.fields('sender')[:]
+        lo, hi = n.searchsorted(senders, [start, end])
+        entries = dataset[lo:hi]
+        self.log.debug("collect %s of %s sparse entries of %s" % (hi - lo, senders.size, dataset.name))
+
+        field = 'count' if 'count' in entries.dtype.names else 'stats'
+        return todense(entries, ranks, ranks, sizeid=sizeid or 0, field=field)
+
+    def timerprecision(self):
+        """
+        the precision of the measured latencies (in the same scale as the data), from the timer calibration
+        every timing is the average of a group of ppgroup pingpongs (2 messages each)
+        returns None for inputfiles without timer calibration
+        """
+        if 'timer_resolution' not in self.meta:
+            return None
+        group = max(int(self.meta.get('ppgroup', 1)), 1)
+        precision = (self.meta['timer_resolution'] + self.meta['timer_overhead']) / (2.0 * group)
+        return precision * self.scaling
+
     def setticks(self, nrticks, length, sub):
         """make and set evenly spaced ticks for the subplot, that excludes zero and max"""
         ticks = [0] * nrticks
@@ -112,7 +199,7 @@ class PingPongAnalysis(object):
         bottom, height = .1, .9
 
         COLUMNS = 3
-        tags = list(self.meta.keys())
+        tags = [tag for tag in self.meta.keys() if not tag.startswith(HIDDEN_META)]
         nrmeta = len(tags)
         while nrmeta % COLUMNS != 0:
             nrmeta += 1
@@ -290,6 +377,10 @@ if __name__ == '__main__':
                         'will correspond to respectively the lowest and highest value in the remaining data-array',
                         'strtuple', 'store', None, 'm'
                         ),
+        'msgsize': ('select the messagesize to plot, if the inputfile contains a sweep', int, 'store', None),
+        'concurrency': ('only plot the rounds with this number of active pairs', int, 'store', None),
+        'ranks': ('only plot the pairs of the ranks in the interval start,end (end excluded)',
+                  'strtuple', 'store', None),
         'bins': ('set the amount of bins in the histograms', 'int', 'store', 100, 'b'),
         'colormap': ('set the colormap, for a list of options see http://matplotlib.org/users/colormaps.html', 'string', 'store', 'jet', 'c'),
         'show': ('show the image after generating', '', 'store_true', False),
@@ -304,7 +395,9 @@ if __name__ == '__main__':
     lscale = map(float, go.options.latencyscale) if go.options.latencyscale else INTERVAL_NONE
     lmask = map(float, go.options.latencymask) if go.options.latencymask else INTERVAL_NONE
 
+    ranks = tuple(map(int, go.options.ranks)) if go.options.ranks else None
+
     ppa = PingPongAnalysis(go.log, lscale, lmask, go.options.bins)
-    ppa.collectdata(go.options.input)
+    ppa.collectdata(go.options.input, msgsize=go.options.msgsize, concurrency=go.options.concurrency, ranks=ranks)
 
     ppa.plot(go.options.colormap, go.options.input, go.options.show, go.options.save, lscale, lmask)
@@ -0,0 +1,121 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+# cython: boundscheck=False, wraparound=False
+"""
+Compiled timed pingpong loop, replaces the loops of the patched mpi4py
+
+Works on any mpi4py communicator; the loop runs without the GIL.
+"""
+
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE, PyBUF_WRITABLE
+from mpi4py cimport MPI
+from mpi4py.libmpi cimport MPI_BYTE, MPI_Comm, MPI_Recv, MPI_Send, MPI_STATUS_IGNORE, MPI_SUCCESS, MPI_Wtime
+from mpi4py.MPI import Exception as MPIException
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
+
+
+cdef int _pingpong(void *sbuf, int slen, void *rbuf, int rlen, int other, int stag, int rtag,
+                   MPI_Comm comm, bint sendfirst) nogil:
+    """one pingpong: send and receive, or receive and send"""
+    cdef int ierr
+    if sendfirst:
+        ierr = MPI_Send(sbuf, slen, MPI_BYTE, other, stag, comm)
+        if ierr == MPI_SUCCESS:
+            ierr = MPI_Recv(rbuf, rlen, MPI_BYTE, other, rtag, comm, MPI_STATUS_IGNORE)
+    else:
+        ierr = MPI_Recv(rbuf, rlen, MPI_BYTE, other, rtag, comm, MPI_STATUS_IGNORE)
+        if ierr == MPI_SUCCESS:
+            ierr = MPI_Send(sbuf, slen, MPI_BYTE, other, stag, comm)
+    return ierr
+
+
+cdef inline double _monotonic() nogil:
+    """the monotonic clock in seconds (the clock of time.perf_counter on Linux)"""
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+
+cdef inline double _now(bint monotonic) nogil:
+    if monotonic:
+        return _monotonic()
+    return MPI_Wtime()
+
+
+def timedloop(MPI.Comm comm, sbuf, rbuf, int other, int stag, int rtag,
+              Py_ssize_t[::1] counts, double[::1] start, double[::1] end,
+              int warmup=0, bint sendfirst=True, bint monotonic=False):
+    """
+    Pingpong with other, timing groups of pingpongs
+
+    Arguments:
+    comm: the mpi4py communicator
+    sbuf, rbuf: the send and receive buffers (anything that supports the buffer protocol)
+    other: the rank to pingpong with
+    stag, rtag: the tags of the sent and received messages
+    counts: the number of pingpongs in every group
+    start, end: filled with the time before and after every group
+    warmup: number of pingpongs done before the timed groups
+    sendfirst: send and then receive (or receive and then send)
+    monotonic: time with the monotonic clock instead of MPI_Wtime
+    """
+    cdef Py_buffer sview
+    cdef Py_buffer rview
+    cdef MPI_Comm ccomm = comm.ob_mpi
+    cdef Py_ssize_t group, nrgroups = counts.shape[0]
+    cdef Py_ssize_t i
+    cdef int ierr = MPI_SUCCESS
+
+    if start.shape[0] < nrgroups or end.shape[0] < nrgroups:
+        raise ValueError("start and end need at least %s elements" % nrgroups)
+
+    PyObject_GetBuffer(sbuf, &sview, PyBUF_SIMPLE)
+    try:
+        PyObject_GetBuffer(rbuf, &rview, PyBUF_SIMPLE | PyBUF_WRITABLE)
+        try:
+            with nogil:
+                for i in range(warmup):
+                    ierr = _pingpong(sview.buf, <int>sview.len, rview.buf, <int>rview.len,
+                                     other, stag, rtag, ccomm, sendfirst)
+                    if ierr != MPI_SUCCESS:
+                        break
+
+                for group in range(nrgroups):
+                    if ierr != MPI_SUCCESS:
+                        break
+                    start[group] = _now(monotonic)
+                    for i in range(counts[group]):
+                        ierr = _pingpong(sview.buf, <int>sview.len, rview.buf, <int>rview.len,
+                                         other, stag, rtag, ccomm, sendfirst)
+                        if ierr != MPI_SUCCESS:
+                            break
+                    end[group] = _now(monotonic)
+        finally:
+            PyBuffer_Release(&rview)
+    finally:
+        PyBuffer_Release(&sview)
+
+    if ierr != MPI_SUCCESS:
+        raise MPIException(ierr)
@@ -0,0 +1,150 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Checkpoints of the per pair accumulators, so an interrupted run can be resumed
+
+Every rank writes its own checkpoint file (no communication is needed),
+alternating between two generations: a file is written under a temporary name and renamed,
+so when a run is killed during a checkpoint, the other generation is still complete.
+"""
+
+import os
+
+import h5py
+import numpy as n
+
+
+CHECKPOINT_GENERATIONS = 2
+
+# no checkpoint
+NO_ROUND = -1
+
+
+class Checkpoint(object):
+    """
+    Checkpoints of the statistics, the fail counts and (optionally) the schedule of one rank
+
+    the round of a checkpoint is the first round that still has to run
+    """
+
+    def __init__(self, prefix, rank, interval, logger=None):
+        self.log = logger
+
+        self.prefix = prefix
+        self.rank = rank
+        self.interval = interval
+
+        # the generation written last
+        self.generation = CHECKPOINT_GENERATIONS - 1
+
+    def filename(self, generation):
+        """the checkpoint file of generation"""
+        return '%s-ckpt%05d-%d.h5' % (self.prefix, self.rank, generation)
+
+    def due(self, runid):
+        """a checkpoint has to be written after round runid"""
+        return self.interval > 0 and (runid + 1) % self.interval == 0
+
+    def write(self, nextround, stats, fail, meta, pairs=None):
+        """
+        write a checkpoint to the oldest generation
+
+        Arguments:
+        nextround: the first round that still has to run
+        stats: a dict that maps the name of the dataset to a list of PairStats (one per messagesize)
+        fail: the fail counts of this rank with every partner
+        meta: a dict with the settings of the run, they have to be the same when resuming
+        pairs: the schedule of this rank (when it is changed during the run)
+        """
+        generation = (self.generation + 1) % CHECKPOINT_GENERATIONS
+        filename = self.filename(generation)
+        tmpfn = '%s.tmp' % filename
+
+        fh = h5py.File(tmpfn, 'w')
+        for k, v in meta.items():
+            fh.attrs[k] = v
+        fh.attrs['round'] = nextround
+        for name, sts in stats.items():
+            fh.create_dataset(name, data=n.array([st.getstate() for st in sts]))
+        fh.create_dataset('fail', data=fail)
+        if pairs is not None:
+            fh.create_dataset('pairs', data=pairs)
+        fh.close()
+        os.rename(tmpfn, filename)
+
+        self.generation = generation
+        if self.log:
+            self.log.debug("checkpoint of round %s written to %s", nextround, filename)
+
+    def rounds(self):
+        """the round of the checkpoint of every generation (NO_ROUND if there is none, or it can't be read)"""
+        res = []
+        for generation in range(CHECKPOINT_GENERATIONS):
+            try:
+                fh = h5py.File(self.filename(generation), 'r')
+                res.append(int(fh.attrs['round']))
+                fh.close()
+            except (IOError, OSError, KeyError) as err:
+                if self.log:
+                    self.log.debug("no checkpoint of generation %s: %s", generation, err)
+                res.append(NO_ROUND)
+        return res
+
+    def read(self, nextround, stats, meta):
+        """
+        restore stats (in place) from the checkpoint of round nextround,
+        the next checkpoint is written to the other generation
+
+        Returns the fail counts and the schedule (None if it is not in the checkpoint),
+        or None if the settings in meta differ from those of the checkpoint
+        """
+        generation = self.rounds().index(nextround)
+        fh = h5py.File(self.filename(generation), 'r')
+
+        for k, v in meta.items():
+            if k not in fh.attrs or not n.array_equal(fh.attrs[k], v):
+                if self.log:
+                    self.log.error("checkpoint %s: %s is %s, not %s", self.filename(generation), k,
+                                   fh.attrs.get(k), v)
+                fh.close()
+                return None
+
+        for name, sts in stats.items():
+            if name not in fh:
+                continue
+            for st, state in zip(sts, fh[name][:]):
+                st.setstate(state)
+        fail = fh['fail'][:]
+        pairs = fh['pairs'][:] if 'pairs' in fh else None
+        fh.close()
+
+        self.generation = generation
+        return fail, pairs
+
+    def remove(self):
+        """remove the checkpoint files"""
+        for generation in range(CHECKPOINT_GENERATIONS):
+            if os.path.exists(self.filename(generation)):
+                os.remove(self.filename(generation))
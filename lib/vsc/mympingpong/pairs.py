@@ -27,10 +27,8 @@
 
 Classes to generate pairs
 
-TODO:
- - faster generation of random pairs:
-  - have each rank generate a set of pairs, using as seed the main seed + the rank
-  - exchange (alltoall?) the generated pairs
+The pairs of a rank are generated by every rank (makepairs), or the complete pairs of every round
+are generated by one rank and exchanged (makepairsdistributed).
 """
 
 import copy
@@ -38,27 +36,169 @@ import re
 
 import numpy as n
 
+from vsc.mympingpong.topology import DISTANCES, Topology
 from vsc.utils.missing import get_subclasses
 
+# partner of a rank that is not active in a round (see Pair.setconcurrency), not a failure
+IDLE = -3
+
+# number of rounds of the schedule that are generated from the same seed (see roundkeys)
+SCHEDULE_BLOCK = 64
+
+# the random permutation of every round is a feistel network with this number of rounds
+FEISTEL_ROUNDS = 8
+
+# maximum number of times the conflicting pairs of a groupexcl round are paired again
+GROUPEXCL_PASSES = 50
+
+# number of rounds between two steering steps of the adaptive pairmode
+ADAPT_INTERVAL = 50
+
+# number of suspicious partners every rank proposes in a steering step of the adaptive pairmode
+ADAPT_CANDIDATES = 4
+
+
+def generator(seed, key):
+    """a random generator seeded with seed and key (e.g. a round), the same for all ranks"""
+    if hasattr(n.random, 'default_rng'):
+        return n.random.default_rng([seed, key])
+    else:
+        return n.random.RandomState([seed, key])
+
+
+def roundkeys(seed, block):
+    """
+    the keys of the random permutations of the SCHEDULE_BLOCK rounds of block, shape (SCHEDULE_BLOCK, FEISTEL_ROUNDS)
+
+    every block has its own generator, seeded with seed and block,
+    so the rounds can be generated in any order (and are the same for all ranks)
+    """
+    shape = (SCHEDULE_BLOCK, FEISTEL_ROUNDS)
+    gen = generator(seed, block)
+    if hasattr(gen, 'integers'):
+        return gen.integers(0, 2**63, shape, dtype=n.uint64)
+    else:
+        return gen.randint(0, 2**63, shape, dtype=n.uint64)
+
+
+def _mix(values, keys):
+    """the round function of the feistel network: the splitmix64 finalizer of values + keys"""
+    z = (values + keys) * n.uint64(0x9E3779B97F4A7C15)
+    z ^= z >> n.uint64(30)
+    z *= n.uint64(0xBF58476D1CE4E5B9)
+    z ^= z >> n.uint64(27)
+    z *= n.uint64(0x94D049BB133111EB)
+    z ^= z >> n.uint64(31)
+    return z
+
+
+def permute(values, keys, size, inverse=False):
+    """
+    apply the random permutation of range(size) given by keys (one row of keys per value) to values,
+    or its inverse
+
+    the permutation is a balanced feistel network on the smallest even number of bits that fits size,
+    values that end up outside range(size) are permuted again (cycle walking)
+    """
+    halfbits = n.uint64(max((int(size - 1).bit_length() + 1) // 2, 1))
+    mask = (n.uint64(1) << halfbits) - n.uint64(1)
+    order = range(FEISTEL_ROUNDS - 1, -1, -1) if inverse else range(FEISTEL_ROUNDS)
+
+    def feistel(vals, ks):
+        left = vals >> halfbits
+        right = vals & mask
+        for r in order:
+            if inverse:
+                left, right = right ^ (_mix(left, ks[:, r]) & mask), left
+            else:
+                left, right = right, left ^ (_mix(right, ks[:, r]) & mask)
+        return (left << halfbits) | right
+
+    keys = n.asarray(keys, n.uint64)
+    res = feistel(n.asarray(values, n.uint64), keys)
+    todo = n.where(res >= size)[0]
+    while todo.size:
+        res[todo] = feistel(res[todo], keys[todo])
+        todo = todo[res[todo] >= size]
+    return res.astype(int)
+
+
+class PropertyIndex(object):
+    """
+    integer index of the properties of all ranks in a cpumap (a list with a list of properties per rank)
+
+    codes: array with the property codes of every rank (one row per rank, padded with -1)
+    names: the property of every code (sorted)
+    the ranks with property code c are members[offsets[c]:offsets[c + 1]] (sorted)
+    """
+
+    def __init__(self, cpumap, mapfilter=None):
+        lengths = n.array([len(props) for props in cpumap], int)
+        flat = [prop for props in cpumap for prop in props]
+        owners = n.repeat(n.arange(len(cpumap)), lengths)
+
+        names, codes = n.unique(n.array(flat, dtype=str), return_inverse=True)
+        codes = codes.ravel()
+        if mapfilter:
+            # only keep the properties that match the mapfilter regex
+            reg = re.compile(r"" + mapfilter)
+            keep = n.array([bool(reg.search(name)) for name in names], bool)
+            newcodes = n.cumsum(keep) - 1
+            sel = keep[codes]
+            names, codes, owners = names[keep], newcodes[codes[sel]], owners[sel]
+        self.names = [str(name) for name in names]
+
+        self.codes = n.ones((len(cpumap), max(lengths.max(), 1) if lengths.size else 1), int) * -1
+        column = n.arange(owners.size) - n.searchsorted(owners, owners)
+        self.codes[owners, column] = codes
+
+        # the ranks per property, without duplicates
+        pairs = n.unique(n.column_stack([codes, owners]), axis=0) if owners.size else n.zeros((0, 2), int)
+        self.members = pairs[:, 1]
+        self.offsets = n.searchsorted(pairs[:, 0], n.arange(len(self.names) + 1))
+
+    def ranks(self, code):
+        """the sorted ranks with property code"""
+        return self.members[self.offsets[code]:self.offsets[code + 1]]
+
+    def sharing(self, rank):
+        """the sorted ranks that have at least one property of rank (including rank)"""
+        codes = self.codes[rank]
+        return n.unique(n.concatenate([self.ranks(code) for code in codes[codes >= 0]] + [n.zeros(0, int)]))
+
+    def conflicts(self, ranks1, ranks2):
+        """check for every pair of ranks1 and ranks2 if they have a property in common (negative ranks never do)"""
+        valid = (ranks1 >= 0) & (ranks2 >= 0)
+        codes1 = self.codes[n.where(valid, ranks1, 0)]
+        codes2 = self.codes[n.where(valid, ranks2, 0)]
+        same = (codes1[:, :, None] == codes2[:, None, :]) & (codes1[:, :, None] >= 0)
+        return valid & same.any(axis=2).any(axis=1)
+
 
 class Pair(object):
 
+    # can generate the pairs of all ranks of a round (see roundpairs)
+    DISTRIBUTED = False
+
     def __init__(self, seed=None, rng=None, pairid=None, logger=None):
 
         self.log = logger
 
         self.seed = None
-        self.nextseed = None
 
         self.rng = None
         self.origrng = None
 
         self.cpumap = None
         self.origmap = None
-        self.revmap = None
+        self.index = None
 
         self.pairid = None
 
+        # the row of the pair of the last new() in the pairs of that round
+        self.row = None
+        self.concurrency = None
+
         self.mode = self.__class__.__name__
 
         if rng:
@@ -81,13 +221,11 @@ class Pair(object):
         raise KeyError
 
     def setseed(self, seed=None):
-        """set the seed for n.random"""
+        """set the seed of the schedule (see roundrng), the global n.random state is not used"""
 
         if isinstance(seed, int):
-            n.random.seed(seed)
             self.seed = seed
-            self.nextseed = n.random.random_integers(10000000)
-            self.log.debug("Seed is %s. Nextseed is %s", self.seed, self.nextseed)
+            self.log.debug("Seed is %s", self.seed)
         else:
             self.log.debug("Seed: nothing done: %s (%s)", seed, type(seed))
 
@@ -104,6 +242,30 @@ class Pair(object):
         self.nr = nr
         self.log.debug("pairs: Number of samples: %s", nr)
 
+    def setconcurrency(self, levels):
+        """
+        limit the number of pairs that are active at the same time:
+        in round i, levels[i % len(levels)] pairs are active (0 is all pairs), the other ranks are IDLE
+        """
+        self.concurrency = levels
+        self.log.debug("pairs: setconcurrency: levels %s", levels)
+
+    def isactive(self, iterations, rows):
+        """
+        check if the pairs in rows (of the pairs of that round, -1 if unknown) are active in rounds iterations
+        a window of active rows rotates over the pairs of every round, so all pairs get their turn
+
+        Returns a boolean array
+        """
+        iterations = n.asarray(iterations)
+        if not self.concurrency:
+            return n.ones(iterations.shape, bool)
+
+        levels = n.array(self.concurrency)[iterations % len(self.concurrency)]
+        nrpairs = len(self.rng) // 2
+        first = (iterations * levels) % nrpairs
+        return (levels <= 0) | (levels >= nrpairs) | (rows < 0) | ((rows - first) % nrpairs < levels)
+
     def setrng(self, rng, start=0, step=1):
         """
         set self.rng
@@ -136,7 +298,11 @@ class Pair(object):
             self.log.info('filterrng: odd number of rng provided. Adding -2.')
 
     def setcpumap(self, cpumapin, rngfilter=None, mapfilter=None):
-        """set the cpumap and the revmap, apply filters when necessary"""
+        """
+        set the cpumap and build the property index, apply filters when necessary
+
+        mapfilter is a regex, only the properties that match it are indexed
+        """
 
         if cpumapin:
             if not self.origmap:
@@ -147,54 +313,16 @@ class Pair(object):
             else:
                 self.log.error("setcpumap: no map or origmap found")
 
-        if mapfilter:
-            self.cpumap = self.applymapfilter(mapfilter)
-        else:
-            self.cpumap = cpumapin
-
-        # Reverse map
-        self.revmap = {}
-        for ind, l in enumerate(self.cpumap):
-            for p in l:
-                if p not in self.revmap:
-                    self.revmap[p] = []
-                if ind in self.revmap[p]:
-                    self.log.error("setcpumap: already found id %s in revmap for property %s: %s", ind, p, self.revmap)
-                else:
-                    self.revmap[p].append(ind)
-        self.log.debug("pairs: setcpumap: revmap is %s", self.revmap)
-
-        if rngfilter:
-            self.applyrngfilter(rngfilter)
-
-    def applymapfilter(self, dictin, mapfilter=None):
-        """
-        filter out the keyvalue pairs in dictin that contain $mapfilter
-        mapfilter is currently never used, so this block can be discarded if the feature is scrapped
-        """
-
-        dictout = {}
-
-        self.log.debug("pairs: applymapfilter: mapfilter %s" % mapfilter)
+        self.cpumap = cpumapin
         try:
-            reg = re.compile(r"" + mapfilter)
+            self.index = PropertyIndex(self.cpumap, mapfilter)
         except re.error as err:
-            self.log.error("applymapfilter: problem with compiling the regex for mapfilter %s:%s", mapfilter, err)
-
-        for k, els in dictin.items():
-            if isinstance(els, list):
-                newl = els
-            else:
-                newl = [els]
+            self.log.error("setcpumap: problem with compiling the regex for mapfilter %s: %s", mapfilter, err)
+            self.index = PropertyIndex(self.cpumap)
+        self.log.debug("pairs: setcpumap: %s properties (mapfilter %s)", len(self.index.names), mapfilter)
 
-            dictout[k] = []
-            for el in newl:
-                if mapfilter and not reg.search(el):
-                    continue
-                dictout[k].append(el)
-
-        self.log.debug("pairs: applymapfilter: map is %s (orig: %s)", dictout, dictin)
-        return dictout
+        if rngfilter:
+            self.applyrngfilter(rngfilter)
 
     def applyrngfilter(self, rngfilter):
         """
@@ -207,34 +335,20 @@ class Pair(object):
         """
 
         self.log.debug("pairs: applyrngfilter: rngfilter %s", rngfilter)
-        try:
-            props = self.cpumap[self.pairid]
-        except KeyError as _:
-            props = []
+        if 0 <= self.pairid < len(self.index.codes):
+            ids = n.intersect1d(self.index.sharing(self.pairid), self.rng)
+        else:
+            ids = n.zeros(0, int)
             self.log.debug("pairs: No props found for id %s", self.pairid)
-
-        ids = []
-        for p in props:
-            for x in self.revmap[p]:
-                if (x in self.rng) and (x not in ids):
-                    ids.append(x)
-        ids.sort()
-        self.log.debug("pairs: applyrngfilter: props %s ids %s", props, ids)
+        self.log.debug("pairs: applyrngfilter: ids %s", ids)
 
         if rngfilter == 'incl':
             # use only these ids to make pairs
-            self.setrng(ids)
+            self.setrng(ids.tolist())
         elif rngfilter == 'excl':
             self.log.error("attempted to use %s rngfilter, which is not correctly implemented", rngfilter)
-            new = []
-            for x in self.rng:
-                if x not in ids:
-                    new.append(x)
-            if self.pairid not in new:
-                new.append(self.pairid)
-            new.sort()
-
-            self.setrng(new)
+            new = n.setdiff1d(self.rng, ids)
+            self.setrng(n.union1d(new, [self.pairid]).tolist())
         elif rngfilter == 'groupexcl':
             # do nothing
             self.log.debug('pairs: applyrngfilter: rngfilter %s: do nothing', rngfilter)
@@ -255,113 +369,501 @@ class Pair(object):
             return res
 
         rngarray = n.array(self.rng)
-        for i in range(self.nr):
-            res[i] = self.new(rngarray, i)
+        iterations = n.arange(self.nr)
+        res, rows = self.newbatch(rngarray, iterations)
+        res[~self.isactive(iterations, rows)] = [self.pairid, IDLE]
 
         self.log.debug("pairs: makepairs %s returns\n%s", self.pairid, res.transpose())
         return res
 
+    def makepairsdistributed(self, comm):
+        """
+        like makepairs, but every rank of comm generates the complete pairs of a part of the rounds
+        (round i is generated by rank i % size) and the pairs of every rank are exchanged with an alltoall
+
+        only possible if all ranks of comm pair with all ranks (no rngfilter)
+        and the pairmode can generate the pairs of all ranks of a round (roundpairs),
+        otherwise (on all ranks) the same as makepairs
+        """
+        size = comm.Get_size()
+        rank = comm.Get_rank()
+
+        possible = self.DISTRIBUTED and self.rng == list(range(size))
+        if comm.allreduce(int(possible)) < size:
+            self.log.debug("pairs: makepairsdistributed: not possible for %s, using makepairs", self.mode)
+            return self.makepairs()
+
+        self.filterrng()
+        rngarray = n.array(self.rng)
+
+        # the partners (and the row of the pair in its round) of all ranks for every round of this rank
+        nrrounds = -(-self.nr // size)
+        table = n.ones((size, nrrounds, 3), int) * -1
+        for i, iteration in enumerate(range(rank, self.nr, size)):
+            pairs = self.roundpairs(rngarray, iteration)
+            flat = pairs.ravel()
+            valid = n.where((flat >= 0) & (flat < size))[0]
+            table[flat[valid], i, :2] = pairs[valid // 2]
+            table[flat[valid], i, 2] = valid // 2
+
+        # received[j][i] is round j + i * size
+        received = n.empty_like(table)
+        comm.Alltoall(table, received)
+
+        iterations = n.arange(self.nr)
+        received = received.transpose(1, 0, 2).reshape(-1, 3)[iterations]
+        res, rows = received[:, :2].copy(), received[:, 2]
+        res[~self.isactive(iterations, rows)] = [self.pairid, IDLE]
+
+        self.log.debug("pairs: makepairsdistributed %s returns\n%s", self.pairid, res.transpose())
+        return res
+
+    def roundpairs(self, rngarray, iteration):  # pylint: disable-msg=W0613
+        """the complete pairs of all ranks in rngarray in round iteration, an array with a pair per row"""
+        self.log.error("roundpairs not implemented for mode %s", self.mode)
+
+    def newbatch(self, rngarray, iterations):
+        """
+        the pairs with self.pairid for all rounds in iterations, and the rows of these pairs in their round
+        (by default, new is called for every round)
+        """
+        res = n.ones((len(iterations), 2), int) * -1
+        rows = n.ones(len(iterations), int) * -1
+        for i, iteration in enumerate(iterations):
+            self.row = None
+            res[i] = self.new(rngarray, iteration)
+            if self.row is not None:
+                rows[i] = self.row
+        return res, rows
+
     def new(self, rngarray, iteration):  # pylint: disable-msg=W0613
         self.log.error("New not implemented for mode %s", self.mode)
 
+    def myindex(self, rngarray):
+        """the index of self.pairid in rngarray (None if it is not in there)"""
+        index = n.where(rngarray == self.pairid)[0]
+        if index.size == 0:
+            self.log.error("myindex: failed to find id %s in %s", self.pairid, rngarray)
+            return None
+        return index[0]
+
 
 class Shift(Pair):
     """iterate through rng to find the next random number"""
 
-    def new(self, rngarray, iteration):
-        # shift through rngarray and convert to a matrix with height = len(self.rng)/2 and width = 2
-        b = n.roll(rngarray, self.offset + iteration).reshape(len(self.rng) // 2, 2)
+    DISTRIBUTED = True
 
-        try:
-            # n.where(b == self.pairid)[0] returns a list of indices of the elements in b that equal pairid
-            # b[n.where(b == self.pairid)[0][0]] is the first element of b that equals pairid
-            res = b[n.where(b == self.pairid)[0][0]]
-        except IndexError as _:
-            self.log.error("new: failed to pick element for id %s from %s", self.pairid, b)
-        return res
+    def newbatch(self, rngarray, iterations):
+        """
+        shift through rngarray and pair the elements 2k and 2k+1 (rows k) of every shifted array
+
+        the shifted array of round i is n.roll(rngarray, self.offset + i), so the pairs follow from index math
+        """
+        size = rngarray.size
+        res = n.ones((len(iterations), 2), int) * -1
+        rows = n.ones(len(iterations), int) * -1
+
+        index = self.myindex(rngarray)
+        if index is None:
+            return res, rows
+
+        # element j of the shifted array is rngarray[(j - shift) % size]
+        shifts = self.offset + n.asarray(iterations)
+        rows = ((index + shifts) % size) // 2
+        res = rngarray[n.column_stack([(2 * rows - shifts) % size, (2 * rows + 1 - shifts) % size])]
+        return res, rows
+
+    def roundpairs(self, rngarray, iteration):
+        return n.roll(rngarray, self.offset + iteration).reshape(-1, 2)
+
+    def new(self, rngarray, iteration):
+        res, rows = self.newbatch(rngarray, [iteration])
+        self.row = rows[0]
+        return res[0]
 
 
 class Shuffle(Pair):
     """shuffle rng to find the next random number"""
 
+    DISTRIBUTED = True
+
+    def newbatch(self, rngarray, iterations):
+        """
+        pair the elements at positions 2k and 2k+1 (rows k) of a random permutation of rngarray for every round
+
+        only the position of self.pairid (the permutation) and the element at the neighbouring position
+        (the inverse permutation) are computed, for all rounds at once
+        """
+        size = rngarray.size
+        iterations = n.asarray(iterations)
+        res = n.ones((len(iterations), 2), int) * -1
+        rows = n.ones(len(iterations), int) * -1
+
+        index = self.myindex(rngarray)
+        if index is None:
+            return res, rows
+
+        keys = self.keys(iterations)
+        positions = permute(n.ones(len(iterations), int) * index, keys, size)
+        partners = permute(positions ^ 1, keys, size, inverse=True)
+        rows = positions // 2
+
+        odd = (positions % 2).astype(bool)
+        res = rngarray[n.column_stack([n.where(odd, partners, index), n.where(odd, index, partners)])]
+        return res, rows
+
+    def roundpairs(self, rngarray, iteration):
+        # the element at every position is given by the inverse permutation
+        keys = n.tile(self.keys([iteration]), (rngarray.size, 1))
+        return rngarray[permute(n.arange(rngarray.size), keys, rngarray.size, inverse=True)].reshape(-1, 2)
+
+    def keys(self, iterations):
+        """the keys of the permutations of the rounds in iterations"""
+        iterations = n.asarray(iterations)
+        blocks = iterations // SCHEDULE_BLOCK
+        keys = n.zeros((len(iterations), FEISTEL_ROUNDS), n.uint64)
+        for block in n.unique(blocks):
+            sel = blocks == block
+            keys[sel] = roundkeys(self.seed or 0, block)[iterations[sel] % SCHEDULE_BLOCK]
+        return keys
+
     def new(self, rngarray, iteration):
+        res, rows = self.newbatch(rngarray, [iteration])
+        self.row = rows[0]
+        return res[0]
 
-        n.random.shuffle(rngarray)
 
-        # convert to matrix with height len(self.rng)/2 and width 2
-        b = rngarray.reshape(len(self.rng) // 2, 2)
+class Adaptive(Shuffle):
+    """
+    shuffle, but every interval rounds the ranks exchange their most suspicious partners (see suspicious)
+    and every other round of the next interval pairs them (see steer)
+    """
 
-        try:
-            res = b[n.where(b == self.pairid)[0][0]]
-        except IndexError as _:
-            self.log.error("new: failed to pick element for id %s from %s", self.pairid, b)
+    def __init__(self, *args, **kwargs):
+        super(Adaptive, self).__init__(*args, **kwargs)
+        self.interval = ADAPT_INTERVAL
+
+    def setinterval(self, interval):
+        """set the number of rounds between two steering steps"""
+        self.interval = interval
+        self.log.debug("pairs: setinterval: %s", interval)
+
+    def suspicious(self, count, mean, stdev, nrcandidates=ADAPT_CANDIDATES):
+        """
+        the nrcandidates partners with the highest score, from the count, mean and stdev of the timings per partner
+
+        the score (mean + stdev) / (median of the means) / sqrt(count) is high for partners with
+        a high latency, a high variance or few samples; partners without samples are not scored
+
+        Returns an array with a (partner, score) row per candidate, padded with (-1, 0)
+        """
+        count, mean, stdev = n.asarray(count), n.asarray(mean, float), n.asarray(stdev, float)
+        res = n.zeros((nrcandidates, 2), float)
+        res[:, 0] = -1
+
+        seen = n.where(count > 0)[0]
+        ref = n.median(mean[seen]) if seen.size else 0
+        if ref <= 0:
+            return res
+
+        scores = (mean[seen] + stdev[seen]) / ref / n.sqrt(count[seen])
+        best = n.argsort(-scores, kind='stable')[:nrcandidates]
+        res[:best.size, 0] = seen[best]
+        res[:best.size, 1] = scores[best]
         return res
 
+    def steer(self, candidates, iterations):
+        """
+        the pairs with self.pairid (and their rows) for the steered rounds in iterations (every other round),
+        from the candidates of all ranks (candidates[rank] is the result of suspicious on that rank)
+
+        all ranks get the same candidates, so they all compute the same (perfect) matchings
+        """
+        iterations = n.asarray(iterations)[1::2]
+        self.filterrng()
+        rngarray = n.array(self.rng)
+        res = n.ones((len(iterations), 2), int) * -1
+        rows = n.ones(len(iterations), int) * -1
+
+        if self.myindex(rngarray) is None:
+            return iterations, res, rows
+
+        candidates = n.asarray(candidates)
+        src = n.repeat(n.arange(len(candidates)), candidates.shape[1])
+        dst = candidates[:, :, 0].ravel().astype(int)
+        weights = candidates[:, :, 1].ravel()
+        valid = (weights > 0) & n.isin(src, rngarray) & n.isin(dst, rngarray) & (src != dst)
+        src, dst, weights = src[valid], dst[valid], weights[valid]
+
+        for i, iteration in enumerate(iterations):
+            pairs, chosen = self.heavymatching(rngarray, src, dst, weights, iteration)
+            # the next rounds prefer the candidates that were not sampled yet
+            weights[chosen] /= 2
+            rows[i] = n.where((pairs == self.pairid).any(axis=1))[0][0]
+            res[i] = pairs[rows[i]]
+
+        res[~self.isactive(iterations, rows)] = [self.pairid, IDLE]
+        return iterations, res, rows
+
+    def heavymatching(self, rngarray, src, dst, weights, iteration):
+        """
+        the pairs of all ranks in rngarray in round iteration: first a greedy matching of the candidate pairs
+        (src, dst) with the highest weights, the remaining ranks are paired randomly
+
+        the greedy matching takes all locally heaviest pairs (the heaviest pair of both its ranks) at once,
+        until no candidate pair is left
+
+        Returns the pairs and the indices of the candidates that were paired
+        """
+        gen = generator(self.seed or 0, iteration)
+        # random tie breaks, so equal weights are not always resolved in the same way
+        ranking = n.lexsort((gen.permutation(src.size), weights))
+        order = n.empty(src.size, int)
+        order[ranking] = n.arange(src.size)
+
+        paired = n.zeros(0, int)
+        free = n.ones(src.size, bool)
+        while free.any():
+            ids = n.where(free)[0]
+            ends = n.concatenate([src[ids], dst[ids]])
+            both = n.concatenate([ids, ids])
+            # the heaviest candidate of every rank
+            sel = n.lexsort((-order[both], ends))
+            ranks, first = n.unique(ends[sel], return_index=True)
+            best = both[sel][first]
+            heaviest = ids[(best[n.searchsorted(ranks, src[ids])] == ids) &
+                           (best[n.searchsorted(ranks, dst[ids])] == ids)]
+            paired = n.concatenate([paired, heaviest])
+            matched = n.concatenate([src[heaviest], dst[heaviest]])
+            free &= ~(n.isin(src, matched) | n.isin(dst, matched))
+
+        pairs = n.column_stack([src[paired], dst[paired]])
+        single = gen.permutation(n.setdiff1d(rngarray, pairs.ravel()))
+        return n.concatenate([pairs, single.reshape(-1, 2)]), paired
+
+
+class Roundrobin(Pair):
+    """
+    round-robin tournament (circle method): every pair of ranks exactly once in every len(rng) - 1 rounds,
+    the rounds after that repeat the schedule with the other rank of every pair sending first
+
+    all ordered pairs are covered in 2 * (len(rng) - 1) rounds, the minimum
+    with an odd number of ranks, the rank paired with the filler (-2) has a bye: it is IDLE in that round
+    """
+
+    DISTRIBUTED = True
+
+    def newbatch(self, rngarray, iterations):
+        """
+        with m = len(rngarray), the last element is fixed and paired with element r = round % (m - 1),
+        the other pairs of the round are (r + k) % (m - 1) and (r - k) % (m - 1) (row k)
+        """
+        iterations = n.asarray(iterations)
+        res = n.ones((len(iterations), 2), int) * -1
+        rows = n.ones(len(iterations), int) * -1
+
+        index = self.myindex(rngarray)
+        if index is None:
+            return res, rows
+
+        circle = rngarray.size - 1
+        rnd = iterations % circle
+        fixed = (index == circle) | (index == rnd)
+
+        # the partner of index in the circle is (2r - index) % (m - 1), index is first if it is r + k
+        offset = (index - rnd) % circle
+        partners = n.where(fixed, n.where(index == circle, rnd, circle), (2 * rnd - index) % circle)
+        first = n.where(fixed, circle, n.where(offset <= circle // 2, index, partners))
+        second = n.where(fixed, rnd, n.where(offset <= circle // 2, partners, index))
+        rows = n.where(fixed, 0, n.minimum(offset, circle - offset))
+
+        # reverse the direction every other pass
+        reverse = (iterations // circle) % 2 == 1
+        res = rngarray[n.column_stack([n.where(reverse, second, first), n.where(reverse, first, second)])]
+        res[res == -2] = IDLE
+        return res, rows
+
+    def roundpairs(self, rngarray, iteration):
+        circle = rngarray.size - 1
+        rnd = iteration % circle
+        k = n.arange(1, rngarray.size // 2)
+        pairs = n.column_stack([n.concatenate([[circle], (rnd + k) % circle]),
+                                n.concatenate([[rnd], (rnd - k) % circle])])
+        if (iteration // circle) % 2 == 1:
+            pairs = pairs[:, ::-1]
+        pairs = rngarray[pairs]
+        pairs[pairs == -2] = IDLE
+        return pairs
+
+    def new(self, rngarray, iteration):
+        res, rows = self.newbatch(rngarray, [iteration])
+        self.row = rows[0]
+        return res[0]
+
 
 class Groupexcl(Pair):
+    """pair ranks that have no property in common (e.g. are on different nodes)"""
+
+    DISTRIBUTED = True
+
+    def newbatch(self, rngarray, iterations):
+        res = n.ones((len(iterations), 2), int) * -1
+        rows = n.ones(len(iterations), int) * -1
+
+        if self.myindex(rngarray) is None:
+            return res, rows
+
+        for i, iteration in enumerate(iterations):
+            pairs = self.matching(rngarray, iteration)
+            rows[i] = n.where((pairs == self.pairid).any(axis=1))[0][0]
+            res[i] = pairs[rows[i]]
+        return res, rows
+
+    def new(self, rngarray, iteration):
+        res, rows = self.newbatch(rngarray, [iteration])
+        self.row = rows[0]
+        return res[0]
 
-    def new(self, rngar, iteration):
-
-        # reseed deterministically because the run of this function is not equal for all values of self.id
-        self.setseed(self.nextseed)
-
-        rngarray = rngar.copy()
-        while rngarray.size > 0:
-            n.random.shuffle(rngarray)
-            luckyid = rngarray[0]
-
-            try:
-                props = self.cpumap[luckyid]
-            except IndexError as _:
-                props = []
-                self.log.debug("pairs: new: No props found for id %s", luckyid)
-            ids = []
-            for p in props:
-                for x in self.revmap[p]:
-                    if (x in rngarray) and (x not in ids):
-                        ids.append(x)
-            neww = []
-            for x in rngarray:
-                if x == luckyid:
-                    continue
-                if x not in ids:
-                    neww.append(x)
-            neww.sort()
-
-            if len(neww) == 0:
-                otherluckyid = -1
+    def roundpairs(self, rngarray, iteration):
+        return self.matching(rngarray, iteration)
+
+    def matching(self, rngarray, iteration):
+        """
+        the pairs of all ranks in rngarray in round iteration, no pair has a property in common
+
+        the ranks are paired randomly, then the conflicting pairs are coupled with each other (even passes)
+        or with random pairs (odd passes), and a couple swaps partners if that gives 2 pairs without conflict;
+        the ranks of the pairs that still conflict after GROUPEXCL_PASSES are paired with -1
+        """
+        gen = generator(self.seed or 0, iteration)
+        pairs = gen.permutation(rngarray).reshape(-1, 2)
+        nrcouples = len(pairs) // 2
+
+        bad = self.index.conflicts(pairs[:, 0], pairs[:, 1])
+        for npass in range(GROUPEXCL_PASSES):
+            if not bad.any() or nrcouples == 0:
+                break
+            if npass % 2 == 0:
+                couples = gen.permutation(n.where(bad)[0])
             else:
-                z = n.array(neww)
-                n.random.shuffle(z)
-                otherluckyid = z[0]
-
-            self.log.debug("pairs: new: id %s: Found other luckyid %s for luckyid %s",
-                           self.pairid, otherluckyid, luckyid)
-            if self.pairid in [luckyid, otherluckyid]:
-                return n.array([luckyid, otherluckyid])
+                couples = gen.permutation(len(pairs))
+            couples = couples[:couples.size // 2 * 2].reshape(-1, 2)
+            couples = couples[bad[couples].any(axis=1)]
+            done = self.swap(pairs, couples[:, 0], couples[:, 1])
+            bad[couples[done].ravel()] = False
+
+        if not bad.any():
+            return pairs
+
+        self.log.debug("pairs: matching: no partner found for %s in round %s", pairs[bad].ravel(), iteration)
+        single = pairs[bad].reshape(-1, 1)
+        return n.concatenate([pairs[~bad], n.column_stack([single, -n.ones_like(single)])])
+
+    def swap(self, pairs, first, second, conflicts=None):
+        """
+        swap the partners of the pairs first and second (index arrays) where both new pairs have no conflict
+        (conflicts is a function of 2 arrays of ranks, default: a property in common)
+
+        Returns a boolean array, True where the partners were swapped
+        """
+        (a, b), (c, d) = pairs[first].T, pairs[second].T
+        conflicts = conflicts or self.index.conflicts
+        cross = ~conflicts(a, c) & ~conflicts(b, d)
+        straight = ~cross & ~conflicts(a, d) & ~conflicts(b, c)
+        pairs[first[cross]] = n.column_stack([a, c])[cross]
+        pairs[second[cross]] = n.column_stack([b, d])[cross]
+        pairs[first[straight]] = n.column_stack([a, d])[straight]
+        pairs[second[straight]] = n.column_stack([c, b])[straight]
+        return cross | straight
+
+
+class Distance(Groupexcl):
+    """
+    pair ranks at one distance class (see vsc.mympingpong.topology.DISTANCES), cycling over a list of classes
+    every round; the ranks without a partner at the distance of a round are idle
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.topology = None
+        self.distances = list(DISTANCES)
+        super(Distance, self).__init__(*args, **kwargs)
+
+    def setdistances(self, distances):
+        """set the distance classes, round i pairs ranks at distance distances[i % len(distances)]"""
+        unknown = [dist for dist in distances if dist not in DISTANCES]
+        if unknown or not distances:
+            self.log.error("setdistances: unknown distances %s, known are %s", unknown, DISTANCES)
+        else:
+            self.distances = list(distances)
+        self.log.debug("pairs: setdistances: %s", self.distances)
+
+    def setcpumap(self, cpumapin, rngfilter=None, mapfilter=None):
+        """set the cpumap and build the topology"""
+        super(Distance, self).setcpumap(cpumapin, rngfilter=rngfilter, mapfilter=mapfilter)
+        self.topology = Topology.fromcpumap(self.cpumap)
+
+    def matching(self, rngarray, iteration):
+        """
+        the pairs of all ranks in rngarray in round iteration, all at the distance of that round
+
+        the ranks are paired randomly within their group (see Topology.group), then the pairs at
+        another distance are coupled with pairs of the same group and swap partners (see Groupexcl.matching)
+        """
+        distance = DISTANCES.index(self.distances[iteration % len(self.distances)])
+        gen = generator(self.seed or 0, iteration)
+
+        def conflicts(ranks1, ranks2):
+            return self.topology.distance(ranks1, ranks2) != distance
+
+        def bygroup(ids):
+            # a random order of pair ids in which the pairs of the same group are next to each other
+            return ids[n.argsort(self.topology.group(pairs[ids, 0], distance), kind='stable')]
+
+        ranks = gen.permutation(rngarray[rngarray >= 0])
+        groups = self.topology.group(ranks, distance)
+        ranks = ranks[n.argsort(groups, kind='stable')]
+        groups = n.sort(groups)
+        # the last rank of a group with an odd size has no partner in its group
+        start, end = n.searchsorted(groups, groups), n.searchsorted(groups, groups, side='right')
+        single = (n.arange(ranks.size) == end - 1) & ((end - start) % 2 == 1)
+        pairs = ranks[~single].reshape(-1, 2)
+        idle = list(ranks[single])
+
+        bad = conflicts(pairs[:, 0], pairs[:, 1])
+        for npass in range(GROUPEXCL_PASSES):
+            if not bad.any() or len(pairs) < 2:
+                break
+            if npass % 2 == 0:
+                couples = bygroup(gen.permutation(n.where(bad)[0]))
             else:
-                for iidd in [luckyid, otherluckyid]:
-                    rngarray = n.delete(rngarray, n.where(rngarray == iidd)[0])
+                couples = bygroup(gen.permutation(len(pairs)))
+            couples = couples[:couples.size // 2 * 2].reshape(-1, 2)
+            couples = couples[bad[couples].any(axis=1)]
+            done = self.swap(pairs, couples[:, 0], couples[:, 1], conflicts=conflicts)
+            bad[couples[done].ravel()] = False
+
+        idle = n.concatenate([idle, pairs[bad].ravel()]).astype(int)
+        return n.concatenate([pairs[~bad], n.column_stack([idle, n.ones_like(idle) * IDLE])])
 
 
 class Hwloc(Shuffle):
 
+    # the rounds have different rngs
+    DISTRIBUTED = False
+
     def makepairs(self):
         """
-        Cycle through all core ids
-        - restore origrng and reapply map with new hwloc filter
+        Cycle through all hwloc properties, every subgroup of rounds
+        - only the ranks with that hwloc property are paired (shuffled), the other ranks are idle
         - repeat ad nauseam
 
         This assumes that all cpus have same hwloc info
         """
-        # from origmap, get all hwloc values
-        hwlocs = []
-        for vs in self.origmap.values():
-            for v in vs:
-                if v.startswith('hwloc'):
-                    hwlocs.append(v)
-        hwlocs.sort()
-        self.log.debug("pairs: makepairs: hwlocs %s" % hwlocs)
+        hwlocs = [code for code, name in enumerate(self.index.names) if name.startswith('hwloc')]
+        self.log.debug("pairs: makepairs: hwlocs %s", [self.index.names[code] for code in hwlocs])
+        if not hwlocs:
+            self.log.error("makepairs: no hwloc properties found in cpumap, not pairing on hwloc")
+            return super(Hwloc, self).makepairs()
 
         res = n.ones((self.nr, 2), int) * -1
 
@@ -369,23 +871,25 @@ class Hwloc(Shuffle):
             self.log.debug("pairs: makepairs: %s not in list of ranks", self.pairid)
             return res
 
-        hwlocid = 0
+        origrng = n.array(self.origrng)
+        mycodes = self.index.codes[self.pairid]
 
         subgroup = 10
-        for i in range(self.nr // subgroup):
-            # restore rng
-            self.rng = copy.deepcopy(self.origrng)
-
-            # remap
-            self.setcpumap(None, rngfilter='incl', mapfilter=hwlocs[hwlocid])
-
+        for start in range(0, self.nr, subgroup):
+            iterations = n.arange(start, min(start + subgroup, self.nr))
+            code = hwlocs[(start // subgroup) % len(hwlocs)]
+            if code not in mycodes:
+                res[iterations] = [self.pairid, IDLE]
+                continue
+
+            self.rng = n.intersect1d(origrng, self.index.ranks(code)).tolist()
             self.filterrng()
 
-            a = n.array(self.rng)
-            for j in range(subgroup):
-                res[i * subgroup + j] = self.new(a, i * subgroup + j)
+            pairs, rows = self.newbatch(n.array(self.rng), iterations)
+            pairs[~self.isactive(iterations, rows)] = [self.pairid, IDLE]
+            res[iterations] = pairs
 
-            hwlocid = (hwlocid + 1) % (len(hwlocs))
+        self.rng = copy.deepcopy(self.origrng)
 
         self.log.debug("pairs: makepairs %s returns\n%s", self.pairid, res.transpose())
         return res
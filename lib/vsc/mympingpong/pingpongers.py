@@ -34,8 +34,19 @@ import copy
 import numpy
 
 from mpi4py import MPI
+from vsc.mympingpong.timers import TIMERS
 from vsc.utils.missing import get_subclasses
 
+try:
+    from vsc.mympingpong import _pingpong
+except ImportError:
+    # the compiled kernel is optional
+    _pingpong = None
+
+
+# the pingpongmodes that measure latency, the classes are PingPongSR<mode> and PingPongRS<mode>
+LATENCY_MODES = ['', 'fast', 'fast2', 'U10', 'persist', 'kernel']
+
 
 class PingPongSR(object):
     """standard pingpong"""
@@ -65,6 +76,8 @@ class PingPongSR(object):
         self.start = None
         self.end = None
 
+        self.timer = MPI.Wtime
+
         self.setsr()
 
         self.setcomm()
@@ -78,6 +91,29 @@ class PingPongSR(object):
                 return cls(comm, p, log)
         raise KeyError
 
+    @staticmethod
+    def available(pmode, comm, log):
+        """
+        check if both sides of pingpongmode pmode can be used with comm
+        (e.g. the patched mpi4py or the compiled kernel might be missing)
+        """
+        try:
+            for pptype in ['SR', 'RS']:
+                PingPongSR.pingpongfactory(pptype + pmode, comm, comm.Get_rank(), log)
+        except (AttributeError, ImportError, KeyError) as err:
+            log.debug("pingpongmode %s is not available: %s (%s)", pmode, err, type(err).__name__)
+            return False
+        return True
+
+    def settimer(self, timer):
+        """
+        time with timer (a name from TIMERS)
+
+        Returns the name of the timer that is used
+        """
+        self.timer = TIMERS[timer]
+        return timer
+
     def setsr(self):
         self.send = self.comm.Send
         self.recv = self.comm.Recv
@@ -92,20 +128,33 @@ class PingPongSR(object):
 
     def setit(self, it, group=None):  # pylint: disable-msg=W0613
         self.it = it
+        self.group = 1
         self.start = numpy.zeros(it, float)
         self.end = numpy.zeros(it, float)
 
+    def dowarmup(self, it, group=None):
+        """do it untimed pingpongs (or windows, exchanges) before the timed ones"""
+        if it:
+            if group:
+                self.dopingpong(it, group)
+            else:
+                self.dopingpong(it)
+
     def dopingpong(self, it=None, group=None):  # pylint: disable-msg=W0613
         if it:
             self.setit(it)
 
         for x in range(self.it):
-            self.start[x] = MPI.Wtime()
+            self.start[x] = self.timer()
             self.run1(self.sndbuf, self.other, self.tag1)
             self.run2(self.rcvbuf, self.other, self.tag2)
-            self.end[x] = MPI.Wtime()
+            self.end[x] = self.timer()
 
-        return numpy.average((self.end - self.start) / (2.0 * self.group))
+        return numpy.average(self.timings())
+
+    def timings(self):
+        """return the (one-way) latency of every group of the last dopingpong"""
+        return (self.end - self.start) / (2.0 * self.group)
 
 
 class PingPongRS(PingPongSR):
@@ -126,6 +175,12 @@ class PingPongSRfast(PingPongSR):
     def setcomm(self):
         self.run1 = self.send
 
+    def settimer(self, timer):
+        """the patched mpi4py always times with MPI.Wtime"""
+        if timer != 'wtime':
+            self.log.debug("settimer: timer %s is not supported, using wtime", timer)
+        return 'wtime'
+
     def setit(self, itall, group=None):
         it = itall // group
         self.group = group
@@ -162,7 +217,7 @@ class PingPongSRfast(PingPongSR):
             self.start[x] = start
             self.end[x] = end
 
-        return numpy.average((self.end - self.start) / (2.0 * self.group))
+        return numpy.average(self.timings())
 
 
 class PingPongRSfast(PingPongSRfast):
@@ -215,6 +270,280 @@ class PingPongRSfast2(PingPongRSfast):
         self.recv = self.comm.PingpongRS25
 
 
+class PingPongSRpersist(PingPongSR):
+    """
+    pingpong with persistent requests, for (unpatched) mpi4py
+
+    the iterations are timed per group of (at most) group pingpongs
+    """
+
+    def __init__(self, comm, other, logger):
+        super(PingPongSRpersist, self).__init__(comm, other, logger)
+        self.counts = None
+        self.sreq = None
+        self.rreq = None
+
+    def setsr(self):
+        self.send = self.comm.Send_init
+        self.recv = self.comm.Recv_init
+
+    def setit(self, itall, group=None):
+        self.it = itall
+        self.group = min(group, itall)
+        # the last group holds the remainder
+        nrgroups = -(-itall // self.group)
+        self.counts = numpy.ones(nrgroups, numpy.intp) * self.group
+        self.counts[-1] = itall - (nrgroups - 1) * self.group
+        self.start = numpy.zeros(nrgroups, float)
+        self.end = numpy.zeros(nrgroups, float)
+
+    def setreqs(self):
+        """create the persistent requests"""
+        self.sreq = self.send(self.sndbuf, self.other, self.tag1)
+        self.rreq = self.recv(self.rcvbuf, self.other, self.tag2)
+
+    def freereqs(self):
+        """free the persistent requests"""
+        for req in [self.sreq, self.rreq]:
+            req.Free()
+        self.sreq = None
+        self.rreq = None
+
+    def dogroup(self, count):
+        """do count pingpongs: send and wait for the answer"""
+        reqs = [self.rreq, self.sreq]
+        startall = MPI.Prequest.Startall
+        waitall = MPI.Request.Waitall
+        for _ in range(count):
+            startall(reqs)
+            waitall(reqs)
+
+    def dopingpong(self, it=None, group=25):
+        if self.groupforce:
+            group = self.groupforce
+
+        if it is not None:
+            self.setit(it, group)
+
+        self.setreqs()
+        for x, count in enumerate(self.counts):
+            self.start[x] = self.timer()
+            self.dogroup(count)
+            self.end[x] = self.timer()
+        self.freereqs()
+
+        return numpy.average(self.timings())
+
+    def timings(self):
+        """return the (one-way) latency of every group of the last dopingpong"""
+        return (self.end - self.start) / (2.0 * self.counts)
+
+
+class PingPongRSpersist(PingPongSRpersist):
+    """receive-send with persistent requests"""
+
+    def setreqs(self):
+        """create the persistent requests, the receive matches the send of the other side"""
+        self.sreq = self.send(self.sndbuf, self.other, self.tag2)
+        self.rreq = self.recv(self.rcvbuf, self.other, self.tag1)
+
+    def dogroup(self, count):
+        """do count pingpongs: wait for the message and answer"""
+        sreq = self.sreq
+        rreq = self.rreq
+        for _ in range(count):
+            rreq.Start()
+            rreq.Wait()
+            sreq.Start()
+            sreq.Wait()
+
+
+class PingPongSRkernel(PingPongSRpersist):
+    """
+    pingpong in the compiled kernel vsc.mympingpong._pingpong (no patched mpi4py needed)
+
+    any group size is possible, group 1 gives the timing of every single pingpong
+    warmup pingpongs are done (untimed) before the timed groups
+    """
+
+    def __init__(self, comm, other, logger):
+        super(PingPongSRkernel, self).__init__(comm, other, logger)
+        self.warmup = 0
+        self.monotonic = False
+
+    def settimer(self, timer):
+        """the kernel uses MPI_Wtime or the monotonic clock (the clock of perf_counter)"""
+        self.monotonic = timer == 'perf_counter'
+        return 'perf_counter' if self.monotonic else 'wtime'
+
+    def setsr(self):
+        if _pingpong is None:
+            raise ImportError("The compiled pingpong kernel vsc.mympingpong._pingpong is not available")
+
+    def setcomm(self):
+        self.sendfirst = True
+
+    def dowarmup(self, it, group=None):  # pylint: disable-msg=W0613
+        """the warmup pingpongs are done in the compiled loop of the next dopingpong"""
+        self.warmup = it
+
+    def dopingpong(self, it=None, group=25):
+        if self.groupforce:
+            group = self.groupforce
+
+        if it is not None:
+            self.setit(it, group)
+
+        _pingpong.timedloop(self.comm, self.sndbuf, self.rcvbuf, self.other, self.tag1, self.tag2,
+                            self.counts, self.start, self.end, warmup=self.warmup, sendfirst=self.sendfirst,
+                            monotonic=self.monotonic)
+
+        return numpy.average(self.timings())
+
+
+class PingPongRSkernel(PingPongSRkernel):
+    """receive-send in the compiled kernel"""
+
+    def setcomm(self):
+        self.sendfirst = False
+        # flip tags
+        a = self.tag2
+        self.tag2 = self.tag1
+        self.tag1 = a
+
+
+class PingPongSRbw(PingPongSR):
+    """
+    streaming bandwidth: keep a window of outstanding sends, acknowledged by the receiver
+
+    the group is the window size; timings() returns the time per message (not per round trip)
+    the window is a set of persistent requests, started and completed at once,
+    so the cost per message in the interpreter does not limit the message rate
+    """
+
+    def __init__(self, comm, other, logger):
+        super(PingPongSRbw, self).__init__(comm, other, logger)
+        self.ackbuf = numpy.zeros(1, 'b')
+        self.reqs = None
+        # the number of messages of the last dopingpong
+        self.msgs = 0
+
+    def setsr(self):
+        self.send = self.comm.Send_init
+        self.recv = self.comm.Recv_init
+
+    def setit(self, it, group=None):
+        self.it = it
+        self.group = group
+        self.start = numpy.zeros(it, float)
+        self.end = numpy.zeros(it, float)
+
+    def setreqs(self):
+        """create the persistent requests of a window"""
+        self.reqs = [self.send(self.sndbuf, self.other, self.tag1) for _ in range(self.group)]
+
+    def freereqs(self):
+        """free the persistent requests"""
+        for req in self.reqs:
+            req.Free()
+        self.reqs = None
+
+    def window(self):
+        """send a window of messages and wait for the acknowledgement"""
+        MPI.Prequest.Startall(self.reqs)
+        MPI.Request.Waitall(self.reqs)
+        self.comm.Recv(self.ackbuf, self.other, self.tag2)
+
+    def dopingpong(self, it=None, group=64):
+        """it windows of group messages"""
+        if self.groupforce:
+            group = self.groupforce
+
+        if it:
+            self.setit(it, group)
+
+        self.setreqs()
+        for x in range(self.it):
+            self.start[x] = self.timer()
+            self.window()
+            self.end[x] = self.timer()
+        self.freereqs()
+        self.msgs = self.it * self.group
+
+        return numpy.average(self.timings())
+
+    def timings(self):
+        """return the time per message of every window of the last dopingpong"""
+        return (self.end - self.start) / float(self.group)
+
+
+class PingPongRSbw(PingPongSRbw):
+    """receiving side of the streaming bandwidth test"""
+
+    def setreqs(self):
+        """create the persistent requests of a window"""
+        self.reqs = [self.recv(self.rcvbuf, self.other, self.tag1) for _ in range(self.group)]
+
+    def window(self):
+        """receive a window of messages and acknowledge"""
+        MPI.Prequest.Startall(self.reqs)
+        MPI.Request.Waitall(self.reqs)
+        self.comm.Send(self.ackbuf, self.other, self.tag2)
+
+
+class PingPongSRbidir(PingPongSR):
+    """
+    bidirectional exchange: both partners send and receive at the same time
+
+    timings() returns 2 rows: the time of every complete exchange,
+    and the time until the message of the other side was received
+    """
+
+    def __init__(self, comm, other, logger):
+        super(PingPongSRbidir, self).__init__(comm, other, logger)
+        self.recvd = None
+
+    def setsr(self):
+        self.send = self.comm.Isend
+        self.recv = self.comm.Irecv
+
+    def setit(self, it, group=None):  # pylint: disable-msg=W0613
+        self.it = it
+        self.group = 1
+        self.start = numpy.zeros(it, float)
+        self.end = numpy.zeros(it, float)
+        self.recvd = numpy.zeros(it, float)
+
+    def dopingpong(self, it=None, group=None):  # pylint: disable-msg=W0613
+        if it:
+            self.setit(it)
+
+        for x in range(self.it):
+            self.start[x] = self.timer()
+            reqs = [self.recv(self.rcvbuf, self.other, self.tag2), self.send(self.sndbuf, self.other, self.tag1)]
+            while MPI.Request.Waitany(reqs) != 0:
+                pass
+            self.recvd[x] = self.timer()
+            MPI.Request.Waitall(reqs)
+            self.end[x] = self.timer()
+
+        return numpy.average(self.end - self.start)
+
+    def timings(self):
+        """return the exchange and the receive time of every exchange of the last dopingpong"""
+        return numpy.array([self.end - self.start, self.recvd - self.start])
+
+
+class PingPongRSbidir(PingPongSRbidir):
+    """the other side of the bidirectional exchange"""
+
+    def setcomm(self):
+        # flip tags
+        a = self.tag2
+        self.tag2 = self.tag1
+        self.tag1 = a
+
+
 class PingPongtest(PingPongSR):
 
     def dopingpong(self, it=None, group=None):  # pylint: disable-msg=W0613
@@ -0,0 +1,129 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Capture of the raw (per group) pingpong timings
+
+Every rank keeps its own buffer and writes it to its own hdf5 file,
+so no communication is needed and compression can be used.
+"""
+
+import h5py
+import numpy as n
+
+
+RAW_DTYPE = n.dtype([
+    ('start', 'f8'),
+    ('end', 'f8'),
+    ('partner', 'i4'),
+    ('runid', 'i8'),
+    ('msgsize', 'i8'),
+])
+
+RAW_DATASET = 'raw'
+
+
+class RawBuffer(object):
+    """
+    Buffer for raw timings, flushed in batches to an extendible, chunked and compressed dataset
+
+    Nothing is written until the buffer is full (or flush/close is called)
+    """
+
+    def __init__(self, filename, capacity=65536, compression='gzip', logger=None):
+        self.log = logger
+
+        self.filename = filename
+        self.capacity = capacity
+        self.compression = compression
+
+        self.buf = n.zeros(capacity, RAW_DTYPE)
+        self.pos = 0
+
+        self.attrs = {}
+
+        self.fh = None
+        self.dataset = None
+
+    def add(self, start, end, partner, runid, msgsize):
+        """add the start and end timings of a set of groups"""
+        start = n.asarray(start)
+        cnt = start.size
+
+        if self.pos + cnt > self.capacity:
+            self.flush()
+
+        if cnt > self.capacity:
+            # doesn't fit in the buffer anyway
+            self.write(n.rec.fromarrays([start, end, [partner] * cnt, [runid] * cnt, [msgsize] * cnt],
+                                        dtype=RAW_DTYPE))
+            return
+
+        sl = slice(self.pos, self.pos + cnt)
+        self.buf['start'][sl] = start
+        self.buf['end'][sl] = end
+        self.buf['partner'][sl] = partner
+        self.buf['runid'][sl] = runid
+        self.buf['msgsize'][sl] = msgsize
+        self.pos += cnt
+
+    def open(self):
+        """create the file and the extendible dataset"""
+        self.fh = h5py.File(self.filename, 'w')
+        chunks = (min(self.capacity, 65536),)
+        self.dataset = self.fh.create_dataset(RAW_DATASET, (0,), dtype=RAW_DTYPE, maxshape=(None,),
+                                              chunks=chunks, compression=self.compression, shuffle=True)
+        if self.log:
+            self.log.debug("created raw dataset in %s (chunks %s, compression %s)",
+                           self.filename, chunks, self.compression)
+
+    def write(self, data):
+        """append data to the dataset"""
+        if self.fh is None:
+            self.open()
+
+        old = self.dataset.shape[0]
+        self.dataset.resize((old + data.shape[0],))
+        self.dataset[old:] = data
+
+    def flush(self):
+        """write the buffered timings"""
+        if self.pos:
+            self.write(self.buf[:self.pos])
+            if self.log:
+                self.log.debug("flushed %s raw timings to %s", self.pos, self.filename)
+            self.pos = 0
+
+    def close(self):
+        """flush and close the file (it is always created, even if there are no timings)"""
+        self.flush()
+        if self.fh is None:
+            self.open()
+
+        for k, v in self.attrs.items():
+            self.fh.attrs[k] = v
+
+        self.fh.close()
+        self.fh = None
+        self.dataset = None
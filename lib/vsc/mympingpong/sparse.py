@@ -0,0 +1,97 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Sparse (COO) layout of the pair matrices in the output file
+
+Every dataset is a list of entries (sender, receiver, sizeid, stats) for the pairs with samples only,
+sorted by sender, so the file and the memory needed to analyse it grow with the number of samples
+instead of with the square of the number of ranks.
+"""
+
+import numpy as n
+
+from vsc.mympingpong.stats import STATS_FIELDS
+
+
+# value of the layout attribute of the file and of the sparse datasets
+SPARSE_LAYOUT = 'coo'
+
+COO_DTYPE = n.dtype([
+    ('sender', 'i4'),
+    ('receiver', 'i4'),
+    ('sizeid', 'i4'),
+    ('stats', 'f4', (len(STATS_FIELDS),)),
+])
+
+FAIL_DTYPE = n.dtype([
+    ('sender', 'i4'),
+    ('receiver', 'i4'),
+    ('count', 'i8'),
+])
+
+
+def tocoo(sender, data):
+    """
+    the entries of the pairs of sender with samples (a nonzero count)
+
+    data is an array with the statistics of sender with every receiver, for every messagesize:
+    data[sizeid][receiver][field]
+    """
+    sizeids, receivers = n.nonzero(data[..., 0])
+    res = n.zeros(sizeids.size, COO_DTYPE)
+    res['sender'] = sender
+    res['receiver'] = receivers
+    res['sizeid'] = sizeids
+    res['stats'] = data[sizeids, receivers]
+    return res
+
+
+def failtocoo(sender, fail):
+    """the entries of the nonzero fail counts of sender (fail is the fail count per receiver)"""
+    receivers = n.nonzero(fail)[0]
+    res = n.zeros(receivers.size, FAIL_DTYPE)
+    res['sender'] = sender
+    res['receiver'] = receivers
+    res['count'] = fail[receivers]
+    return res
+
+
+def todense(entries, senders, receivers, sizeid=0, field='stats'):
+    """
+    materialize the dense block of the pairs of senders and receivers (ranges (start, end))
+    from the entries of the messagesize sizeid (if there is a sizeid field)
+
+    Returns an array with shape (nrsenders, nrreceivers) + the shape of field
+    """
+    sel = ((entries['sender'] >= senders[0]) & (entries['sender'] < senders[1]) &
+           (entries['receiver'] >= receivers[0]) & (entries['receiver'] < receivers[1]))
+    if 'sizeid' in entries.dtype.names:
+        sel &= entries['sizeid'] == sizeid
+    entries = entries[sel]
+
+    res = n.zeros((senders[1] - senders[0], receivers[1] - receivers[0]) + entries.dtype[field].shape,
+                  entries.dtype[field].base)
+    res[entries['sender'] - senders[0], entries['receiver'] - receivers[0]] = entries[field]
+    return res
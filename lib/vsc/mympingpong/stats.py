@@ -0,0 +1,105 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Streaming statistics for pingpong timings
+
+All accumulators use preallocated arrays and the Welford/Chan update,
+so memory and cost per update do not depend on the number of rounds.
+"""
+
+import numpy as n
+
+
+# the fields (in order) of the last axis of the arrays returned by PairStats.asarray
+STATS_FIELDS = ('count', 'mean', 'stdev', 'min', 'max')
+
+# the accumulators (in order) of the arrays returned by PairStats.getstate
+STATE_FIELDS = ('count', 'mean', 'm2', 'min', 'max')
+
+
+class PairStats(object):
+    """
+    count, mean, sum of squared deviations, min and max of timings per partner rank
+
+    index is the partner rank, so one instance holds (a row of) the pair matrix
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+        self.count = n.zeros(size, int)
+        self.mean = n.zeros(size, float)
+        self.m2 = n.zeros(size, float)
+        self.min = n.ones(size, float) * n.inf
+        self.max = n.ones(size, float) * -n.inf
+
+    def update(self, index, samples):
+        """
+        add samples (a scalar or an array of timings) for partner index
+
+        uses the parallel variant of Welford's algorithm (Chan et al.) to merge the samples in one go
+        """
+        samples = n.asarray(samples, float).ravel()
+        cnt = samples.size
+        if cnt == 0:
+            return
+
+        smean = samples.mean()
+        sm2 = n.sum((samples - smean) ** 2)
+
+        oldcnt = self.count[index]
+        total = oldcnt + cnt
+        delta = smean - self.mean[index]
+
+        self.mean[index] += delta * cnt / total
+        self.m2[index] += sm2 + delta ** 2 * oldcnt * cnt / total
+        self.count[index] = total
+
+        self.min[index] = min(self.min[index], samples.min())
+        self.max[index] = max(self.max[index], samples.max())
+
+    def stdev(self):
+        """(population) standard deviation per partner, 0 if there are no samples"""
+        return n.sqrt(self.m2 / n.where(self.count == 0, 1, self.count))
+
+    def getstate(self):
+        """the accumulators as one array of shape (len(STATE_FIELDS), size), to checkpoint them"""
+        return n.array([getattr(self, name) for name in STATE_FIELDS], float)
+
+    def setstate(self, state):
+        """restore the accumulators from an array returned by getstate"""
+        for name, values in zip(STATE_FIELDS, state):
+            getattr(self, name)[:] = values
+
+    def asarray(self):
+        """return an array of shape (size, len(STATS_FIELDS)); partners without samples are all zero"""
+        seen = self.count > 0
+        res = n.zeros((self.size, len(STATS_FIELDS)), float)
+        res[:, 0] = self.count
+        res[:, 1] = self.mean
+        res[:, 2] = self.stdev()
+        res[:, 3] = n.where(seen, self.min, 0)
+        res[:, 4] = n.where(seen, self.max, 0)
+        return res
@@ -0,0 +1,124 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Clocks used for the pingpong timings, and their calibration
+
+wtime is MPI.Wtime, perf_counter is the high resolution (monotonic) performance counter of python.
+PhaseTimer accumulates the wall time of the phases of a run.
+"""
+
+import time
+from contextlib import contextmanager
+
+import numpy as n
+from mpi4py import MPI
+
+
+# python 2 has no performance counter
+perf_counter = getattr(time, 'perf_counter', time.time)
+
+TIMERS = {
+    'wtime': MPI.Wtime,
+    'perf_counter': perf_counter,
+}
+
+# the phases of a run (see PhaseTimer), in order
+PHASES = ['affinity', 'cpumap', 'schedule', 'calibrate', 'barrier', 'abortcheck', 'steer', 'pingpong', 'checkpoint',
+          'writehdf5']
+
+
+def timertick(name):
+    """the resolution of timer name, as reported by the clock itself"""
+    if name == 'wtime':
+        return MPI.Wtick()
+    elif hasattr(time, 'get_clock_info'):
+        return time.get_clock_info(perf_counter.__name__).resolution
+    else:
+        return 0.0
+
+
+def calibrate(name, nrsamples=10000):
+    """
+    measure the overhead (the average time of a call) and the resolution
+    (the smallest nonzero difference between consecutive calls) of timer name
+
+    Returns a dict with the overhead, resolution and tick (see timertick)
+    """
+    timer = TIMERS[name]
+
+    begin = timer()
+    for _ in range(nrsamples):
+        timer()
+    overhead = (timer() - begin) / nrsamples
+
+    diffs = n.diff([timer() for _ in range(nrsamples)])
+    diffs = diffs[diffs > 0]
+    tick = timertick(name)
+
+    return {
+        'overhead': overhead,
+        # the clock did not advance during all samples
+        'resolution': diffs.min() if diffs.size else max(tick, overhead * nrsamples),
+        'tick': tick,
+    }
+
+
+class PhaseTimer(object):
+    """
+    wall time per phase (see PHASES) of this rank, accumulated over all times the phase is timed
+    """
+
+    def __init__(self, phases=None):
+        self.phases = phases or PHASES
+        self.durations = dict([(phase, 0.0) for phase in self.phases])
+
+    def add(self, phase, duration):
+        """add duration (in seconds) to phase"""
+        self.durations[phase] += duration
+
+    @contextmanager
+    def timed(self, phase):
+        """time the with block as (part of) phase"""
+        begin = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, perf_counter() - begin)
+
+    def reduce(self, comm):
+        """
+        the min, median and max over all ranks of comm of every phase (collective)
+
+        Returns a dict that maps phase_<phase> to an array with the min, median and max
+        """
+        mine = n.array([self.durations[phase] for phase in self.phases], float)
+        alldurations = n.empty((comm.Get_size(), mine.size), float)
+        comm.Allgather(mine, alldurations)
+
+        res = {}
+        for idx, phase in enumerate(self.phases):
+            durations = alldurations[:, idx]
+            res['phase_%s' % phase] = n.array([durations.min(), n.median(durations), durations.max()])
+        return res
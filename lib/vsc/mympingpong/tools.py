@@ -27,37 +27,212 @@ Module with general tools
 
 @author: Stijn De Weirdt (Ghent University)
 """
+import glob
+import json
 import logging
 import os
+import socket
 import tempfile
 
+import numpy as n
 from lxml.etree import ElementTree as etree
-from vsc.utils.run import run_simple
+from vsc.utils.run import run_simple, run_timeout
 
 
 HWLOC_LS = "hwloc-ls"
 HWLOC_LS_XML_TEMPLATE = HWLOC_LS + " --force --output-format xml %s"
 
+# changes with every boot, so a cached hwlocmap is never used after e.g. a hardware change
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
+HWLOC_CACHE_TEMPLATE = "mympingpong-hwloc-%s-%s-%s.json"
 
-def hwlocmap():
+# the auto topology backend uses sysfs if hwloc-ls takes longer than this (in seconds)
+HWLOC_TIMEOUT = 10
+
+SYSFS = "/sys"
+SYSFS_CPU = "devices/system/cpu"
+SYSFS_NODE = "devices/system/node"
+
+TOPOLOGY_BACKENDS = ['auto', 'hwloc', 'sysfs']
+
+
+def hwlocmap(timeout=None):
     """
     Generate and parse output from hwloc-ls
 
     Returns a dict that maps the absolute Processor Unit ID to its socket-id and its core-id
+    If timeout (in seconds) is given, hwloc-ls is stopped after timeout and None is returned when it failed
     """
     # Only need a filename
     (fh, xmlout) = tempfile.mkstemp(prefix="hwloc-xml-", suffix=".xml")
     os.close(fh)
 
-    run_simple(HWLOC_LS_XML_TEMPLATE % xmlout)
-
-    parsed = _parse_hwloc_xml(xmlout)
+    if timeout is None:
+        run_simple(HWLOC_LS_XML_TEMPLATE % xmlout)
+        parsed = _parse_hwloc_xml(xmlout)
+    else:
+        ec, out = run_timeout(HWLOC_LS_XML_TEMPLATE % xmlout, timeout=timeout)
+        if ec == 0 and os.path.getsize(xmlout):
+            parsed = _parse_hwloc_xml(xmlout)
+        else:
+            logging.warning("%s failed or took more than %s s (exitcode %s): %s", HWLOC_LS, timeout, ec, out)
+            parsed = None
 
     os.remove(xmlout)
 
     return parsed
 
 
+def _which(cmd):
+    """the full path of executable cmd in $PATH (None if it is not found)"""
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        fullpath = os.path.join(path, cmd)
+        if os.path.isfile(fullpath) and os.access(fullpath, os.X_OK):
+            return fullpath
+    return None
+
+
+def _read_sysfs(path):
+    """the stripped content of a sysfs file"""
+    with open(path) as fh:
+        return fh.read().strip()
+
+
+def _parse_cpulist(cpulist):
+    """parse a linux cpulist, e.g. 0-3,8,10-11, into a list of ints"""
+    res = []
+    for part in cpulist.split(','):
+        if '-' in part:
+            low, high = part.split('-')
+            res.extend(range(int(low), int(high) + 1))
+        elif part.strip():
+            res.append(int(part))
+    return res
+
+
+def sysfsmap(sysfs=SYSFS):
+    """
+    Generate the same map as hwlocmap from the cpu and node topology in sysfs
+    (no external command or temporary file needed)
+
+    Returns a dict that maps the absolute Processor Unit ID to its socket-id and its core-id
+    """
+    numas = {}
+    for nodedir in glob.glob(os.path.join(sysfs, SYSFS_NODE, 'node[0-9]*')):
+        numa = int(os.path.basename(nodedir)[len('node'):])
+        try:
+            for pu in _parse_cpulist(_read_sysfs(os.path.join(nodedir, 'cpulist'))):
+                numas[pu] = numa
+        except (IOError, OSError, ValueError) as err:
+            logging.error("Failed to read the cpus of numa node %s: %s", numa, err)
+
+    res = {}
+    for cpudir in glob.glob(os.path.join(sysfs, SYSFS_CPU, 'cpu[0-9]*')):
+        pu = int(os.path.basename(cpudir)[len('cpu'):])
+        try:
+            socket = int(_read_sysfs(os.path.join(cpudir, 'topology', 'physical_package_id')))
+            core = int(_read_sysfs(os.path.join(cpudir, 'topology', 'core_id')))
+        except (IOError, OSError, ValueError) as err:
+            # e.g. offline cpus have no topology
+            logging.debug("No topology for cpu %s: %s", pu, err)
+            continue
+        res[pu] = "socket %s core %s abscore %s numa %s" % (socket, core, pu, numas.get(pu))
+
+    logging.debug("result map: %s", res)
+    return res
+
+
+def topologymap(backend='auto', timeout=HWLOC_TIMEOUT):
+    """
+    The map of hwlocmap, from the hwloc or the sysfs backend
+
+    auto uses hwloc-ls, unless it is not installed, fails or takes more than timeout seconds
+    """
+    return _topologymap(backend, timeout=timeout)[1]
+
+
+def _autobackend(backend):
+    """the backend auto tries first: hwloc if hwloc-ls is installed, sysfs otherwise"""
+    if backend == 'auto':
+        if _which(HWLOC_LS):
+            backend = 'hwloc'
+        else:
+            logging.debug("%s not found, using sysfs", HWLOC_LS)
+            backend = 'sysfs'
+    return backend
+
+
+def _topologymap(backend='auto', timeout=HWLOC_TIMEOUT):
+    """the backend that generated the map and the map of topologymap"""
+    if backend == 'hwloc':
+        return backend, hwlocmap()
+    elif backend == 'sysfs':
+        return backend, sysfsmap()
+    elif backend != 'auto':
+        raise ValueError("Unknown topology backend %s, expected one of %s" % (backend, TOPOLOGY_BACKENDS))
+
+    if _autobackend(backend) == 'hwloc':
+        res = hwlocmap(timeout=timeout)
+        if res:
+            return 'hwloc', res
+    return 'sysfs', sysfsmap()
+
+
+def bootid():
+    """the boot id of the host (None if unknown)"""
+    try:
+        with open(BOOT_ID) as fh:
+            return fh.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+def hwlocmapcached(cachedir=None, backend='auto'):
+    """
+    the topologymap of backend, cached in cachedir (default: the temporary directory)
+    keyed by hostname, boot id and the backend that generated it, so the topology is only discovered once per boot
+
+    Without cachedir (an empty string) or boot id, the map is not cached.
+    An empty map is never cached, and auto only uses the cache of the sysfs backend when hwloc-ls is not installed
+    (a sysfs map that replaced a failed hwloc-ls is not reused).
+    """
+    if cachedir is None:
+        cachedir = tempfile.gettempdir()
+    boot = bootid()
+    if not cachedir or not boot:
+        return topologymap(backend)
+
+    def cachefn(used):
+        return os.path.join(cachedir, HWLOC_CACHE_TEMPLATE % (socket.gethostname(), boot, used))
+
+    preferred = _autobackend(backend)
+    try:
+        with open(cachefn(preferred)) as fh:
+            # json only has string keys
+            res = dict([(int(pu), prop) for pu, prop in json.load(fh).items()])
+        if res:
+            logging.debug("hwlocmap read from cache %s", cachefn(preferred))
+            return res
+    except (IOError, OSError, ValueError) as err:
+        logging.debug("no valid cached hwlocmap in %s: %s", cachefn(preferred), err)
+
+    used, res = _topologymap(backend)
+    if not res:
+        logging.warning("no topology found with the %s backend, not cached", used)
+        return res
+
+    try:
+        # write and rename, so a concurrent reader never sees a partial cache
+        (fh, tmpfn) = tempfile.mkstemp(prefix="hwloc-cache-", suffix=".json", dir=cachedir)
+        with os.fdopen(fh, 'w') as cachefh:
+            json.dump(res, cachefh)
+        os.rename(tmpfn, cachefn(used))
+    except (IOError, OSError) as err:
+        logging.warning("failed to cache hwlocmap in %s: %s", cachefn(used), err)
+
+    return res
+
+
 def _parse_hwloc_xml(xml_fn):
     """
     Generate the mapping between absolute Processor Unit ID to its socket-id and its core-id
@@ -65,47 +240,75 @@ def _parse_hwloc_xml(xml_fn):
     xml_fn is filename for xml file with hwloc-ls output in xml format
     """
     # parse xmloutput
-    base = etree().parse(xml_fn).getroottree()
+    root = etree().parse(xml_fn)
 
-    # gather all interesting elements and their paths
+    # walk the tree once, carrying the ids of the interesting ancestors down to every PU
     # SB has numa -> socket -> core -> pu
     # haswell has socket -> numa -> core -> pu
     # broadwell has package -> numa -> core -> pu
-    # track elements by unique xpath
+    ancestortypes = ['Package', 'Socket', 'NUMANode', 'Core']
 
-    elements = {}
-    for typ in ['Package', 'Socket', 'NUMANode', 'Core', 'PU']:
-        xpath = './/object[@type="%s"]' % typ
-        elements[typ] = dict([(base.getpath(el), int(el.get('os_index', -1))) for el in base.findall(xpath)])
+    pus = []
+    stack = [(root, {})]
+    while stack:
+        parent, ancestors = stack.pop()
+        for el in parent.iterchildren('object'):
+            typ = el.get('type')
+            if typ == 'PU':
+                pus.append((int(el.get('os_index', -1)), ancestors))
+            elif typ in ancestortypes:
+                stack.append((el, dict(ancestors, **{typ: int(el.get('os_index', -1))})))
+            else:
+                stack.append((el, ancestors))
 
     # there should be either socket or package
-    # if package, rename to socket
-    if len(elements['Package']):
-        elements['Socket'] = elements['Package']
-
-    def find_parent_element(typ, path):
-        """
-        Look for typ that is parent of path in elements
-        log error if more than one is found (it really shouldn't)
-        return first value
-        """
-        # keep p and v for debugging when more than one is found
-        found = [(p, v) for p, v in elements[typ].items() if path.startswith(p)]
-        if len(found) > 1:
-            logging.error("Found more than one %s for child path %s: %s" % (typ, path, found))
-        elif len(found) == 0:
-            logging.error("Found none %s for child path %s" % (typ, path))
-            return None
-        # only return value
-        return found[0][1]
+    # if package, use it as socket
+    sockettype = 'Package' if any('Package' in anc for _, anc in pus) else 'Socket'
 
     res = {}
-    for path, pu in elements['PU'].items():
-        core = find_parent_element('Core', path)
-        socket = find_parent_element('Socket', path)
-        numa = find_parent_element('NUMANode', path)
+    for pu, ancestors in pus:
+        values = []
+        for typ in [sockettype, 'Core', 'NUMANode']:
+            if typ not in ancestors:
+                logging.error("Found none %s for PU %s" % (typ, pu))
+            values.append(ancestors.get(typ))
+        socket, core, numa = values
         text = "socket %s core %s abscore %s numa %s" % (socket, core, pu, numa)
         res[pu] = text
 
     logging.debug("result map: %s", res)
     return res
+
+
+def parsesizes(spec, what='messagesize'):
+    """
+    Parse a specification of messagesizes (in Bytes), or other positive numbers (what is used in the errors)
+
+    spec is either a comma-separated list of sizes, e.g. 0,1,1024,4096
+    or min:max:steps, for steps sizes geometrically spaced between min and max (both included), e.g. 1:4194304:23
+    (a geometric range can't start at 0: with min 0, the range has 0 and steps - 1 sizes from 1 to max)
+
+    Returns a sorted list of unique sizes
+    """
+    if ':' in spec:
+        try:
+            low, high, steps = [int(x) for x in spec.split(':')]
+        except ValueError:
+            raise ValueError("Invalid %s range %s, expected min:max:steps" % (what, spec))
+        if low < 0 or high < max(low, 1) or steps < 1 or (low == 0 and steps < 2):
+            raise ValueError("Invalid %s range %s: need 0 <= min <= max, 1 <= max and steps >= 1 "
+                             "(steps >= 2 if min is 0)" % (what, spec))
+        sizes = []
+        if low == 0:
+            sizes, low, steps = [0], 1, steps - 1
+        sizes += [int(round(x)) for x in n.logspace(n.log10(low), n.log10(high), steps)]
+    else:
+        try:
+            sizes = [int(x) for x in spec.split(',') if x.strip()]
+        except ValueError:
+            raise ValueError("Invalid %ss %s, expected a comma-separated list of integers" % (what, spec))
+
+    if not sizes or min(sizes) < 0:
+        raise ValueError("Invalid %ss %s" % (what, spec))
+
+    return sorted(set(sizes))
@@ -0,0 +1,135 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Topology of the ranks: the node, socket and NUMA node of every rank, and the distance between ranks
+
+The topology is built from the cpumap (see MyPingPong.makecpumap): the processor name and the hwloc
+property of every rank, so the nodes do not need to have the same hardware.
+"""
+
+import re
+
+import numpy as n
+
+
+# the distance classes between 2 ranks, from close to far
+# numa: same NUMA node, socket: same socket (other NUMA node), node: same node (other socket), remote: other node
+DISTANCES = ('numa', 'socket', 'node', 'remote')
+
+# the distance of ranks of which the socket or NUMA node is not known (on the same node)
+UNKNOWN = -1
+
+HWLOC_REGEX = re.compile(r"socket\s+(\S+)\s+core\s+(\S+)\s+abscore\s+(\S+)\s+numa\s+(\S+)")
+
+
+def parsehwloc(prop):
+    """
+    parse a hwloc property (as made by tools.hwlocmap) into its socket-id, core-id, PU-id and numa-id
+
+    Returns a tuple of ints, -1 for the fields that are missing
+    """
+    res = [-1] * 4
+    match = HWLOC_REGEX.search(prop or '')
+    if match:
+        for idx, value in enumerate(match.groups()):
+            try:
+                res[idx] = int(value)
+            except ValueError:
+                pass
+    return tuple(res)
+
+
+def formathwloc(socket, core, pu, numa):
+    """the hwloc property (as made by tools.hwlocmap) of the ids, the inverse of parsehwloc (-1 is None)"""
+    ids = [None if value < 0 else value for value in (socket, core, pu, numa)]
+    return "socket %s core %s abscore %s numa %s" % tuple(ids)
+
+
+class Topology(object):
+    """
+    node, socket and numa: arrays with the node, socket and NUMA node of every rank,
+    unique over all nodes (-1 if unknown)
+    """
+
+    def __init__(self, names, sockets, numas):
+        _, self.node = n.unique(n.array(names, dtype=str), return_inverse=True)
+        self.node = self.node.ravel()
+        self.socket = self._global(sockets)
+        self.numa = self._global(numas)
+
+    def _global(self, local):
+        """make the ids per node unique over all nodes"""
+        local = n.asarray(local, int)
+        width = max(local.max() + 1, 1) if local.size else 1
+        return n.where(local >= 0, self.node * width + local, -1)
+
+    @classmethod
+    def fromcpumap(cls, cpumap):
+        """
+        the topology of a cpumap, a list with the properties of every rank:
+        the processor name and a hwloc_<hwloc property> (other properties are ignored)
+        """
+        names, sockets, numas = [], [], []
+        for props in cpumap:
+            hwloc = [prop[len('hwloc_'):] for prop in props if prop.startswith('hwloc_')]
+            socket, _, _, numa = parsehwloc(hwloc[0] if hwloc else None)
+            names.append(props[0])
+            sockets.append(socket)
+            numas.append(numa)
+        return cls(names, sockets, numas)
+
+    def distance(self, ranks1, ranks2):
+        """
+        the distance class (index in DISTANCES) of every pair of ranks1 and ranks2
+
+        UNKNOWN for ranks on the same node without socket or NUMA info, and for negative ranks
+        """
+        ranks1, ranks2 = n.asarray(ranks1), n.asarray(ranks2)
+        valid = (ranks1 >= 0) & (ranks2 >= 0)
+        ranks1, ranks2 = n.where(valid, ranks1, 0), n.where(valid, ranks2, 0)
+
+        def same(ids):
+            return (ids[ranks1] == ids[ranks2]) & (ids[ranks1] >= 0)
+
+        def known(ids):
+            return (ids[ranks1] >= 0) & (ids[ranks2] >= 0)
+
+        res = n.ones(ranks1.shape, int) * UNKNOWN
+        samenode = self.node[ranks1] == self.node[ranks2]
+        res[~samenode] = DISTANCES.index('remote')
+        res[samenode & known(self.socket) & ~same(self.socket)] = DISTANCES.index('node')
+        res[samenode & same(self.socket) & known(self.numa) & ~same(self.numa)] = DISTANCES.index('socket')
+        res[samenode & same(self.numa)] = DISTANCES.index('numa')
+        res[~valid] = UNKNOWN
+        return res
+
+    def group(self, ranks, distance):
+        """
+        the group of every rank in which all partners at distance are: the NUMA node (numa),
+        the socket (socket), the node (node) or all ranks (remote)
+        """
+        ranks = n.asarray(ranks)
+        ids = [self.numa, self.socket, self.node, n.zeros_like(self.node)][distance]
+        return ids[ranks]
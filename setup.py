@@ -30,10 +30,30 @@
 Setup for mympingpong
 """
 
+import os
 import sys
 
+from setuptools import Extension
 from vsc.install.shared_setup import action_target, kh, sdw
 
+
+def kernel_extensions():
+    """
+    The compiled pingpong kernel vsc.mympingpong._pingpong
+
+    It is optional: only built when Cython and mpi4py are available, using the MPI compiler wrapper of mpi4py
+    """
+    try:
+        from Cython.Build import cythonize
+        import mpi4py
+    except ImportError:
+        return []
+
+    os.environ.setdefault('CC', mpi4py.get_config().get('mpicc', 'mpicc'))
+    ext = Extension('vsc.mympingpong._pingpong', [os.path.join('lib', 'vsc', 'mympingpong', '_pingpong.pyx')])
+    return cythonize([ext])
+
+
 PACKAGE = {
     'name': 'mympingpong',
     'version': '0.8.1',
@@ -50,6 +70,7 @@ PACKAGE = {
         'mock',
         'nose',
     ],
+    'ext_modules': kernel_extensions(),
     'author': [sdw, kh],
     'maintainer': [sdw, kh],
 }
@@ -0,0 +1,96 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+
+import numpy as n
+
+from vsc.install.testing import TestCase
+from vsc.mympingpong.checkpoint import NO_ROUND, Checkpoint
+from vsc.mympingpong.stats import PairStats
+
+
+class CheckpointTest(TestCase):
+    """Test checkpoint"""
+
+    def setUp(self):
+        """Create a temporary directory"""
+        super(CheckpointTest, self).setUp()
+        self.ckptdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary directory"""
+        shutil.rmtree(self.ckptdir)
+        super(CheckpointTest, self).tearDown()
+
+    def makestats(self, size, nrsizes, nrsamples=0):
+        """stats with nrsamples samples for every partner and messagesize"""
+        stats = {'data': [PairStats(size) for _ in range(nrsizes)]}
+        for sizeid, st in enumerate(stats['data']):
+            for partner in range(size):
+                if nrsamples:
+                    st.update(partner, n.arange(nrsamples) + partner + sizeid * 10.0)
+        return stats
+
+    def test_checkpoint(self):
+        """Test writing, alternating generations and restoring checkpoints"""
+        prefix = os.path.join(self.ckptdir, 'PPtest')
+        meta = {'totalranks': 3, 'seed': 2, 'msgsize': [8, 64], 'pairmode': 'shuffle'}
+        ckpt = Checkpoint(prefix, 1, 5)
+
+        self.assertEqual([ckpt.due(runid) for runid in range(10)], [False] * 4 + [True] + [False] * 4 + [True])
+        self.assertFalse(Checkpoint(prefix, 1, 0).due(4))
+        self.assertEqual(ckpt.rounds(), [NO_ROUND, NO_ROUND])
+
+        ckpt.write(5, self.makestats(3, 2, 4), n.array([0, 0, 1]), meta)
+        stats = self.makestats(3, 2, 7)
+        ckpt.write(10, stats, n.array([0, 0, 2]), meta, pairs=n.arange(6).reshape(3, 2))
+        self.assertEqual(ckpt.rounds(), [5, 10])
+        self.assertEqual(sorted(os.listdir(self.ckptdir)), ['PPtest-ckpt00001-0.h5', 'PPtest-ckpt00001-1.h5'])
+
+        # the oldest generation is overwritten
+        ckpt.write(15, self.makestats(3, 2, 9), n.array([0, 0, 3]), meta)
+        self.assertEqual(ckpt.rounds(), [15, 10])
+
+        # restore an older generation, the next checkpoint replaces the other one
+        restored = self.makestats(3, 2)
+        resumed = Checkpoint(prefix, 1, 5)
+        fail, pairs = resumed.read(10, restored, meta)
+        self.assertEqual(fail.tolist(), [0, 0, 2])
+        self.assertEqual(pairs.tolist(), [[0, 1], [2, 3], [4, 5]])
+        for st, orig in zip(restored['data'], stats['data']):
+            self.assertTrue(n.allclose(st.asarray(), orig.asarray()))
+            self.assertEqual(st.count.tolist(), [7, 7, 7])
+        resumed.write(20, restored, fail, meta)
+        self.assertEqual(resumed.rounds(), [20, 10])
+
+        # different settings
+        self.assertEqual(resumed.read(10, self.makestats(3, 2), dict(meta, seed=3)), None)
+        self.assertEqual(resumed.read(10, self.makestats(3, 2), dict(meta, msgsize=[8])), None)
+
+        resumed.remove()
+        self.assertEqual(os.listdir(self.ckptdir), [])
+        self.assertEqual(resumed.rounds(), [NO_ROUND, NO_ROUND])
@@ -0,0 +1,360 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+import os
+import shutil
+import tempfile
+
+import h5py
+import numpy as n
+from mock import MagicMock, patch
+from mpi4py import MPI
+
+from vsc.install.testing import TestCase
+from vsc.mympingpong.stats import PairStats, STATS_FIELDS
+
+
+MPP_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin', 'mympingpong.py')
+
+
+def loadscript():
+    """load bin/mympingpong.py as a module"""
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('mympingpong_script', MPP_SCRIPT)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except ImportError:
+        # python 2
+        import imp
+        module = imp.load_source('mympingpong_script', MPP_SCRIPT)
+    return module
+
+
+class MyPingPongTest(TestCase):
+    """Test MyPingPong on MPI.COMM_WORLD (a single rank), without pinning the rank"""
+
+    def setUp(self):
+        """Load the script and create a MyPingPong instance"""
+        super(MyPingPongTest, self).setUp()
+        self.script = loadscript()
+
+        affinity = MagicMock(cpus=[1])
+        affinity.__str__.return_value = '0'
+        with patch.object(self.script, 'sched_getaffinity', return_value=affinity):
+            with patch.object(self.script, 'sched_setaffinity'):
+                self.mpp = self.script.MyPingPong(logging.getLogger(), 10, 5)
+
+    def tearDown(self):
+        """Free the node communicator"""
+        self.mpp.nodecomm.Free()
+        super(MyPingPongTest, self).tearDown()
+
+    def test_pingpong_empty(self):
+        """Test that an empty buffer is sent as a 0 Bytes message, not replaced by the default message"""
+        pp = MagicMock(group=1)
+        self.mpp.raw = MagicMock()
+        self.mpp.rank = 0
+        with patch.object(self.script.PingPongSR, 'pingpongfactory', return_value=pp) as factory:
+            self.mpp.pingpong(0, 1, pmode='', dat=self.mpp.makedata(l=0), runid=3)
+            self.assertEqual(factory.call_args[0][:3], ('SR', self.mpp.comm, 1))
+            self.assertEqual(len(pp.setdat.call_args[0][0]), 0)
+            self.assertEqual(self.mpp.raw.add.call_args[0][2:], (1, 3, 0))
+
+            # no buffer is the default message
+            self.mpp.pingpong(0, 1, pmode='')
+            self.assertEqual(len(pp.setdat.call_args[0][0]), 1024)
+
+    def test_pingpong_warmup(self):
+        """Test that the warmup pingpongs are done before the timed ones"""
+        pp = MagicMock(group=1)
+        self.mpp.rank = 1
+        with patch.object(self.script.PingPongSR, 'pingpongfactory', return_value=pp) as factory:
+            self.mpp.pingpong(0, 1, pmode='bw', group=16)
+            self.assertEqual(factory.call_args[0][0], 'RSbw')
+            self.assertFalse(pp.dowarmup.called)
+
+            self.mpp.setwarmup(5)
+            self.mpp.pingpong(0, 1, pmode='bw', group=16)
+            pp.dowarmup.assert_called_once_with(5, 16)
+            self.assertEqual([call[0] for call in pp.method_calls[-3:]], ['dowarmup', 'dopingpong', 'timings'])
+            pp.dopingpong.assert_called_with(10, 16)
+
+    def test_calibrate(self):
+        """Test that only the given pingpongmodes are calibrated"""
+        best, calib = self.mpp.calibrate(pmodes=['', 'persist'])
+        self.assertTrue(best in ['', 'persist'])
+        self.assertEqual(sorted(calib), ['pplocal_persist', 'pplocal_plain', 'ppoverhead_persist', 'ppoverhead_plain'])
+        self.assertTrue(calib['ppoverhead_plain'] > 0)
+
+        best, calib = self.mpp.calibrate(pmodes=['persist'])
+        self.assertEqual(best, 'persist')
+        self.assertEqual(sorted(calib), ['pplocal_persist', 'ppoverhead_persist'])
+
+    def test_updatebandwidth(self):
+        """Test the bandwidth and messagerate of a bandwidth test, without 0 Bytes or 0 time samples"""
+        stats = {'bandwidth': [PairStats(2), PairStats(2)], 'msgrate': [PairStats(2), PairStats(2)]}
+        self.mpp.updatebandwidth(stats, 0, 1, 1000, [1e-6, 0.0, 2e-6])
+        self.assertEqual(stats['bandwidth'][0].count.tolist(), [0, 2])
+        self.assertEqual(stats['bandwidth'][0].max[1], 1000.0)
+        self.assertEqual(stats['bandwidth'][0].min[1], 500.0)
+        self.assertEqual(stats['msgrate'][0].count.tolist(), [0, 2])
+        self.assertEqual(stats['msgrate'][0].max[1], 1e6)
+
+        # 0 Bytes messages only have a messagerate
+        self.mpp.updatebandwidth(stats, 1, 1, 0, [1e-6, 2e-6])
+        self.assertEqual(stats['bandwidth'][1].count.tolist(), [0, 0])
+        self.assertEqual(stats['msgrate'][1].count.tolist(), [0, 2])
+
+        # a test that completed within the timer resolution has no samples
+        self.mpp.updatebandwidth(stats, 0, 0, 1000, [0.0])
+        self.assertEqual(stats['bandwidth'][0].count.tolist(), [0, 2])
+        self.assertEqual(stats['msgrate'][0].count.tolist(), [0, 2])
+
+    def test_setup_schedule(self):
+        """Test that the time of the local schedule is stored, also for the distributed one with compare"""
+        size = self.mpp.size
+        cpumap = [['node0', 'core_%s' % rank, 'hwloc_%s' % rank] for rank in range(size)]
+
+        self.mpp.setschedule('local')
+        attrs, local, _ = self.mpp.setup(2, cpumap, [1024])
+        self.assertEqual(attrs['scheduletime_local'], attrs['scheduletime'])
+
+        self.mpp.setschedule('distributed')
+        attrs, distributed, _ = self.mpp.setup(2, cpumap, [1024])
+        self.assertEqual(attrs['scheduletime_local'], 0)
+        self.assertEqual(distributed.tolist(), local.tolist())
+
+        self.mpp.setschedule('distributed', compare=True)
+        attrs, distributed, _ = self.mpp.setup(2, cpumap, [1024])
+        self.assertTrue(attrs['scheduletime_local'] > 0)
+        self.assertEqual(distributed.tolist(), local.tolist())
+
+    def test_nextabortcheck(self):
+        """Test that the abort check interval follows the rate of the rounds, also after a resume"""
+        # 50 rounds/s: at most 1 s between two checks
+        self.assertEqual(self.mpp.nextabortcheck(100, 2.0, 100, 1.0), 150)
+        # fast rounds: every abortinterval rounds
+        self.assertEqual(self.mpp.nextabortcheck(100, 0.1, 100, 1.0), 200)
+        # slow rounds: every round
+        self.assertEqual(self.mpp.nextabortcheck(100, 200.0, 100, 1.0), 101)
+        # without aborttime
+        self.assertEqual(self.mpp.nextabortcheck(100, 200.0, 100, 0), 200)
+
+        # resumed at round 990, 10 rounds in 2 s: 5 rounds/s
+        self.assertEqual(self.mpp.nextabortcheck(1000, 2.0, 100, 1.0, firstround=990), 1005)
+        self.assertEqual(self.mpp.nextabortcheck(1000, 20.0, 100, 1.0, firstround=990), 1001)
+
+    def rankdata(self, nrsizes, rank=None):
+        """
+        the data of a run of rank (default: this rank) with every partner with nrsizes messagesizes,
+        and its fail counts (different for every rank)
+        """
+        if rank is None:
+            rank = self.mpp.rank
+        size = self.mpp.size
+        shape = (nrsizes, size, len(STATS_FIELDS))
+        data = {
+            'data': n.arange(n.prod(shape), dtype=float).reshape(shape) + 100 * rank + 1,
+            'bandwidth': n.ones(shape) * (rank + 2.5),
+        }
+        fail = n.zeros((size, size), int)
+        fail[rank, (rank + 1) % size] = rank + 3
+        return data, fail
+
+    def test_gatherrows(self):
+        """Test the rows of all datasets gathered on rank 0, for a single messagesize and for a sweep"""
+        self.mpp.name = 'node%03d' % self.mpp.rank
+        self.mpp.core = str(self.mpp.rank + 3)
+        size = self.mpp.size
+
+        for nrsizes in [1, 3]:
+            data, fail = self.rankdata(nrsizes)
+
+            rows = dict(self.mpp.gatherrows(data, fail, True, False, 64))
+            self.assertEqual(sorted(rows), ['bandwidth', 'data', 'fail', 'rankdata'])
+            if self.mpp.rank == 0:
+                # the rows of all ranks, with the type of their dataset
+                self.assertEqual(rows['data'].shape, (size, nrsizes, size, len(STATS_FIELDS)))
+                self.assertEqual(rows['data'].dtype, n.dtype('f'))
+                self.assertEqual(rows['bandwidth'].shape, rows['data'].shape)
+                self.assertEqual(rows['fail'].dtype, n.dtype('i8'))
+                self.assertEqual(rows['rankdata'].dtype, n.dtype('S64'))
+                for rank in range(size):
+                    rdata, rfail = self.rankdata(nrsizes, rank=rank)
+                    self.assertEqual(rows['data'][rank].tolist(), rdata['data'].tolist())
+                    self.assertEqual(rows['bandwidth'][rank].tolist(), rdata['bandwidth'].tolist())
+                    self.assertEqual(rows['fail'][rank].tolist(), rfail[rank].tolist())
+                    self.assertEqual([x.strip() for x in rows['rankdata'][rank].tolist()],
+                                     [b'node%03d' % rank, b'%d' % (rank + 3)])
+            else:
+                self.assertEqual(rows['data'], None)
+
+            # no fail dataset if no rank failed
+            self.assertEqual([name for name, _ in self.mpp.gatherrows(data, fail, False, False, 64)],
+                             ['bandwidth', 'data', 'rankdata'])
+
+            # with parallel IO, every rank keeps its own rows
+            rows = dict(self.mpp.gatherrows(data, fail, True, True, 64))
+            self.assertEqual(rows['data'].shape, (nrsizes, size, len(STATS_FIELDS)))
+            self.assertEqual(rows['fail'].tolist(), fail[self.mpp.rank].tolist())
+
+    def writeread(self, nrsizes, parallel_io=False, sparse=False):
+        """
+        write the data of a run with writehdf5 (collective) and read it back on all ranks,
+        as a dict of name: (attrs, values)
+        """
+        comm = self.mpp.comm
+        tmpdir = comm.bcast(tempfile.mkdtemp() if self.mpp.rank == 0 else None, root=0)
+        try:
+            self.mpp.fn = os.path.join(tmpdir, 'out.h5')
+            self.mpp.setsparse(sparse)
+            self.mpp.nodenames = ['node']
+            self.mpp.rankinfo = n.zeros((self.mpp.size, 2), int)
+            data, fail = self.rankdata(nrsizes)
+            self.assertEqual(self.mpp.writehdf5(data, {'pairmode': 'test'}, True, fail, parallel_io=parallel_io),
+                             self.mpp.fn)
+            comm.barrier()
+
+            fh = h5py.File(self.mpp.fn, 'r')
+            res = dict([(name, (dict(fh[name].attrs), fh[name][...])) for name in fh])
+            res['file'] = (dict(fh.attrs), None)
+            fh.close()
+            return res
+        finally:
+            comm.barrier()
+            if self.mpp.rank == 0:
+                shutil.rmtree(tmpdir)
+
+    def test_writehdf5(self):
+        """Test writing the dense and the sparse layout without parallel IO"""
+        size = self.mpp.size
+        res = self.writeread(3)
+        self.assertEqual(res['file'][0]['pairmode'], 'test')
+        for rank in range(size):
+            data, fail = self.rankdata(3, rank=rank)
+            # the messagesize is the first dimension
+            self.assertEqual(res['data'][1][:, rank].tolist(), data['data'].tolist())
+            self.assertEqual(res['fail'][1][rank].tolist(), fail[rank].tolist())
+
+        res = self.writeread(1)
+        for rank in range(size):
+            data, _ = self.rankdata(1, rank=rank)
+            self.assertEqual(res['bandwidth'][1][rank].tolist(), data['bandwidth'][0].tolist())
+
+        res = self.writeread(3, sparse=True)
+        self.assertEqual(res['file'][0]['layout'], 'coo')
+        self.assertEqual(res['data'][0]['shape'].tolist(), [3, size, size, len(STATS_FIELDS)])
+        entries = res['data'][1]
+        self.assertEqual(entries['sender'].tolist(), sorted(entries['sender'].tolist()))
+        for rank in range(size):
+            data, fail = self.rankdata(3, rank=rank)
+            mine = entries[entries['sender'] == rank]
+            self.assertEqual(mine['stats'].tolist(), data['data'].reshape(-1, len(STATS_FIELDS)).tolist())
+            self.assertEqual(res['fail'][1]['count'][rank], rank + 3)
+
+    def test_writehdf5_parallel(self):
+        """Test the collective writes of every rank with parallel IO"""
+        if not h5py.get_config().mpi:
+            self.skipTest("h5py without MPI support")
+
+        res = self.writeread(3, parallel_io=True)
+        data, fail = self.rankdata(3)
+        self.assertEqual(res['data'][1][:, self.mpp.rank].tolist(), data['data'].tolist())
+        self.assertEqual(res['fail'][1][self.mpp.rank].tolist(), fail[self.mpp.rank].tolist())
+
+        res = self.writeread(1, parallel_io=True, sparse=True)
+        data, _ = self.rankdata(1)
+        entries = res['data'][1]
+        mine = entries[entries['sender'] == self.mpp.rank]
+        self.assertEqual(mine['stats'].tolist(), data['data'][0].tolist())
+
+    def test_resumecheckpoint(self):
+        """Test that a checkpoint is only resumed with the same settings"""
+        size, rank = self.mpp.size, self.mpp.rank
+        comm = self.mpp.comm
+        tmpdir = comm.bcast(tempfile.mkdtemp() if rank == 0 else None, root=0)
+        self.mpp.fn = os.path.join(tmpdir, 'out.h5')
+
+        def defaults(mpp):
+            """the settings of the interrupted run"""
+            mpp.setpairmode(pairmode='shuffle')
+            mpp.concurrency = None
+            mpp.setschedule('local')
+            mpp.setwarmup(0)
+            mpp.settimer('wtime')
+            mpp.it, mpp.seed = 10, 2
+
+        def resume(change, pmode='', bandwidth=0):
+            """resume with the settings changed by change (a function), returns the round, counts and fails"""
+            defaults(self.mpp)
+            change(self.mpp)
+            # the resumed run has a new outputfile
+            self.mpp.fn = os.path.join(tmpdir, 'new.h5')
+            self.mpp.setcheckpoint(0, resume=os.path.join(tmpdir, 'out'))
+            stats = {'data': [PairStats(size)]}
+            fail = n.zeros((size, size), int)
+            meta = self.mpp.checkpointmeta([1024], stats, pmode, bandwidth, False)
+            nextround = self.mpp.resumecheckpoint(stats, fail, None, meta)
+            comm.barrier()
+            return nextround, stats['data'][0].count.tolist(), fail[rank].tolist()
+
+        try:
+            defaults(self.mpp)
+            self.mpp.setcheckpoint(5)
+            stats = {'data': [PairStats(size)]}
+            stats['data'][0].update(0, [1.0, 2.0])
+            fail = n.zeros(size, int)
+            fail[0] = 1
+            self.mpp.checkpoint.write(5, stats, fail, self.mpp.checkpointmeta([1024], stats, '', 0, False))
+            comm.barrier()
+
+            # the same settings
+            self.assertEqual(resume(lambda mpp: None), (5, [2] + [0] * (size - 1), [1] + [0] * (size - 1)))
+
+            # every setting that changes the schedule or the measurements
+            refused = (0, [0] * size, [0] * size)
+            changes = [
+                lambda mpp: mpp.setpairmode(pairmode='shuffle', rngfilter='incl'),
+                lambda mpp: mpp.setpairmode(pairmode='roundrobin'),
+                lambda mpp: mpp.setconcurrency([1]),
+                lambda mpp: mpp.setschedule('distributed'),
+                lambda mpp: mpp.setwarmup(10),
+                lambda mpp: mpp.settimer('perf_counter'),
+                lambda mpp: setattr(mpp, 'it', 20),
+                lambda mpp: setattr(mpp, 'seed', 3),
+            ]
+            for change in changes:
+                self.assertEqual(resume(change), refused)
+                # the checkpoints of the interrupted run are kept
+                self.assertEqual(self.mpp.checkpoint.prefix, os.path.join(tmpdir, 'new'))
+                self.mpp.checkpoint.remove()
+                self.assertEqual(resume(lambda mpp: None)[0], 5)
+            self.assertEqual(resume(lambda mpp: None, pmode='kernel'), refused)
+            self.assertEqual(resume(lambda mpp: None, bandwidth=16), refused)
+        finally:
+            comm.barrier()
+            if rank == 0:
+                shutil.rmtree(tmpdir)
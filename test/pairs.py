@@ -0,0 +1,303 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+
+import numpy as n
+
+from vsc.install.testing import TestCase
+from vsc.mympingpong.pairs import FEISTEL_ROUNDS, IDLE, SCHEDULE_BLOCK, Pair, PropertyIndex, permute, roundkeys
+from vsc.mympingpong.topology import DISTANCES, Topology
+
+from .topology import topomap
+
+
+class PairsTest(TestCase):
+    """Test pairs"""
+
+    def cpumap(self, nodes, cores):
+        """a cpumap of ranks on nodes with cores each"""
+        return [['node%s' % (rank // cores), 'core_%s' % (rank % cores), 'hwloc_%s' % (rank % cores)]
+                for rank in range(nodes * cores)]
+
+    def allpairs(self, pairmode, size, nr, seed=1, concurrency=None, cpumap=None, rngfilter=None, distances=None):
+        """the pairs of every rank, as generated independently by every rank"""
+        res = []
+        for rank in range(size):
+            pair = Pair.pairfactory(pairmode, seed=seed, rng=size, pairid=rank, logger=logging.getLogger())
+            pair.setcpumap(cpumap or self.cpumap(1, size), rngfilter=rngfilter)
+            if distances:
+                pair.setdistances(distances)
+            pair.setnr(nr)
+            if concurrency:
+                pair.setconcurrency(concurrency)
+            res.append(pair.makepairs())
+        return n.array(res)
+
+    def checkpairs(self, allpairs):
+        """every rank is paired with a partner that is paired with it (or -1, -2 or IDLE)"""
+        size, nr, _ = allpairs.shape
+        for runid in range(nr):
+            for rank in range(size):
+                p1, p2 = allpairs[rank, runid]
+                other = p2 if p1 == rank else p1
+                self.assertTrue(rank in (p1, p2))
+                if other >= 0:
+                    self.assertEqual(sorted(allpairs[other, runid]), sorted([p1, p2]))
+
+    def test_concurrency(self):
+        """Test the number of active pairs per round"""
+        for pairmode in ['shuffle', 'shift']:
+            size = 10
+            levels = [1, 2, 5]
+            allpairs = self.allpairs(pairmode, size, 30, concurrency=levels)
+            self.checkpairs(allpairs)
+
+            nrpairs = []
+            for runid in range(30):
+                active = set([tuple(sorted(allpairs[rank, runid])) for rank in range(size)
+                              if IDLE not in allpairs[rank, runid]])
+                nrpairs.append(len(active))
+                # the idle ranks are all idle
+                idle = [rank for rank in range(size) if IDLE in allpairs[rank, runid]]
+                self.assertEqual(len(idle), size - 2 * len(active))
+            self.assertEqual(nrpairs, [levels[runid % len(levels)] for runid in range(30)])
+
+            # without concurrency, there are no idle ranks
+            allpairs = self.allpairs(pairmode, size, 30)
+            self.checkpairs(allpairs)
+            self.assertFalse((allpairs == IDLE).any())
+
+    def test_shift(self):
+        """Test the shift schedule against shifting the ranks"""
+        size = 8
+        allpairs = self.allpairs('shift', size, 20)
+        self.checkpairs(allpairs)
+        for runid in range(20):
+            b = n.roll(n.arange(size), runid).reshape(size // 2, 2)
+            for rank in range(size):
+                self.assertEqual(allpairs[rank, runid].tolist(), b[n.where(b == rank)[0][0]].tolist())
+
+    def test_shuffle(self):
+        """Test the shuffle schedule"""
+        size = 7
+        nr = 2 * SCHEDULE_BLOCK + 5
+        # the global random state is not touched
+        n.random.seed(42)
+        before = n.random.get_state()[1].copy()
+        allpairs = self.allpairs('shuffle', size, nr)
+        self.assertTrue((n.random.get_state()[1] == before).all())
+        self.checkpairs(allpairs)
+        # the odd rank out is paired with -2
+        self.assertEqual((allpairs == -2).sum(), nr)
+        # the same for the same seed, different for another
+        self.assertTrue((allpairs == self.allpairs('shuffle', size, nr)).all())
+        self.assertFalse((allpairs == self.allpairs('shuffle', size, nr, seed=2)).all())
+
+        # a single round is the same as in the schedule
+        pair = Pair.pairfactory('shuffle', seed=1, rng=size, pairid=3, logger=logging.getLogger())
+        pair.filterrng()
+        for runid in [0, SCHEDULE_BLOCK + 3, nr - 1]:
+            self.assertEqual(pair.new(n.array(pair.rng), runid).tolist(), allpairs[3, runid].tolist())
+
+    def test_permute(self):
+        """Test the random permutations"""
+        keys = roundkeys(1, 3)
+        self.assertEqual(keys.shape, (SCHEDULE_BLOCK, FEISTEL_ROUNDS))
+        self.assertTrue((keys == roundkeys(1, 3)).all())
+        self.assertFalse((keys == roundkeys(1, 4)).any())
+
+        for size in [1, 2, 6, 64, 100, 1001]:
+            values = n.arange(size)
+            for key in keys[:5]:
+                rowkeys = n.tile(key, (size, 1))
+                perm = permute(values, rowkeys, size)
+                self.assertEqual(sorted(perm.tolist()), values.tolist())
+                self.assertEqual(permute(perm, rowkeys, size, inverse=True).tolist(), values.tolist())
+
+    def test_propertyindex(self):
+        """Test the property index"""
+        cpumap = self.cpumap(3, 4)
+        index = PropertyIndex(cpumap)
+        self.assertEqual(len(index.names), 3 + 4 + 4)
+        self.assertEqual(index.codes.shape, (12, 3))
+        for rank, props in enumerate(cpumap):
+            self.assertEqual([index.names[code] for code in index.codes[rank]], props)
+        self.assertEqual(index.ranks(index.names.index('node1')).tolist(), [4, 5, 6, 7])
+        self.assertEqual(index.ranks(index.names.index('core_2')).tolist(), [2, 6, 10])
+        self.assertEqual(index.sharing(5).tolist(), [1, 4, 5, 6, 7, 9])
+        self.assertEqual(index.conflicts(n.array([0, 0, 0, 3, -1]), n.array([1, 4, 5, 7, 0])).tolist(),
+                         [True, True, False, True, False])
+
+        index = PropertyIndex(cpumap, mapfilter='^hwloc')
+        self.assertEqual(index.names, ['hwloc_%s' % x for x in range(4)])
+        self.assertEqual(index.codes[:, 1:].tolist(), [[-1, -1]] * 12)
+        self.assertEqual(index.sharing(5).tolist(), [1, 5, 9])
+
+    def test_incl(self):
+        """Test the incl rngfilter: only pair with ranks on the same node"""
+        cpumap = [['node%s' % (rank // 4)] for rank in range(12)]
+        allpairs = self.allpairs('shuffle', 12, 20, cpumap=cpumap, rngfilter='incl')
+        self.checkpairs(allpairs)
+        self.assertTrue((allpairs // 4 == n.arange(12)[:, None, None] // 4).all())
+
+    def test_groupexcl(self):
+        """Test groupexcl: only pair ranks without properties in common"""
+        cpumap = self.cpumap(4, 4)
+        index = PropertyIndex(cpumap)
+        allpairs = self.allpairs('groupexcl', 16, 50, cpumap=cpumap)
+        self.checkpairs(allpairs)
+        flat = allpairs.reshape(-1, 2)
+        self.assertFalse(index.conflicts(flat[:, 0], flat[:, 1]).any())
+        self.assertTrue((allpairs >= 0).all())
+        self.assertTrue((allpairs == self.allpairs('groupexcl', 16, 50, cpumap=cpumap)).all())
+
+        # 2 ranks on the same node can't be paired
+        allpairs = self.allpairs('groupexcl', 2, 5, cpumap=[['node0'], ['node0']])
+        self.assertEqual(allpairs[0].tolist(), [[0, -1]] * 5)
+
+    def test_hwloc(self):
+        """Test hwloc: cycle over the hwloc properties, pairing the ranks that have it"""
+        cpumap = self.cpumap(4, 2)
+        allpairs = self.allpairs('hwloc', 8, 40, cpumap=cpumap)
+        self.checkpairs(allpairs)
+        for runid in range(40):
+            hwloc = (runid // 10) % 2
+            for rank in range(8):
+                if rank % 2 == hwloc:
+                    self.assertEqual((allpairs[rank, runid] % 2).tolist(), [hwloc, hwloc])
+                else:
+                    self.assertEqual(allpairs[rank, runid].tolist(), [rank, IDLE])
+
+    def test_roundpairs(self):
+        """Test that the pairs of all ranks of a round are the pairs generated by every rank"""
+        cpumap = self.cpumap(4, 4)
+        for pairmode, size in [('shuffle', 16), ('shuffle', 11), ('shift', 10), ('groupexcl', 16), ('roundrobin', 9)]:
+            allpairs = self.allpairs(pairmode, size, 2 * SCHEDULE_BLOCK + 3, cpumap=cpumap[:size])
+            pair = Pair.pairfactory(pairmode, seed=1, rng=size, pairid=0, logger=logging.getLogger())
+            pair.setcpumap(cpumap[:size])
+            pair.filterrng()
+            self.assertTrue(pair.DISTRIBUTED)
+            for runid in range(2 * SCHEDULE_BLOCK + 3):
+                for row, (p1, p2) in enumerate(pair.roundpairs(n.array(pair.rng), runid)):
+                    for rank in [p1, p2]:
+                        if rank >= 0:
+                            self.assertEqual(allpairs[rank, runid].tolist(), [p1, p2])
+
+    def test_makepairsdistributed(self):
+        """Test makepairsdistributed (with a single rank)"""
+        from mpi4py import MPI
+
+        for pairmode in ['shuffle', 'shift', 'groupexcl', 'hwloc']:
+            res = []
+            for distributed in [True, False]:
+                pair = Pair.pairfactory(pairmode, seed=1, rng=1, pairid=0, logger=logging.getLogger())
+                pair.setcpumap(self.cpumap(1, 1))
+                pair.setnr(5)
+                res.append(pair.makepairsdistributed(MPI.COMM_SELF) if distributed else pair.makepairs())
+            self.assertEqual(res[0].shape, (5, 2))
+            self.assertEqual(res[0].tolist(), res[1].tolist())
+
+    def test_roundrobin(self):
+        """Test the round-robin schedule: all ordered pairs in the minimal number of rounds"""
+        for size in [2, 5, 8, 13]:
+            nrranks = size + size % 2
+            nr = 2 * (nrranks - 1)
+            allpairs = self.allpairs('roundrobin', size, 2 * nr)
+            self.checkpairs(allpairs)
+            for first in [0, nr]:
+                rounds = allpairs[:, first:first + nr]
+                ordered = set([tuple(p) for p in rounds.reshape(-1, 2)])
+                self.assertEqual(len(ordered), nrranks * (nrranks - 1))
+                # every rank sends to every other rank once
+                for rank in range(size):
+                    partners = [p2 for p1, p2 in rounds[rank] if p1 == rank]
+                    expected = [IDLE] * (size % 2) + [x for x in range(size) if x != rank]
+                    self.assertEqual(sorted(partners), expected)
+            # the bye is idle, not a failed pair (-1 or -2 partners are counted as fails in a run)
+            self.assertFalse(n.isin(allpairs, [-1, -2]).any())
+            self.assertEqual((allpairs == IDLE).sum(), 2 * nr * (size % 2))
+
+    def test_adaptive(self):
+        """Test the steering of the adaptive pairmode toward suspicious pairs"""
+        log = logging.getLogger()
+        pair = Pair.pairfactory('adaptive', seed=1, rng=10, pairid=0, logger=log)
+
+        # partner 3 has a high latency, 5 a high variance, 7 few samples, 9 no samples
+        count = n.array([0, 100, 100, 100, 100, 100, 100, 1, 100, 0])
+        mean = n.array([0, 1, 1, 3, 1, 1, 1, 1, 1, 0], float)
+        stdev = n.array([0, 0, 0, 0, 0, 1, 0, 0, 0, 0], float)
+        candidates = pair.suspicious(count, mean, stdev, nrcandidates=4)
+        self.assertEqual(candidates[:3, 0].tolist(), [7, 3, 5])
+        self.assertTrue(candidates[3, 1] > 0)
+        self.assertEqual(pair.suspicious(n.zeros(10), n.zeros(10), n.zeros(10))[:, 0].tolist(), [-1] * 4)
+
+        for size in [10, 11]:
+            # rank r suspects rank r + 1 and (with a lower score) rank r + 2
+            candidates = n.zeros((size, 2, 2))
+            candidates[:, :, 0] = (n.arange(size)[:, None] + [1, 2]) % size
+            candidates[:, :, 1] = [2, 1]
+            # rank 2 has no candidates
+            candidates[2] = [[-1, 0], [-1, 0]]
+
+            allpairs = []
+            for rank in range(size):
+                pair = Pair.pairfactory('adaptive', seed=1, rng=size, pairid=rank, logger=log)
+                iterations, res, rows = pair.steer(candidates, n.arange(50, 60))
+                allpairs.append(res)
+            self.assertEqual(iterations.tolist(), [51, 53, 55, 57, 59])
+            allpairs = n.array(allpairs)
+            self.checkpairs(allpairs)
+
+            nrcandidates = 0
+            for runid in range(len(iterations)):
+                ordered = set([tuple(p) for p in allpairs[:, runid]])
+                # a perfect matching
+                self.assertEqual(sum(len(p) for p in ordered), size + size % 2)
+                nrcandidates += len([p for p in ordered if p[0] >= 0 and (p[1] - p[0]) % size in (1, 2)])
+            # most pairs are candidates, (almost) all pairs of the first round are (rank 2 has no candidates)
+            self.assertTrue(nrcandidates > 3 * len(iterations))
+
+    def test_distance(self):
+        """Test pairing at a distance class"""
+        cpumap = topomap(3, 2, 2, 3)
+        size = len(cpumap)
+        topo = Topology.fromcpumap(cpumap)
+        for distances in [['numa'], ['socket'], ['node'], ['remote'], ['numa', 'remote', 'remote']]:
+            allpairs = self.allpairs('distance', size, 12, cpumap=cpumap, distances=distances)
+            self.checkpairs(allpairs)
+            for runid in range(12):
+                distance = DISTANCES.index(distances[runid % len(distances)])
+                pairs = allpairs[:, runid]
+                active = pairs[pairs[:, 1] != IDLE]
+                self.assertTrue((topo.distance(active[:, 0], active[:, 1]) == distance).all())
+                # only the odd rank of every numa node is idle
+                self.assertEqual(len(active), size - (3 * 2 * 2 if distance == 0 else 0))
+
+        # rank 5 has no hwloc info, it is only paired remote
+        cpumap[5][2] = 'hwloc_None'
+        allpairs = self.allpairs('distance', size, 8, cpumap=cpumap)
+        self.checkpairs(allpairs)
+        partners = [p2 if p1 == 5 else p1 for p1, p2 in allpairs[5]]
+        self.assertEqual([p == IDLE for p in partners], [runid % 4 != 3 for runid in range(8)])
@@ -0,0 +1,157 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+import threading
+import time
+
+import numpy as n
+from mpi4py import MPI
+
+from vsc.install.testing import TestCase
+from vsc.mympingpong.pingpongers import PingPongSR, _pingpong
+
+
+class PingPongersTest(TestCase):
+    """Test pingpongers, by pingponging with self on MPI.COMM_SELF"""
+
+    def selfpingponger(self, pptype, it, group=None, msgsize=8):
+        """create a pingponger of pptype that pingpongs with itself, and pingpong it times"""
+        pp = PingPongSR.pingpongfactory(pptype, MPI.COMM_SELF, 0, logging.getLogger())
+        # the messages are sent to self, so the tags have to match
+        pp.tag2 = pp.tag1
+        pp.setdat(n.zeros(msgsize, 'b'))
+        if group:
+            pp.dopingpong(it, group)
+        else:
+            pp.dopingpong(it)
+        return pp
+
+    def test_sr(self):
+        """Test the plain SR pingponger"""
+        pp = self.selfpingponger('SR', 10)
+        self.assertEqual(pp.timings().shape, (10,))
+        self.assertEqual(pp.group, 1)
+        self.assertTrue((pp.timings() > 0).all())
+
+    def test_persist(self):
+        """Test the pingponger with persistent requests"""
+        for it, group, counts in [(10, 3, [3, 3, 3, 1]), (10, 5, [5, 5]), (2, 25, [2])]:
+            pp = self.selfpingponger('SRpersist', it, group)
+            self.assertEqual(pp.counts.tolist(), counts)
+            self.assertEqual(pp.timings().shape, (len(counts),))
+            self.assertTrue((pp.timings() > 0).all())
+            # requests are freed
+            self.assertEqual(pp.sreq, None)
+
+    def test_warmup(self):
+        """Test the untimed warmup pingpongs"""
+        for pptype, group, shape in [('SR', None, (10,)), ('SRpersist', 5, (2,)), ('SRbidir', None, (2, 10))]:
+            pp = self.selfpingponger(pptype, 1)
+            pp.dowarmup(3, group)
+            if group:
+                pp.dopingpong(10, group)
+            else:
+                pp.dopingpong(10)
+            # only the timed pingpongs are in the timings
+            self.assertEqual(pp.timings().shape, shape)
+
+    def test_bidir(self):
+        """Test the bidirectional pingponger"""
+        pp = self.selfpingponger('SRbidir', 5)
+        timings = pp.timings()
+        self.assertEqual(timings.shape, (2, 5))
+        # receive completed before the full exchange
+        self.assertTrue((timings[1] <= timings[0]).all())
+
+    def test_kernel(self):
+        """Test the pingponger with the compiled kernel"""
+        if _pingpong is None:
+            self.skipTest("compiled kernel vsc.mympingpong._pingpong not available")
+
+        pp = self.selfpingponger('SRkernel', 7, 1)
+        # group 1: every pingpong is timed
+        self.assertEqual(pp.counts.tolist(), [1] * 7)
+        self.assertTrue((pp.timings() > 0).all())
+
+        pp.dowarmup(3)
+        self.assertEqual(pp.warmup, 3)
+        pp.dopingpong(100, 30)
+        self.assertEqual(pp.counts.tolist(), [30, 30, 30, 10])
+        self.assertTrue((pp.end >= pp.start).all())
+
+    def test_available(self):
+        """Test probing of the available pingpongmodes"""
+        log = logging.getLogger()
+        for pmode in ['', 'persist', 'bw', 'bidir']:
+            self.assertTrue(PingPongSR.available(pmode, MPI.COMM_SELF, log))
+        self.assertEqual(PingPongSR.available('kernel', MPI.COMM_SELF, log), _pingpong is not None)
+        self.assertEqual(PingPongSR.available('fast2', MPI.COMM_SELF, log), hasattr(MPI.COMM_SELF, 'PingpongSR25'))
+        self.assertFalse(PingPongSR.available('nosuchmode', MPI.COMM_SELF, log))
+
+    def test_timer(self):
+        """Test pingpongers with the performance counter"""
+        log = logging.getLogger()
+        for pmode in ['SR', 'SRpersist', 'SRkernel']:
+            if pmode == 'SRkernel' and _pingpong is None:
+                continue
+            pp = PingPongSR.pingpongfactory(pmode, MPI.COMM_SELF, 0, log)
+            self.assertEqual(pp.settimer('perf_counter'), 'perf_counter')
+            pp.tag2 = pp.tag1
+            pp.setdat(n.zeros(8, 'b'))
+            before = time.perf_counter()
+            pp.dopingpong(10, 5)
+            # the timings come from the performance counter
+            self.assertTrue((pp.start >= before).all())
+            self.assertTrue((pp.end <= time.perf_counter()).all())
+
+    def test_bw(self):
+        """Test the streaming bandwidth pingpongers, with the receiving side in a thread"""
+        log = logging.getLogger()
+        sr = PingPongSR.pingpongfactory('SRbw', MPI.COMM_SELF, 0, log)
+        rs = PingPongSR.pingpongfactory('RSbw', MPI.COMM_SELF, 0, log)
+        dat = n.arange(16, dtype='b')
+        sr.setdat(dat)
+        rs.setdat(n.zeros(16, 'b'))
+
+        receiver = threading.Thread(target=rs.dopingpong, args=(5, 8))
+        receiver.start()
+        sr.dopingpong(5, 8)
+        receiver.join(30)
+        self.assertFalse(receiver.is_alive())
+
+        # every message sent is received, and nothing is left
+        self.assertEqual((sr.msgs, rs.msgs), (40, 40))
+        self.assertFalse(MPI.COMM_SELF.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG))
+        self.assertEqual(rs.rcvbuf.tolist(), dat.tolist())
+        # requests are freed
+        self.assertEqual((sr.reqs, rs.reqs), (None, None))
+
+        # time per message: the bandwidth is the messagesize over it
+        timings = sr.timings()
+        self.assertEqual(timings.shape, (5,))
+        self.assertTrue((timings > 0).all())
+        self.assertTrue(n.allclose(timings * 8, sr.end - sr.start))
+        # the average bandwidth is all bytes sent over the total time
+        self.assertTrue(n.isclose(dat.nbytes / timings.mean(), sr.msgs * dat.nbytes / n.sum(sr.end - sr.start)))
@@ -0,0 +1,89 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import shutil
+import tempfile
+
+import h5py
+import numpy as n
+
+from vsc.install.testing import TestCase
+from vsc.mympingpong.rawdata import RawBuffer, RAW_DATASET
+
+
+class RawDataTest(TestCase):
+    """Test rawdata"""
+
+    def setUp(self):
+        """Create a temporary directory"""
+        super(RawDataTest, self).setUp()
+        self.rawdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the temporary directory"""
+        shutil.rmtree(self.rawdir)
+        super(RawDataTest, self).tearDown()
+
+    def test_rawbuffer(self):
+        """Test buffering, flushing and reading back the raw timings"""
+        fn = os.path.join(self.rawdir, 'raw.h5')
+        raw = RawBuffer(fn, capacity=10)
+
+        starts = []
+        for runid in range(7):
+            start = n.arange(4) + runid * 10.0
+            raw.add(start, start + 0.5, runid % 3, runid, 2 ** runid)
+            starts.extend(start)
+            if runid == 1:
+                # buffer holds 8 timings, nothing written yet
+                self.assertFalse(os.path.exists(fn))
+        # more than the capacity at once
+        start = n.arange(25) + 100.0
+        raw.add(start, start + 0.5, 5, 7, 1)
+        starts.extend(start)
+
+        raw.attrs['rank'] = 3
+        raw.close()
+
+        f = h5py.File(fn, 'r')
+        data = f[RAW_DATASET][:]
+        self.assertEqual(f.attrs['rank'], 3)
+        self.assertEqual(f[RAW_DATASET].compression, 'gzip')
+        self.assertEqual(f[RAW_DATASET].maxshape, (None,))
+        f.close()
+
+        self.assertEqual(data['start'].tolist(), starts)
+        self.assertEqual((data['end'] - data['start']).tolist(), [0.5] * len(starts))
+        self.assertEqual(data['runid'].tolist(), [x // 4 for x in range(28)] + [7] * 25)
+        self.assertEqual(data['partner'].tolist(), [(x // 4) % 3 for x in range(28)] + [5] * 25)
+        self.assertEqual(data['msgsize'].tolist(), [2 ** (x // 4) for x in range(28)] + [1] * 25)
+
+    def test_rawbuffer_empty(self):
+        """Closing an empty buffer still creates the file"""
+        fn = os.path.join(self.rawdir, 'raw.h5')
+        RawBuffer(fn).close()
+        f = h5py.File(fn, 'r')
+        self.assertEqual(f[RAW_DATASET].shape, (0,))
+        f.close()
@@ -0,0 +1,67 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+import numpy as n
+
+from vsc.install.testing import TestCase
+from vsc.mympingpong.sparse import COO_DTYPE, FAIL_DTYPE, failtocoo, tocoo, todense
+from vsc.mympingpong.stats import STATS_FIELDS
+
+
+class SparseTest(TestCase):
+    """Test the sparse (coo) layout"""
+
+    def test_tocoo(self):
+        """Test the entries of the pairs with samples, and the dense blocks made from them"""
+        size, nrsizes = 5, 2
+        dense = n.zeros((nrsizes, size, size, len(STATS_FIELDS)), 'f4')
+        for sender, receiver, sizeid in [(0, 3, 0), (0, 4, 1), (2, 1, 0), (2, 1, 1), (4, 0, 1)]:
+            dense[sizeid, sender, receiver] = [sender + 1, receiver, sizeid, 1, 2]
+
+        entries = n.concatenate([tocoo(sender, dense[:, sender]) for sender in range(size)])
+        self.assertEqual(entries.dtype, COO_DTYPE)
+        self.assertEqual(entries.size, 5)
+        # sorted by sender
+        self.assertEqual(entries['sender'].tolist(), [0, 0, 2, 2, 4])
+        self.assertEqual(entries['receiver'].tolist(), [3, 4, 1, 1, 0])
+
+        for sizeid in range(nrsizes):
+            self.assertTrue((todense(entries, (0, size), (0, size), sizeid=sizeid) == dense[sizeid]).all())
+            # a block
+            block = todense(entries, (1, 3), (0, 2), sizeid=sizeid)
+            self.assertEqual(block.shape, (2, 2, len(STATS_FIELDS)))
+            self.assertTrue((block == dense[sizeid, 1:3, 0:2]).all())
+
+        # a sender without samples
+        self.assertEqual(tocoo(1, dense[:, 1]).size, 0)
+
+    def test_failtocoo(self):
+        """Test the entries of the fail counts"""
+        fail = n.array([[0, 2, 0], [0, 0, 0], [1, 0, 3]], 'i8')
+
+        entries = n.concatenate([failtocoo(sender, fail[sender]) for sender in range(3)])
+        self.assertEqual(entries.dtype, FAIL_DTYPE)
+        self.assertEqual(entries['count'].tolist(), [2, 1, 3])
+        self.assertTrue((todense(entries, (0, 3), (0, 3), field='count') == fail).all())
+        self.assertEqual(todense(entries, (2, 3), (1, 3), field='count').tolist(), [[0, 3]])
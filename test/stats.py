@@ -0,0 +1,74 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+import numpy as n
+
+from vsc.install.testing import TestCase
+from vsc.mympingpong.stats import PairStats, STATE_FIELDS, STATS_FIELDS
+
+
+class StatsTest(TestCase):
+    """Test stats"""
+
+    def test_pairstats(self):
+        """Test PairStats against numpy on the full set of samples"""
+        n.random.seed(1)
+        stats = PairStats(4)
+
+        allsamples = {1: [], 3: []}
+        for i in range(50):
+            partner = [1, 3][i % 2]
+            samples = n.random.random(n.random.randint(1, 10)) * 1e-6 + 1e-6
+            stats.update(partner, samples)
+            allsamples[partner].extend(samples)
+        # scalars are accepted too
+        stats.update(1, 1.5e-6)
+        allsamples[1].append(1.5e-6)
+
+        res = stats.asarray()
+        self.assertEqual(res.shape, (4, len(STATS_FIELDS)))
+        self.assertEqual(res[0].tolist(), [0] * len(STATS_FIELDS))
+        self.assertEqual(res[2].tolist(), [0] * len(STATS_FIELDS))
+
+        for partner, samples in allsamples.items():
+            samples = n.array(samples)
+            expected = [samples.size, samples.mean(), samples.std(), samples.min(), samples.max()]
+            self.assertTrue(n.allclose(res[partner], expected, rtol=1e-10, atol=0),
+                            msg='stats for %s %s equal to %s' % (partner, res[partner], expected))
+
+    def test_state(self):
+        """Test restoring PairStats from its state, and continuing the updates"""
+        stats = PairStats(3)
+        stats.update(1, [1.0, 2.0, 4.0])
+        state = stats.getstate()
+        self.assertEqual(state.shape, (len(STATE_FIELDS), 3))
+
+        restored = PairStats(3)
+        restored.setstate(state)
+        self.assertEqual(restored.asarray().tolist(), stats.asarray().tolist())
+
+        stats.update(1, [8.0])
+        restored.update(1, [8.0])
+        self.assertEqual(restored.count.tolist(), [0, 4, 0])
+        self.assertTrue(n.allclose(restored.asarray(), stats.asarray()))
@@ -0,0 +1,64 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+import time
+
+from mpi4py import MPI
+
+from vsc.install.testing import TestCase
+from vsc.mympingpong.timers import PHASES, TIMERS, PhaseTimer, calibrate, timertick
+
+
+class TimersTest(TestCase):
+    """Test timers"""
+
+    def test_calibrate(self):
+        """Test the calibration of all timers"""
+        for name, timer in TIMERS.items():
+            calib = calibrate(name, nrsamples=1000)
+            self.assertEqual(sorted(calib.keys()), ['overhead', 'resolution', 'tick'])
+            self.assertTrue(calib['overhead'] > 0)
+            self.assertTrue(calib['resolution'] > 0)
+            self.assertEqual(calib['tick'], timertick(name))
+            # a timer with a resolution of more than a millisecond is useless
+            self.assertTrue(calib['resolution'] < 1e-3)
+
+            start = timer()
+            self.assertTrue(timer() >= start)
+
+    def test_phasetimer(self):
+        """Test the phase timer"""
+        phases = PhaseTimer()
+        self.assertEqual(phases.phases, PHASES)
+        with phases.timed('pingpong'):
+            time.sleep(0.01)
+        phases.add('pingpong', 1.0)
+        phases.add('barrier', 0.5)
+        self.assertTrue(phases.durations['pingpong'] >= 1.01)
+
+        reduced = phases.reduce(MPI.COMM_SELF)
+        self.assertEqual(sorted(reduced), sorted(['phase_%s' % phase for phase in PHASES]))
+        # a single rank: min, median and max are the same
+        self.assertEqual(reduced['phase_barrier'].tolist(), [0.5] * 3)
+        self.assertEqual(reduced['phase_writehdf5'].tolist(), [0.0] * 3)
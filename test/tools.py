@@ -24,6 +24,8 @@
 #
 from mock import patch
 import os
+import shutil
+import socket
 import tempfile
 
 import vsc.mympingpong.tools
@@ -134,3 +136,197 @@ class ToolsTest(TestCase):
                     gen_map[aPU] = "socket %s core %s abscore %s numa %s" % (sk, cr, aPU, numa)
                     aPU += 1
         self.assertEqual(hmap, gen_map, msg='broadwell hwlocmap %s is equal to generated map %s' % (hmap, gen_map))
+
+    def test_parsesizes(self):
+        """Test parsesizes"""
+        parsesizes = vsc.mympingpong.tools.parsesizes
+
+        self.assertEqual(parsesizes('1024'), [1024])
+        self.assertEqual(parsesizes('4096,1,1024,1'), [1, 1024, 4096])
+        self.assertEqual(parsesizes('1:4194304:23'), [2 ** x for x in range(23)])
+        self.assertEqual(parsesizes('8:8:3'), [8])
+        # rounding can make sizes equal
+        self.assertEqual(parsesizes('1:4:10'), [1, 2, 3, 4])
+        # 0 Bytes, in both forms
+        self.assertEqual(parsesizes('0,8'), [0, 8])
+        self.assertEqual(parsesizes('0:1024:12'), [0] + [2 ** x for x in range(11)])
+        self.assertEqual(parsesizes('0:1:2'), [0, 1])
+
+        for spec in ['', '1:2', '0:10:1', '0:0:2', '10:1:2', '-1:10:2', 'a,b', '-1']:
+            self.assertErrorRegex(ValueError, 'nvalid messagesize', parsesizes, spec)
+
+    def test_hwlocmapcached(self):
+        """Test the hwlocmap cache"""
+        hmap = {0: 'socket 0 core 0 abscore 0 numa 0', 1: 'socket 0 core 1 abscore 1 numa 0'}
+        cachedir = tempfile.mkdtemp()
+        tools = 'vsc.mympingpong.tools'
+
+        with patch(tools + '._topologymap', return_value=('hwloc', hmap)) as h_m:
+            with patch(tools + '.bootid', return_value='boot1'):
+                self.assertEqual(vsc.mympingpong.tools.hwlocmapcached(cachedir, backend='hwloc'), hmap)
+                self.assertEqual(h_m.call_count, 1)
+                # the cache is used, with the same (integer) keys
+                self.assertEqual(vsc.mympingpong.tools.hwlocmapcached(cachedir, backend='hwloc'), hmap)
+                self.assertEqual(h_m.call_count, 1)
+                # auto uses the hwloc cache when hwloc-ls is installed
+                with patch(tools + '._which', return_value='/usr/bin/hwloc-ls'):
+                    self.assertEqual(vsc.mympingpong.tools.hwlocmapcached(cachedir), hmap)
+                    self.assertEqual(h_m.call_count, 1)
+                # the hwloc map is not used for sysfs
+                h_m.return_value = ('sysfs', hmap)
+                self.assertEqual(vsc.mympingpong.tools.hwlocmapcached(cachedir, backend='sysfs'), hmap)
+                self.assertEqual(h_m.call_count, 2)
+                # disabled cache
+                with patch(tools + '.topologymap', return_value=hmap) as t_m:
+                    self.assertEqual(vsc.mympingpong.tools.hwlocmapcached(''), hmap)
+                    self.assertEqual(t_m.call_count, 1)
+
+            # after a reboot, the cache is not used
+            with patch(tools + '.bootid', return_value='boot2'):
+                # auto fell back to sysfs: the sysfs map is cached, but auto tries hwloc-ls again
+                with patch(tools + '._which', return_value='/usr/bin/hwloc-ls'):
+                    self.assertEqual(vsc.mympingpong.tools.hwlocmapcached(cachedir), hmap)
+                    self.assertEqual(h_m.call_count, 3)
+                    self.assertEqual(vsc.mympingpong.tools.hwlocmapcached(cachedir), hmap)
+                    self.assertEqual(h_m.call_count, 4)
+                # without hwloc-ls, auto uses the sysfs cache
+                with patch(tools + '._which', return_value=None):
+                    self.assertEqual(vsc.mympingpong.tools.hwlocmapcached(cachedir), hmap)
+                    self.assertEqual(h_m.call_count, 4)
+
+            # an empty map is not cached
+            with patch(tools + '.bootid', return_value='boot3'):
+                h_m.return_value = ('hwloc', {})
+                self.assertEqual(vsc.mympingpong.tools.hwlocmapcached(cachedir, backend='hwloc'), {})
+                h_m.return_value = ('hwloc', hmap)
+                self.assertEqual(vsc.mympingpong.tools.hwlocmapcached(cachedir, backend='hwloc'), hmap)
+                self.assertEqual(h_m.call_count, 6)
+
+            # no boot id, no cache
+            with patch(tools + '.bootid', return_value=None):
+                with patch(tools + '.topologymap', return_value=hmap) as t_m:
+                    vsc.mympingpong.tools.hwlocmapcached(cachedir)
+                    self.assertEqual(t_m.call_count, 1)
+
+        self.assertEqual(sorted(os.listdir(cachedir)), [
+            'mympingpong-hwloc-%s-%s-%s.json' % (socket.gethostname(), boot, backend)
+            for boot, backend in [('boot1', 'hwloc'), ('boot1', 'sysfs'), ('boot2', 'sysfs'), ('boot3', 'hwloc')]
+        ])
+        for fn in os.listdir(cachedir):
+            os.remove(os.path.join(cachedir, fn))
+        os.rmdir(cachedir)
+
+    def make_hwloc_xml(self, packages, numas, cores, threads):
+        """
+        Write a synthetic hwloc xml file with packages -> numas -> L3 cache -> cores -> L2 cache -> threads PUs,
+        PUs numbered sequentially per thread (like hyperthreading on linux)
+
+        Returns the filename and the expected map
+        """
+        nrcores = packages * numas * cores
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<topology>', '<object type="Machine" os_index="0">']
+        gen_map = {}
+        for pk in range(packages):
+            lines.append('<object type="Package" os_index="%s">' % pk)
+            for nm in range(numas):
+                numa = pk * numas + nm
+                lines.append('<object type="NUMANode" os_index="%s"><object type="Cache" depth="3">' % numa)
+                for cr in range(cores):
+                    core = numa * cores + cr
+                    lines.append('<object type="Core" os_index="%s"><object type="Cache" depth="2">' % cr)
+                    for th in range(threads):
+                        pu = th * nrcores + core
+                        lines.append('<object type="PU" os_index="%s"/>' % pu)
+                        gen_map[pu] = "socket %s core %s abscore %s numa %s" % (pk, cr, pu, numa)
+                    lines.append('</object></object>')
+                lines.append('</object></object>')
+            lines.append('</object>')
+        lines.extend(['</object>', '</topology>'])
+
+        (fh, xmlout) = tempfile.mkstemp(prefix="hwloc-xml-", suffix=".xml")
+        os.write(fh, '\n'.join(lines).encode())
+        os.close(fh)
+        return xmlout, gen_map
+
+    def test_parse_hwloc_xml_large(self):
+        """Going to test _parse_hwloc_xml with a synthetic topology of 256 PUs"""
+        xmlout, gen_map = self.make_hwloc_xml(2, 4, 16, 2)
+        hmap = vsc.mympingpong.tools._parse_hwloc_xml(xmlout)
+        os.remove(xmlout)
+        self.assertEqual(len(hmap), 256)
+        self.assertEqual(hmap, gen_map)
+
+    def make_sysfs(self, sysfs, packages, numas, cores, threads, offline=None):
+        """
+        Create a fake sysfs tree with packages -> numas -> cores -> threads PUs (numbered like hwloc on linux),
+        the cpus in offline have no topology
+
+        Returns the expected map
+        """
+        nrcores = packages * numas * cores
+        cpulists = {}
+        gen_map = {}
+        for pu in range(nrcores * threads):
+            core = pu % nrcores
+            numa = core // cores
+            cpudir = os.path.join(sysfs, 'devices', 'system', 'cpu', 'cpu%s' % pu)
+            if pu in (offline or []):
+                os.makedirs(cpudir)
+                continue
+            os.makedirs(os.path.join(cpudir, 'topology'))
+            for name, value in [('physical_package_id', numa // numas), ('core_id', core % cores)]:
+                with open(os.path.join(cpudir, 'topology', name), 'w') as fh:
+                    fh.write('%s\n' % value)
+            cpulists.setdefault(numa, []).append(pu)
+            gen_map[pu] = "socket %s core %s abscore %s numa %s" % (numa // numas, core % cores, pu, numa)
+
+        for numa, pus in cpulists.items():
+            nodedir = os.path.join(sysfs, 'devices', 'system', 'node', 'node%s' % numa)
+            os.makedirs(nodedir)
+            with open(os.path.join(nodedir, 'cpulist'), 'w') as fh:
+                fh.write(','.join(['%s-%s' % (pu, pu) for pu in pus]) + '\n')
+        return gen_map
+
+    def test_sysfsmap(self):
+        """Test sysfsmap on a fake sysfs tree"""
+        sysfs = tempfile.mkdtemp()
+        gen_map = self.make_sysfs(sysfs, 2, 2, 4, 2, offline=[5])
+        hmap = vsc.mympingpong.tools.sysfsmap(sysfs)
+        self.assertEqual(len(hmap), 31)
+        self.assertEqual(hmap, gen_map)
+        shutil.rmtree(sysfs)
+
+        self.assertEqual(vsc.mympingpong.tools._parse_cpulist('0-3,8,10-11'), [0, 1, 2, 3, 8, 10, 11])
+
+    def test_sysfsmap_hwloc(self):
+        """Test that sysfsmap gives the same map as the hwloc xml of the same (synthetic) topology"""
+        sysfs = tempfile.mkdtemp()
+        gen_map = self.make_sysfs(sysfs, 2, 4, 16, 2)
+        xmlout, hwloc_map = self.make_hwloc_xml(2, 4, 16, 2)
+        self.assertEqual(vsc.mympingpong.tools.sysfsmap(sysfs), vsc.mympingpong.tools._parse_hwloc_xml(xmlout))
+        self.assertEqual(gen_map, hwloc_map)
+        os.remove(xmlout)
+        shutil.rmtree(sysfs)
+
+    def test_topologymap(self):
+        """Test the selection of the topology backend"""
+        tools = 'vsc.mympingpong.tools'
+        with patch(tools + '.hwlocmap', return_value={0: 'hwloc'}) as h_m:
+            with patch(tools + '.sysfsmap', return_value={0: 'sysfs'}) as s_m:
+                self.assertEqual(vsc.mympingpong.tools.topologymap('hwloc'), {0: 'hwloc'})
+                self.assertEqual(vsc.mympingpong.tools.topologymap('sysfs'), {0: 'sysfs'})
+
+                with patch(tools + '._which', return_value='/usr/bin/hwloc-ls'):
+                    self.assertEqual(vsc.mympingpong.tools.topologymap(timeout=5), {0: 'hwloc'})
+                    h_m.assert_called_with(timeout=5)
+                    # hwloc-ls failed or was too slow
+                    h_m.return_value = None
+                    self.assertEqual(vsc.mympingpong.tools.topologymap(), {0: 'sysfs'})
+
+                # no hwloc-ls
+                with patch(tools + '._which', return_value=None):
+                    calls = h_m.call_count
+                    self.assertEqual(vsc.mympingpong.tools.topologymap(), {0: 'sysfs'})
+                    self.assertEqual(h_m.call_count, calls)
+
+        self.assertErrorRegex(ValueError, 'Unknown topology backend', vsc.mympingpong.tools.topologymap, 'nosuch')
@@ -0,0 +1,90 @@
+#
+# Copyright 2017-2017 Ghent University
+#
+# This file is part of mympingpong,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/mympingpong
+#
+# mympingpong is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation v2.
+#
+# mympingpong is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mympingpong.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tests for the topology of the ranks
+"""
+from vsc.install.testing import TestCase
+from vsc.mympingpong.topology import DISTANCES, UNKNOWN, Topology, formathwloc, parsehwloc
+
+
+def topomap(nodes, sockets, numas, cores):
+    """
+    a cpumap of ranks on nodes with sockets, numas NUMA nodes per socket and cores per NUMA node,
+    every rank has the processor name, a core and a hwloc property (like MyPingPong.makecpumap)
+    """
+    res = []
+    percore = sockets * numas * cores
+    for rank in range(nodes * percore):
+        local = rank % percore
+        socket, numa, core = local // (numas * cores), local // cores, local
+        res.append(['node%s' % (rank // percore), 'core_%s' % core,
+                    'hwloc_socket %s core %s abscore %s numa %s' % (socket, core, core, numa)])
+    return res
+
+
+class TopologyTest(TestCase):
+    """Test the topology"""
+
+    def test_parsehwloc(self):
+        """Test parsing of the hwloc properties"""
+        self.assertEqual(parsehwloc('socket 1 core 3 abscore 11 numa 2'), (1, 3, 11, 2))
+        self.assertEqual(parsehwloc('socket 0 core 3 abscore 3 numa None'), (0, 3, 3, -1))
+        self.assertEqual(parsehwloc('None'), (-1, -1, -1, -1))
+        self.assertEqual(parsehwloc(None), (-1, -1, -1, -1))
+
+        for prop in ['socket 1 core 3 abscore 11 numa 2', 'socket 0 core 3 abscore 3 numa None']:
+            self.assertEqual(formathwloc(*parsehwloc(prop)), prop)
+
+    def test_distance(self):
+        """Test the distance classes"""
+        topo = Topology.fromcpumap(topomap(2, 2, 2, 2))
+        self.assertEqual(topo.node.tolist(), [0] * 8 + [1] * 8)
+        # the sockets and numa nodes are different on every node
+        self.assertEqual(len(set(topo.socket)), 4)
+        self.assertEqual(len(set(topo.numa)), 8)
+
+        dist = topo.distance([0, 0, 0, 0, 0, 0], [1, 2, 4, 8, 0, -1])
+        expected = [DISTANCES.index(name) for name in ['numa', 'socket', 'node', 'remote', 'numa']] + [UNKNOWN]
+        self.assertEqual(dist.tolist(), expected)
+
+        self.assertEqual(topo.group([0, 3, 9], DISTANCES.index('numa')).tolist(), topo.numa[[0, 3, 9]].tolist())
+        self.assertEqual(topo.group([0, 3, 9], DISTANCES.index('remote')).tolist(), [0, 0, 0])
+
+    def test_heterogeneous(self):
+        """Test nodes with different hardware and missing hwloc info"""
+        cpumap = [
+            ['node0', 'core_0', 'hwloc_socket 0 core 0 abscore 0 numa 0'],
+            ['node0', 'core_1', 'hwloc_socket 1 core 1 abscore 1 numa 1'],
+            # a single socket node with 2 numa nodes
+            ['node1', 'core_0', 'hwloc_socket 0 core 0 abscore 0 numa 0'],
+            ['node1', 'core_1', 'hwloc_socket 0 core 1 abscore 1 numa 1'],
+            # no hwloc info
+            ['node2', 'core_0', 'hwloc_None'],
+            ['node2', 'core_1', 'hwloc_None'],
+        ]
+        topo = Topology.fromcpumap(cpumap)
+        dist = topo.distance([0, 2, 4, 4], [1, 3, 5, 0])
+        self.assertEqual(dist.tolist(), [DISTANCES.index('node'), DISTANCES.index('socket'),
+                                         UNKNOWN, DISTANCES.index('remote')])